@@ -50,8 +50,12 @@ setup(
     package_dir={'': 'src'},
     install_requires=[
         'sos>=0.21.13',
+        'fasteners',
     ],
     entry_points='''
+[console_scripts]
+sos-pbs = sos_pbs.__main__:main
+
 [sos_taskengines]
 pbs = sos_pbs.task_engine:PBS_TaskEngine
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import argparse
+import sys
+
+
+def get_compact_parser(subparsers):
+    parser = subparsers.add_parser(
+        'compact',
+        help='''Remove job scripts and job id files of tasks that have
+            completed, failed, or been aborted for longer than a retention
+            period, locally and on the execution host of a PBS queue.''')
+    parser.add_argument('queue', help='''A PBS queue defined in configuration files''')
+    parser.add_argument(
+        '--age',
+        help='''Retention period such as 30d (default) or 12h, overriding
+            option job_file_retention of the queue''')
+    parser.add_argument(
+        '-c',
+        dest='config',
+        help='''A configuration file with host definitions''')
+    parser.set_defaults(func=cmd_compact)
+
+
+def cmd_compact(args):
+    from sos.hosts import Host
+    from sos.utils import load_config_files
+
+    load_config_files(args.config)
+    host = Host(args.queue, start_engine=False)
+    engine = host._task_engine
+    if not hasattr(engine, 'compact_job_files'):
+        sys.exit(f'Queue {args.queue} is not a PBS queue.')
+    n_local, n_remote = engine.compact_job_files(args.age)
+    print(
+        f'Removed job files of {n_local} tasks locally and {n_remote} tasks on {args.queue}.'
+    )
+
+
+def _get_engine(args, start_engine):
+    from sos.hosts import Host
+    from sos.utils import load_config_files
+
+    load_config_files(args.config)
+    engine = Host(args.queue, start_engine=start_engine)._task_engine
+    if not hasattr(engine, 'iter_kill_tasks'):
+        sys.exit(f'Queue {args.queue} is not a PBS queue.')
+    return engine
+
+
+def get_kill_parser(subparsers):
+    parser = subparsers.add_parser(
+        'kill',
+        help='''Kill tasks and cancel their jobs on a PBS queue, printing
+            task id, status, job id, and output of kill_cmd of each task as
+            soon as its batch is processed.''')
+    parser.add_argument('queue', help='''A PBS queue defined in configuration files''')
+    parser.add_argument('tasks', nargs='+', help='''IDs of tasks''')
+    parser.add_argument(
+        '-c',
+        dest='config',
+        help='''A configuration file with host definitions''')
+    parser.set_defaults(func=cmd_kill)
+
+
+def cmd_kill(args):
+    engine = _get_engine(args, start_engine=True)
+    for record in engine.iter_kill_tasks(args.tasks):
+        response = (record.response or '').replace('\n', ' ')
+        print(f'{record.task_id}\t{record.status}\t{record.job_id or ""}\t{response}', flush=True)
+
+
+def get_status_parser(subparsers):
+    parser = subparsers.add_parser(
+        'status',
+        help='''Print task id, status, job id, and state of the job in the
+            scheduler of tasks on a PBS queue, batch by batch.''')
+    parser.add_argument('queue', help='''A PBS queue defined in configuration files''')
+    parser.add_argument('tasks', nargs='*', help='''IDs of tasks, default to all tasks''')
+    parser.add_argument(
+        '-c',
+        dest='config',
+        help='''A configuration file with host definitions''')
+    parser.set_defaults(func=cmd_status)
+
+
+def cmd_status(args):
+    engine = _get_engine(args, start_engine=True)
+    for record in engine.iter_query_tasks(args.tasks):
+        state = record.response.state if record.response is not None else ''
+        print(f'{record.task_id}\t{record.status}\t{record.job_id or ""}\t{state}', flush=True)
+
+
+def get_report_parser(subparsers):
+    parser = subparsers.add_parser(
+        'report',
+        help='''Summarize the history of jobs submitted to PBS queues, with
+            number of submitted jobs, submissions per hour, failure rate,
+            median and 90th percentile of queue wait and run time, and
+            median percentage of requested walltime and memory that were
+            used, per queue and step.''')
+    parser.add_argument(
+        '--by',
+        nargs='+',
+        choices=['queue', 'step', 'kind'],
+        default=['queue', 'step'],
+        help='''Columns by which jobs are grouped, default to queue and step''')
+    parser.add_argument('--queue', help='''Only report jobs of this queue''')
+    parser.add_argument(
+        '--history-dir',
+        default='~/.sos/pbs_history',
+        help='''Directory of the job history, default to ~/.sos/pbs_history''')
+    parser.set_defaults(func=cmd_report)
+
+
+def _format(value, fmt='.0f'):
+    return '-' if value is None else format(value, fmt)
+
+
+def cmd_report(args):
+    from .job_history import iter_records, summarize
+
+    records = iter_records(args.history_dir)
+    if args.queue:
+        records = (x for x in records if x['queue'] == args.queue)
+    summary = summarize(records, args.by)
+    if not summary:
+        sys.exit(f'No job history found in {args.history_dir}.')
+    print('\t'.join(args.by + [
+        'submitted', 'jobs/h', 'ended', 'failed', 'wait_p50', 'wait_p90',
+        'run_p50', 'run_p90', 'walltime%', 'mem%'
+    ]))
+    for group, res in summary.items():
+        print('\t'.join(
+            [x or '-' for x in group] +
+            [str(res['submitted']),
+             _format(res['throughput'], '.1f'),
+             str(res['ended']),
+             _format(res['failure_rate'], '.1%')] +
+            [_format(res[x]) for x in ('wait_p50', 'wait_p90', 'run_p50', 'run_p90',
+                                       'walltime_used_p50', 'mem_used_p50')]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        'sos-pbs', description='Maintenance commands of sos-pbs')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    get_compact_parser(subparsers)
+    get_kill_parser(subparsers)
+    get_status_parser(subparsers)
+    get_report_parser(subparsers)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import datetime
+import re
+import threading
+import time
+
+from sos.utils import env, expand_time, format_HHMMSS
+
+
+def parse_showbf(output):
+    '''Return a list of (tasks, nodes, seconds) of backfill windows that are
+    available now from the output of showbf of Moab/Maui.'''
+    windows = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 5 or not fields[1].isdigit() or not fields[2].isdigit():
+            continue
+        # windows that start later are of no use to jobs submitted now
+        if fields[4].strip('-') not in ('00:00:00', '0:00:00'):
+            continue
+        duration = fields[3]
+        # [[DD:]HH:]MM:SS or INFINITY
+        seconds = float('inf') if duration.upper() == 'INFINITY' else sum(
+            int(x) * y for x, y in zip(
+                reversed(re.split('[:-]', duration)), (1, 60, 3600, 86400)))
+        windows.append((int(fields[1]), int(fields[2]), seconds))
+    return windows
+
+
+class BackfillShaper(object):
+    '''Reduce the walltime of tasks to fit backfill windows of the scheduler
+    if the runtimes of earlier tasks of the same step say that the task will
+    finish in time.
+
+    The requested walltime is reduced only to the duration of a window that
+    is open now, has enough nodes and cores, and is at least backfill_margin
+    (default 1.5) times the estimated runtime of the task. Walltime requested
+    by a task itself is only reduced if the task allows it with the runtime
+    option backfill=True. Windows are listed
+    with showbf (backfill_cmd), or probed with sbatch --test-only for Slurm,
+    and are cached for backfill_cache_ttl (default 60) seconds.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.agent = engine.agent
+        config = engine.config
+        self.margin = float(config.get('backfill_margin', 1.5))
+        self.ttl = expand_time(config.get('backfill_cache_ttl', 60))
+        self.probe = getattr(engine.scheduler, 'name',
+                             None) == 'slurm' and 'backfill_cmd' not in config
+        self.cmd = config.get('backfill_cmd', 'showbf')
+        # cached windows, or results of probes by (queue, nodes, cores, seconds)
+        self._windows = None
+        self._windows_time = 0
+        self._probes = {}
+        self._lock = threading.Lock()
+
+    def windows(self):
+        with self._lock:
+            if self._windows is None or time.time(
+            ) - self._windows_time > self.ttl:
+                try:
+                    self._windows = parse_showbf(
+                        self.agent.check_output(self.cmd))
+                except Exception as e:
+                    env.logger.debug(
+                        f'Failed to get backfill windows with {self.cmd}: {e}')
+                    self._windows = []
+                self._windows_time = time.time()
+            return self._windows
+
+    def _probe(self, queue, nodes, cores, seconds):
+        # ask Slurm when a job of this size would start
+        key = (queue, nodes, cores, seconds)
+        with self._lock:
+            if key in self._probes and time.time(
+            ) - self._probes[key][0] <= self.ttl:
+                return self._probes[key][1]
+        cmd = f'sbatch --test-only -N {nodes} -n {cores} -t {max(int(seconds // 60), 1)}'
+        if queue:
+            cmd += f' -p {queue}'
+        try:
+            # sbatch: Job 123 to start at 2021-01-01T10:00:00 using ...
+            output = self.agent.check_output(cmd + ' --wrap true 2>&1')
+            start = re.search(r'to start at (\S+)', output).group(1)
+            fits = datetime.datetime.strptime(
+                start, '%Y-%m-%dT%H:%M:%S').timestamp() <= time.time() + 60
+        except Exception as e:
+            env.logger.debug(f'Failed to probe backfill window with {cmd}: {e}')
+            fits = False
+        with self._lock:
+            self._probes[key] = (time.time(), fits)
+        return fits
+
+    def shape(self, runtime, estimate):
+        '''Return a reduced walltime for runtime, or None if the walltime
+        should not be changed.'''
+        if estimate is None or 'walltime' not in runtime:
+            return None
+        requested = expand_time(runtime['walltime'])
+        needed = estimate * self.margin
+        if needed >= requested:
+            return None
+        nodes = int(runtime.get('nodes', 1))
+        cores = int(runtime.get('cores', 1))
+        if self.probe:
+            # prefer a walltime with more room for the task if it fits
+            for seconds in sorted({int(needed), int((needed + requested) / 2)},
+                                  reverse=True):
+                if self._probe(runtime.get('queue'), nodes, cores, seconds):
+                    return format_HHMMSS(seconds)
+            return None
+        candidates = [
+            seconds for tasks, n, seconds in self.windows()
+            if n >= nodes and tasks >= nodes * cores and needed <= seconds < requested
+        ]
+        if not candidates:
+            return None
+        return format_HHMMSS(int(max(candidates)))
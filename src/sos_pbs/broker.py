@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import fasteners
+from sos.utils import env
+
+from .schedulers import ACTIVE_STATES
+from .status_cache import SchedulerStatusCache
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SubmissionBroker(object):
+    '''Share the job limit of an account on a host between all sos sessions
+    of the user on this machine.
+
+    Sessions register the number of tasks they are waiting to submit in a
+    ledger in ~/.sos/pbs_broker/{host}-{user}[-{account}].json, and the
+    engine submits no more jobs than the quota of its session, which is the
+    number of jobs that the session has in flight plus the slots granted to
+    it. Slots are granted while fewer than fair_share_limit jobs are in
+    flight, one at a time by weighted fair queuing: each slot advances the
+    virtual finish time of a session by 1/fair_share_weight, and the waiting
+    session with the smallest finish time gets the next slot. Sessions that
+    have had at most fair_share_small tasks waiting since they were last
+    idle, or run interactively, are served before all others and can use the
+    last fair_share_reserve slots. Whichever session updates the ledger
+    grants slots to all waiting sessions, so there is no broker process to
+    start or to die, and no session ever waits for the ledger to change.
+
+    A slot is released when the end of its task is recorded, when the job
+    table of the scheduler no longer lists its job, or when the session has
+    exited and its job cannot be found in the job table.'''
+
+    def __init__(self, engine, broker_dir='~/.sos/pbs_broker'):
+        self.engine = engine
+        config = engine.config
+        self.limit = int(config['fair_share_limit'])
+        self.weight = float(config.get('fair_share_weight', 1))
+        if self.limit <= 0 or self.weight <= 0:
+            raise ValueError(
+                f'fair_share_limit and fair_share_weight of queue {engine.alias} should be positive'
+            )
+        self.small = int(config.get('fair_share_small', 10))
+        self.reserve = int(
+            config.get('fair_share_reserve', min(self.limit // 20, self.small)))
+        self.poll = float(config.get('fair_share_poll', 0.5))
+        broker_dir = os.path.expanduser(broker_dir)
+        os.makedirs(broker_dir, exist_ok=True)
+        key = SchedulerStatusCache.cache_key(config)
+        if config.get('fair_share_account', None):
+            key += '-' + re.sub(r'[^\w.-]', '_',
+                                str(config['fair_share_account']))
+        self.ledger_file = os.path.join(broker_dir, key + '.json')
+        self._lock = fasteners.InterProcessLock(
+            os.path.join(broker_dir, key + '.lock'))
+        self._thread_lock = threading.Lock()
+        self.session = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        # tasks granted to this session, job ids of submitted tasks that are
+        # written to the ledger with the next update, the most tasks waiting
+        # since the session was last idle, and the quota of the session as of
+        # the last update
+        self._tasks = set()
+        self._job_ids = {}
+        self._peak = 0
+        self._quota = 0
+        self._polled = 0
+
+    def _load(self):
+        try:
+            with open(self.ledger_file) as ledger:
+                return json.load(ledger)
+        except (FileNotFoundError, ValueError):
+            return {'vtime': 0, 'sessions': {}, 'jobs': {}}
+
+    def _update(self, func):
+        # apply func to the ledger and grant free slots to waiting sessions
+        with self._thread_lock, self._lock:
+            state = self._load()
+            self._prune(state)
+            job_ids, self._job_ids = self._job_ids, {}
+            for task_id, job_id in job_ids.items():
+                if task_id in state['jobs']:
+                    state['jobs'][task_id].update(job_id=job_id,
+                                                  time=time.time())
+            self._dispatch(state)
+            result = func(state)
+            self._dispatch(state)
+            session = state['sessions'].get(self.session)
+            self._quota = sum(
+                1 for x in state['jobs'].values()
+                if x['session'] == self.session) + (session or {}).get('ready', 0)
+            self._polled = time.time()
+            tmp_file = f'{self.ledger_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as ledger:
+                json.dump(state, ledger)
+            os.replace(tmp_file, self.ledger_file)
+            return result
+
+    def _prune(self, state):
+        dead = {
+            sid for sid, session in state['sessions'].items()
+            if not _is_alive(session['pid'])
+        }
+        for sid in dead:
+            state['sessions'].pop(sid)
+        cache = self.engine._status_cache
+        snapshot = None if cache is None else cache.snapshot()
+        for task_id, job in list(state['jobs'].items()):
+            if snapshot is not None and job['job_id'] is not None:
+                # jobs submitted well before the snapshot should be listed
+                record = snapshot['jobs'].get(job['job_id'])
+                if (record is not None and record.state in ACTIVE_STATES
+                   ) or job['time'] >= snapshot['time'] - cache.interval:
+                    continue
+                state['jobs'].pop(task_id)
+            elif job['session'] not in state['sessions']:
+                state['jobs'].pop(task_id)
+
+    def _dispatch(self, state):
+        sessions = state['sessions']
+        free = self.limit - len(state['jobs']) - sum(
+            x['ready'] for x in sessions.values())
+        while free > 0:
+            waiting = [
+                x for x in sessions.values() if x['want'] > x['ready'] and
+                (x['priority'] or free > self.reserve)
+            ]
+            if not waiting:
+                break
+            session = min(
+                waiting,
+                key=lambda x: (not x['priority'], x['finish'] + 1 / x['weight']))
+            state['vtime'] = session['finish']
+            session['finish'] += 1 / session['weight']
+            session['ready'] += 1
+            free -= 1
+
+    def _session(self, state):
+        return state['sessions'].setdefault(self.session, {
+            'pid': os.getpid(),
+            'want': 0,
+            'ready': 0,
+            'finish': state['vtime'],
+            'weight': self.weight,
+            'priority': False,
+        })
+
+    def _register(self, state, waiting):
+        self._peak = max(self._peak, waiting) if waiting else 0
+        priority = self._peak <= self.small or env.config.get(
+            'run_mode', 'run') == 'interactive'
+        session = self._session(state)
+        if session['want'] == 0:
+            # sessions that were idle do not get slots for the time they
+            # have not been waiting
+            session['finish'] = max(session['finish'], state['vtime'])
+        session.update(weight=self.weight, priority=priority, want=waiting)
+        session['ready'] = min(session['ready'], waiting)
+
+    def _take(self, state, task_ids):
+        # record jobs of tasks that are being submitted, which use the slots
+        # granted to the session, and return the number of granted slots used
+        session = self._session(state)
+        for task_id in task_ids:
+            state['jobs'][task_id] = {
+                'session': self.session,
+                'job_id': None,
+                'time': time.time(),
+            }
+        granted = min(session['ready'], len(task_ids))
+        session['ready'] -= granted
+        session['want'] = max(session['want'] - len(task_ids), 0)
+        self._tasks.update(task_ids)
+        return granted
+
+    def _finish(self, state, task_ids):
+        # release slots of tasks that were not submitted
+        for task_id in task_ids:
+            job = state['jobs'].get(task_id)
+            if job is not None and job['session'] == self.session and job['job_id'] is None:
+                state['jobs'].pop(task_id)
+                self._tasks.discard(task_id)
+
+    def quota(self, waiting):
+        '''Return the number of jobs that this session can have in flight,
+        given the number of tasks it is waiting to submit. The ledger is read
+        at most once every fair_share_poll seconds, and never waited for.'''
+        if time.time() - self._polled >= self.poll:
+            try:
+                self._update(lambda state: self._register(state, waiting))
+            except Exception as e:
+                env.logger.debug(f'Failed to update fair share ledger: {e}')
+        return self._quota
+
+    def take(self, task_ids):
+        '''Record that task_ids are being submitted.'''
+        self._update(lambda state: self._take(state, task_ids))
+
+    def finish(self, task_ids):
+        '''Release the slots of task_ids that have not been submitted.'''
+        self._update(lambda state: self._finish(state, task_ids))
+
+    def submitted(self, task_id, job_id):
+        if task_id in self._tasks:
+            self._job_ids[task_id] = job_id
+
+    def release(self, task_id):
+        if task_id not in self._tasks:
+            return
+        self._tasks.discard(task_id)
+        self._job_ids.pop(task_id, None)
+        try:
+            self._update(lambda state: state['jobs'].pop(task_id, None))
+        except Exception as e:
+            env.logger.debug(f'Failed to release slot of {task_id}: {e}')
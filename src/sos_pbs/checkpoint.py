@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# Tasks with runtime option checkpoint=True and a walltime longer than
+# checkpoint_segment are run as a chain of jobs with the same task id, each
+# with a walltime of checkpoint_segment. Other tasks are not signalled.
+# checkpoint_warning (default 10m) before the end of a segment, the job
+# sends checkpoint_signal (default USR1) to the process group of the task,
+# which can trap it to write a checkpoint and exit, and leaves a marker file
+# with the number of the segment. The engine then submits the next segment,
+# and the task resumes from its checkpoint. The signal can also be sent by
+# the scheduler with {checkpoint_directive} in task_template.
+#
+# Tasks killed by the signal can stay running in sos status, so continuation
+# jobs of such tasks are only submitted after the job table of the scheduler
+# (status_table_cmd or scheduler) says that the job has ended.
+
+import threading
+import time
+
+from sos.utils import env, expand_time
+
+# markers of signalled segments, on storage shared by the head and compute
+# nodes. Commands are interpolated again with task_template so they cannot
+# contain braces.
+CHECKPOINT_DIR = '$HOME/.sos/checkpoints'
+
+
+def checkpoint_command(task_id, command, segment, seconds, signal):
+    '''Run command in the background and send signal to its process group
+    after seconds, or when the job receives signal from the scheduler.'''
+    return '\n'.join([
+        f'mkdir -p {CHECKPOINT_DIR}',
+        'set -m',
+        f'{command} &',
+        'SOS_TASK_PID=$!',
+        f"trap 'echo {segment} > {CHECKPOINT_DIR}/{task_id}; kill -{signal} -- -$SOS_TASK_PID 2>/dev/null' {signal}",
+        f'(sleep {int(seconds)}; kill -{signal} $$) &',
+        'SOS_TIMER_PID=$!',
+        # wait is interrupted by the trapped signal, and returns the saved
+        # exit code of the task once it has exited
+        'wait $SOS_TASK_PID',
+        'while kill -0 $SOS_TASK_PID 2>/dev/null; do wait $SOS_TASK_PID; done',
+        'wait $SOS_TASK_PID',
+        'SOS_STATUS=$?',
+        'kill $SOS_TIMER_PID 2>/dev/null',
+        'exit $SOS_STATUS',
+    ])
+
+
+def checkpoint_directive(scheduler, signal, seconds):
+    # directive that asks the scheduler to signal the job before walltime
+    if scheduler == 'slurm':
+        return f'#SBATCH --signal=B:{signal}@{int(seconds)}'
+    if scheduler == 'torque':
+        return f'#PBS -l signal={signal}@{int(seconds)}'
+    if scheduler == 'lsf':
+        return f'#BSUB -wa {signal} -wt {max(int(seconds // 60), 1)}'
+    return ''
+
+
+class CheckpointMonitor(object):
+    '''Read the markers of signalled segments with a single command, at most
+    once every checkpoint_check_interval (default 60) seconds.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.agent = engine.agent
+        config = engine.config
+        self.segment = expand_time(config['checkpoint_segment'])
+        self.warning = expand_time(config.get('checkpoint_warning', '10m'))
+        self.signal = config.get('checkpoint_signal', 'USR1')
+        self.interval = expand_time(config.get('checkpoint_check_interval', 60))
+        self._markers = {}
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def markers(self):
+        '''Return a dictionary of task ids and the last signalled segments.'''
+        with self._lock:
+            if time.time() - self._checked < self.interval:
+                return self._markers
+            self._checked = time.time()
+            try:
+                output = self.agent.check_output(
+                    f'grep -s . {CHECKPOINT_DIR}/t*; true')
+                self._markers = {}
+                for line in output.splitlines():
+                    path, _, segment = line.rpartition(':')
+                    self._markers[path.rsplit('/', 1)[-1]] = int(segment)
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to check checkpoints on {self.engine.alias}: {e}')
+            return self._markers
+
+    def clear(self, task_id):
+        with self._lock:
+            self._markers.pop(task_id, None)
+        try:
+            self.agent.check_output(f'rm -f {CHECKPOINT_DIR}/{task_id}')
+        except Exception as e:
+            env.logger.debug(
+                f'Failed to remove checkpoint marker of {task_id}: {e}')
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import threading
+import time
+
+from sos.utils import env, expand_time
+
+# only job files of tasks in these states are removed. Tasks whose task
+# files have been purged are reported missing, and their job files are
+# removed once they are older than the retention period.
+TERMINAL_STATUSES = ('completed', 'failed', 'aborted', 'missing')
+# number of tasks handled by a single status query or rm command, which
+# keeps the command line well below the limit of a single argument of bash -c
+CHUNK_SIZE = 1000
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = sorted(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class JobFileCompactor(object):
+    '''Remove job scripts and job id files of tasks that have been in a
+    terminal state for longer than a retention period, from the local spool
+    and from ~/.sos/tasks of the execution host.'''
+
+    def __init__(self, engine, retention):
+        self.engine = engine
+        self.agent = engine.agent
+        self.spool = engine.spool
+        self.retention = expand_time(retention, default_unit='d')
+
+    def local_candidates(self, cutoff):
+        # task_id => list of job files older than cutoff
+        candidates = {}
+        dirs = [self.spool.root] + self.spool.legacy_dirs[1:]
+        while dirs:
+            try:
+                entries = list(os.scandir(dirs.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path.startswith(self.spool.root):
+                        dirs.append(entry.path)
+                    continue
+                task_id, ext = os.path.splitext(entry.name)
+                if ext not in ('.sh', '.job_id'):
+                    continue
+                try:
+                    if entry.stat().st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                candidates.setdefault(task_id, []).append(entry.path)
+        return candidates
+
+    def remote_candidates(self, cutoff):
+        # list job files on the execution host in one command
+        minutes = max(int((time.time() - cutoff) / 60), 1)
+        cmd = (r'find ~/.sos/tasks -maxdepth 1 -type f '
+               r'\( -name "t*.sh" -o -name "t*.job_id" \) '
+               f'-mmin +{minutes}')
+        try:
+            output = self.agent.check_output(cmd)
+        except Exception as e:
+            env.logger.debug(
+                f'Failed to list job files on {self.engine.alias}: {e}')
+            return set()
+        return {
+            os.path.splitext(os.path.basename(x.strip()))[0]
+            for x in output.splitlines()
+            if x.strip()
+        }
+
+    def terminal_tasks(self, task_ids, cutoff):
+        # tasks that ended before cutoff, out of tasks with job files older
+        # than cutoff. sos status is run directly instead of
+        # engine.query_tasks, which resubmits jobs and records their ends
+        terminal = set()
+        sos = self.agent.config.get('sos', 'sos')
+        for chunk in _chunks(task_ids):
+            try:
+                output = self.agent.check_output(
+                    f'{sos} status {" ".join(chunk)} -v 3 --numeric-times')
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to check status of tasks on {self.engine.alias}: {e}'
+                )
+                continue
+            for line in output.splitlines():
+                fields = [x.strip() for x in line.split('\t')]
+                if len(fields) != 6 or fields[5] not in TERMINAL_STATUSES:
+                    continue
+                # missing tasks have no times, and their job files are old
+                if fields[5] == 'missing':
+                    terminal.add(fields[0])
+                    continue
+                # tasks that never started ended when they were created
+                created, start, duration = (
+                    float(x) if x else None for x in fields[2:5])
+                end = start + (duration or 0) if start else created
+                if end is not None and end <= cutoff:
+                    terminal.add(fields[0])
+        return terminal
+
+    def compact(self):
+        '''Remove stale job files and return the number of tasks whose
+        files are removed locally and on the execution host.'''
+        cutoff = time.time() - self.retention
+        local = self.local_candidates(cutoff)
+        remote = self.remote_candidates(cutoff)
+        terminal = self.terminal_tasks(set(local) | remote, cutoff)
+        #
+        n_local = 0
+        for task_id in terminal & set(local):
+            for filename in local[task_id]:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+            n_local += 1
+        #
+        n_remote = 0
+        for chunk in _chunks(terminal & remote):
+            cmd = 'cd ~/.sos/tasks && rm -f ' + ' '.join(
+                f'{x}.sh {x}.job_id' for x in chunk)
+            try:
+                self.agent.check_output(cmd)
+                n_remote += len(chunk)
+            except Exception as e:
+                env.logger.warning(
+                    f'Failed to remove job files on {self.engine.alias}: {e}'
+                )
+        env.log_to_file(
+            'TASK',
+            f'Removed job files of {n_local} local and {n_remote} remote tasks from {self.engine.alias}'
+        )
+        return n_local, n_remote
+
+    def start(self, interval):
+        '''Compact job files in a background thread every interval.'''
+        interval = expand_time(interval, default_unit='d')
+
+        def compact_periodically():
+            self.engine.engine_ready.wait()
+            while True:
+                try:
+                    self.compact()
+                except Exception as e:
+                    env.logger.warning(
+                        f'Failed to remove stale job files of {self.engine.alias}: {e}'
+                    )
+                time.sleep(interval)
+
+        thread = threading.Thread(target=compact_periodically, daemon=True)
+        thread.start()
+        return thread
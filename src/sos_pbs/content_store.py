@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import fasteners
+
+from .status_cache import SchedulerStatusCache
+
+
+class ContentStore(object):
+    '''Content-addressed store of files under ~/.sos/workflows/blobs of a
+    host, where each file is saved as {sha256}{ext}. Hashes of files that
+    the host already has are kept in a local manifest in
+    ~/.sos/pbs_manifests/{host}-{user}.json so that each distinct file is
+    sent only once. The manifest has to be removed if blobs are removed
+    from the host.'''
+
+    blob_dir = 'workflows/blobs'
+
+    def __init__(self, agent, manifest_dir='~/.sos/pbs_manifests'):
+        self.agent = agent
+        manifest_dir = os.path.expanduser(manifest_dir)
+        os.makedirs(manifest_dir, exist_ok=True)
+        key = SchedulerStatusCache.cache_key(agent.config)
+        self.manifest_file = os.path.join(manifest_dir, key + '.json')
+        self._lock = fasteners.InterProcessLock(
+            os.path.join(manifest_dir, key + '.lock'))
+        self._thread_lock = threading.Lock()
+        self._hashes = None
+        self.local_dir = os.path.join(
+            os.path.expanduser('~'), '.sos', *self.blob_dir.split('/'))
+
+    def _load(self):
+        try:
+            with open(self.manifest_file) as manifest:
+                return set(json.load(manifest))
+        except (FileNotFoundError, ValueError):
+            return set()
+
+    def has(self, name):
+        with self._thread_lock:
+            if self._hashes is None:
+                self._hashes = self._load()
+            return name in self._hashes
+
+    def _add(self, name):
+        # merge with blobs sent by other sessions
+        with self._thread_lock, self._lock:
+            self._hashes = self._load()
+            self._hashes.add(name)
+            tmp_file = f'{self.manifest_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as manifest:
+                json.dump(sorted(self._hashes), manifest)
+            os.replace(tmp_file, self.manifest_file)
+
+    def _put(self, name, write):
+        # write a blob locally with write(path) and send it if needed
+        if not self.has(name):
+            blob = os.path.join(self.local_dir, name)
+            if not os.path.isfile(blob):
+                os.makedirs(self.local_dir, exist_ok=True)
+                tmp_file = f'{blob}.{os.getpid()}'
+                write(tmp_file)
+                os.replace(tmp_file, blob)
+            self.agent.send_job_file(blob, dir=self.blob_dir)
+            self._add(name)
+        return f'~/.sos/{self.blob_dir}/{name}'
+
+    def put_file(self, filename):
+        '''Store a file and return its path on the host.'''
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as content:
+            for block in iter(lambda: content.read(1 << 20), b''):
+                sha.update(block)
+        name = sha.hexdigest() + os.path.splitext(filename)[1]
+        return self._put(name, lambda x: shutil.copyfile(filename, x))
+
+    def put_text(self, text, ext=''):
+        '''Store text and return its path on the host.'''
+        name = hashlib.sha256(text.encode()).hexdigest() + ext
+
+        def write(path):
+            # do not translate newline because scripts are executed under linux
+            with open(path, 'w', newline='') as blob:
+                blob.write(text)
+
+        return self._put(name, write)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import atexit
+import os
+import subprocess
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sos.targets import sos_targets
+from sos.tasks import TaskFile
+from sos.utils import env, expand_size, expand_time
+
+from .job_history import requested_resources
+
+# result of the dry run of a task, with total cores and requested core hours
+# (None if the task has no walltime) of its job, and a list of errors
+DryRunResult = namedtuple('DryRunResult',
+                          ['task_id', 'cores', 'core_hours', 'errors'])
+
+
+def check_limits(resources, config):
+    '''Return a list of errors of requested resources (walltime in seconds,
+    mem in bytes, cores, and nodes) that exceed max_walltime, max_mem,
+    max_cores, and max_nodes of the queue.'''
+    errors = []
+    for key, expand in (('walltime', expand_time), ('mem', expand_size),
+                        ('cores', int), ('nodes', int)):
+        limit = config.get(f'max_{key}', None)
+        if limit is None or resources[key] in ('', None):
+            continue
+        if int(resources[key]) > expand(limit):
+            errors.append(f'{key} {resources[key]} exceeds max_{key} {limit}')
+    return errors
+
+
+class BulkDryRun(object):
+    '''Render job scripts and submit commands of tasks in parallel without
+    running anything on the remote host, check template variables, limits
+    of the queue, and shell syntax of scripts with bash -n, and summarize
+    the jobs that would be submitted.
+
+    Tasks are checked as they are submitted to the engine, so they never
+    reach the host. Valid tasks are completed with their declared outputs
+    and invalid ones failed, and a summary of the tasks is logged once the
+    last submitted task has been checked, or when the process exits if a
+    task is still being checked.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.jobs = int(engine.config.get('dryrun_jobs', os.cpu_count() or 4))
+        self.results = []
+        # number of submitted tasks that are still being checked
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self._lock = threading.Lock()
+        atexit.register(self.report)
+
+    def submit(self, task_id):
+        '''Check task_id in the background and return its status.'''
+        with self._lock:
+            self.engine.task_status[task_id] = 'submitted'
+            self.pending += 1
+            self.engine.task_results[task_id] = self._executor.submit(
+                self._run, task_id)
+        return 'submitted'
+
+    def _run(self, task_id):
+        # result of the task as returned by sos execute
+        result = self.check(task_id)
+        try:
+            output = TaskFile(task_id).params.sos_dict.get('_output', None)
+        except Exception:
+            output = None
+        with self._lock:
+            self.results.append(result)
+            self.engine.task_status[task_id] = 'failed' if result.errors else 'completed'
+            self.pending -= 1
+            last = self.pending == 0
+        # the summary is logged before the result of the last task is
+        # returned, because the atexit hook is never run by notebook kernels
+        if last:
+            self.report()
+        if result.errors:
+            return {
+                'task': task_id,
+                'ret_code': 1,
+                'output': sos_targets(),
+                'exception': ValueError('; '.join(result.errors)),
+            }
+        return {
+            'task': task_id,
+            'ret_code': 0,
+            'output': output if output is not None else sos_targets(),
+        }
+
+    def check(self, task_id):
+        try:
+            runtime, job_file, _ = self.engine._render_job(task_id)
+            self.engine._get_submit_cmd(runtime)
+        except Exception as e:
+            return DryRunResult(task_id, 0, None, [str(e)])
+        resources = requested_resources(runtime)
+        errors = check_limits(resources, self.engine.config)
+        proc = subprocess.run(['bash', '-n', job_file],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            errors.append(f'invalid job script {job_file}: '
+                          f'{proc.stderr.decode(errors="replace").strip()}')
+        cores = int(resources['cores'] or 1) * int(resources['nodes'] or 1)
+        core_hours = None if resources['walltime'] == '' else cores * resources[
+            'walltime'] / 3600
+        return DryRunResult(task_id, cores, core_hours, errors)
+
+    def report(self):
+        # log the summary of tasks checked since the last report
+        with self._lock:
+            results, self.results = self.results, []
+        if not results:
+            return
+        summary = self.summary(results)
+        if any(x.errors for x in results):
+            env.logger.warning(summary)
+        else:
+            env.logger.info(summary)
+
+    def summary(self, results):
+        failed = [x for x in results if x.errors]
+        no_walltime = sum(1 for x in results if x.core_hours is None)
+        lines = [
+            f'{len(results)} jobs to {self.engine.alias}: '
+            f'{sum(x.cores for x in results)} cores, '
+            f'{sum(x.core_hours or 0 for x in results):.1f} core hours requested'
+            + (f' ({no_walltime} jobs without walltime)' if no_walltime else '')
+        ]
+        if failed:
+            lines.append(f'{len(failed)} jobs failed to validate:')
+            # one line per error, with interpolated templates on one line
+            lines.extend(f'{x.task_id}\t{" ".join(error.split())}'
+                         for x in failed
+                         for error in x.errors)
+        return '\n'.join(lines)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import threading
+import time
+
+from sos.utils import env, expand_time
+
+# sos touches ~/.sos/tasks/{task}.pulse every few seconds while it executes a
+# task, and the file is removed when the task is prepared for a new job
+PULSE_DIR = '$HOME/.sos/tasks'
+
+
+class HeartbeatMonitor(object):
+    '''Find running tasks whose pulse files have not been modified for
+    timeout seconds (default 5 times heartbeat_interval), which means that
+    the sos process executing the task is no longer alive. Ages of pulse
+    files of all running tasks are read with a single command, at most once
+    every heartbeat_interval. Tasks without a pulse file have not started
+    yet and are never stale.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.agent = engine.agent
+        self.interval = expand_time(engine.config['heartbeat_interval'])
+        self.timeout = expand_time(
+            engine.config.get('heartbeat_timeout', self.interval * 5))
+        self._running = set()
+        self._stale = set()
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def watch(self, task_ids):
+        # check the pulse of these running tasks with the next check
+        with self._lock:
+            self._running.update(task_ids)
+
+    def stale(self, task_id):
+        '''Return True if the pulse of running task task_id is stale.'''
+        with self._lock:
+            self._running.add(task_id)
+            if time.time() - self._checked >= self.interval:
+                self._check()
+            return task_id in self._stale
+
+    def _check(self):
+        self._checked = time.time()
+        # time on the remote host, followed by name and mtime of files
+        files = ' '.join(f'{x}.pulse' for x in sorted(self._running))
+        cmd = (f'date +%s; cd {PULSE_DIR} && stat -c "%n %Y" {files} '
+               '2>/dev/null; true')
+        try:
+            lines = self.agent.check_output(cmd).split('\n')
+            now = float(lines[0])
+            self._stale = set()
+            for line in lines[1:]:
+                fields = line.split()
+                if len(fields) == 2 and now - float(fields[1]) > self.timeout:
+                    self._stale.add(fields[0][:-len('.pulse')])
+        except Exception as e:
+            env.logger.debug(
+                f'Failed to check heartbeats on {self.engine.alias}: {e}')
+
+    def forget(self, task_id):
+        # stop checking a task that is no longer running
+        with self._lock:
+            self._running.discard(task_id)
+            self._stale.discard(task_id)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import os
+import threading
+
+import fasteners
+from sos.utils import textMD5
+
+from .status_cache import SchedulerStatusCache
+
+
+def runtime_key(params):
+    '''Key of the runtimes of a task, the name of its step and a digest of
+    the code of the task, so that steps of the same name of different
+    workflows are kept apart.'''
+    return f'{params.sos_dict.get("step_name", "")}@{textMD5(params.global_def + params.task)[:12]}'
+
+
+class RuntimeHistory(object):
+    '''Runtimes of completed tasks of each step on a host, kept across
+    sessions in ~/.sos/pbs_history/{host}-{user}.json. Only the last
+    max_records runtimes of each step are kept, and runtimes are estimated
+    only from at least min_samples records.'''
+
+    def __init__(self, config, history_dir='~/.sos/pbs_history',
+                 max_records=100, min_samples=5):
+        history_dir = os.path.expanduser(history_dir)
+        os.makedirs(history_dir, exist_ok=True)
+        key = SchedulerStatusCache.cache_key(config)
+        self.history_file = os.path.join(history_dir, key + '.json')
+        self._lock = fasteners.InterProcessLock(
+            os.path.join(history_dir, key + '.lock'))
+        self._thread_lock = threading.Lock()
+        self.max_records = max_records
+        self.min_samples = min_samples
+        self._runtimes = None
+
+    def _load(self):
+        try:
+            with open(self.history_file) as history:
+                return json.load(history)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def runtimes(self, step):
+        with self._thread_lock:
+            if self._runtimes is None:
+                self._runtimes = self._load()
+            return self._runtimes.get(step, [])
+
+    def record(self, step, runtime):
+        # merge with records written by other sessions
+        with self._thread_lock, self._lock:
+            self._runtimes = self._load()
+            records = self._runtimes.setdefault(step, [])
+            records.append(round(runtime, 1))
+            del records[:-self.max_records]
+            tmp_file = f'{self.history_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as history:
+                json.dump(self._runtimes, history)
+            os.replace(tmp_file, self.history_file)
+
+    def estimate(self, step, quantile=0.9):
+        '''Return the quantile of runtimes of step, or None if fewer than
+        min_samples tasks of the step have completed.'''
+        runtimes = sorted(self.runtimes(step))
+        if not runtimes or len(runtimes) < self.min_samples:
+            return None
+        return runtimes[min(int(len(runtimes) * quantile), len(runtimes) - 1)]
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# Columnar history of jobs submitted by the task and workflow engines, kept
+# under ~/.sos/pbs_history/jobs/{host}-{user}/. Each process appends to its
+# own segment directory with one gzip file per column, so that sessions never
+# write to the same file and a column can be read without the others. Rows
+# are buffered and appended as one gzip member per column every flush_size
+# rows and when the process exits.
+#
+# A submit row is written when a job is submitted, and an end row, with the
+# submit, start, and end times and the peak cpu and memory usage of the task,
+# when a task is first seen completed, failed, or aborted. Resources requested
+# for the job (walltime, mem, cores, nodes) are recorded in both rows so that
+# every row can be summarized on its own.
+
+import atexit
+import gzip
+import math
+import os
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from sos.utils import env, expand_size, expand_time
+
+from .status_cache import SchedulerStatusCache
+
+COLUMNS = ('event', 'kind', 'name', 'job_id', 'queue', 'step', 'status',
+           'submit_time', 'start_time', 'end_time', 'walltime', 'mem', 'cores',
+           'nodes', 'peak_cpu', 'peak_mem')
+
+
+def requested_resources(runtime):
+    # walltime in seconds and mem in bytes, or '' if not requested
+    res = {}
+    # mem is in bytes in runtime of tasks, and in job id files of tasks that
+    # have been resubmitted with more memory
+    size = lambda x: int(x) if str(x).isdigit() else expand_size(x)
+    for key, expand in (('walltime', expand_time), ('mem', size)):
+        try:
+            res[key] = expand(runtime[key]) if runtime.get(key) else ''
+        except Exception:
+            res[key] = ''
+    res['cores'] = runtime.get('cores', '')
+    res['nodes'] = runtime.get('nodes', '')
+    return res
+
+
+class JobHistory(object):
+    '''Append-only columnar store of submit and end records of jobs.'''
+
+    def __init__(self, config, history_dir='~/.sos/pbs_history',
+                 flush_size=100):
+        self.root = os.path.join(
+            os.path.expanduser(history_dir), 'jobs',
+            SchedulerStatusCache.cache_key(config))
+        self.queue = config.get('alias', '')
+        self.flush_size = flush_size
+        self._segment = None
+        self._rows = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def record(self, event, **fields):
+        fields.setdefault('queue', self.queue)
+        row = [fields.get(x, '') for x in COLUMNS[1:]]
+        with self._lock:
+            self._rows.append([event] + row)
+            if len(self._rows) < self.flush_size:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                if self._segment is None:
+                    self._segment = os.path.join(
+                        self.root,
+                        f'{time.strftime("%Y%m%d")}-{os.getpid()}-{uuid.uuid4().hex[:8]}')
+                    os.makedirs(self._segment, exist_ok=True)
+                for idx, column in enumerate(COLUMNS):
+                    with gzip.open(
+                            os.path.join(self._segment, column + '.gz'),
+                            'at') as col:
+                        col.write(''.join(
+                            f'{str(row[idx]).replace(chr(10), " ")}\n'
+                            for row in rows))
+            except Exception as e:
+                env.logger.debug(f'Failed to write job history: {e}')
+
+
+def _segments(root):
+    for dirpath, _, filenames in os.walk(root):
+        if 'event.gz' in filenames:
+            yield dirpath
+
+
+def iter_records(history_dir='~/.sos/pbs_history', columns=COLUMNS):
+    '''Yield records of all hosts under history_dir as dictionaries of the
+    requested columns, reading all segments line by line.'''
+    root = os.path.join(os.path.expanduser(history_dir), 'jobs')
+    for segment in sorted(_segments(root)):
+        files = []
+        try:
+            files = [
+                gzip.open(os.path.join(segment, x + '.gz'), 'rt')
+                for x in columns
+            ]
+            # rows of a segment whose writer died during a flush are
+            # truncated to the shortest column
+            for values in zip(*files):
+                yield dict(zip(columns, (x[:-1] for x in values)))
+        except (OSError, EOFError) as e:
+            env.logger.warning(f'Failed to read job history {segment}: {e}')
+        finally:
+            for f in files:
+                f.close()
+
+
+class Histogram(object):
+    '''Counts of values in logarithmic buckets of about 9% width, from which
+    quantiles are estimated in constant memory.'''
+
+    scale = 8
+
+    def __init__(self):
+        self.counts = Counter()
+        self.n = 0
+
+    def add(self, value):
+        self.counts[int(math.log2(max(value, 0) + 1) * self.scale)] += 1
+        self.n += 1
+
+    def quantile(self, q):
+        if not self.n:
+            return None
+        target = q * self.n
+        total = 0
+        for bucket in sorted(self.counts):
+            total += self.counts[bucket]
+            if total >= target:
+                # middle of the bucket
+                return 2**((bucket + 0.5) / self.scale) - 1
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class GroupSummary(object):
+
+    def __init__(self):
+        self.submitted = 0
+        self.first_submit = None
+        self.last_submit = None
+        self.ended = Counter()
+        self.wait = Histogram()
+        self.run = Histogram()
+        self.walltime_used = Histogram()
+        self.mem_used = Histogram()
+
+    def add(self, record):
+        if record['event'] == 'submit':
+            self.submitted += 1
+            submit_time = _float(record['submit_time'])
+            if submit_time is not None:
+                self.first_submit = submit_time if self.first_submit is None else min(
+                    self.first_submit, submit_time)
+                self.last_submit = submit_time if self.last_submit is None else max(
+                    self.last_submit, submit_time)
+            return
+        self.ended[record['status']] += 1
+        submit, start, end = (_float(record[x])
+                              for x in ('submit_time', 'start_time', 'end_time'))
+        if submit is not None and start is not None:
+            self.wait.add(start - submit)
+        if start is None or end is None:
+            return
+        self.run.add(end - start)
+        walltime = _float(record['walltime'])
+        if walltime:
+            # percentage of requested walltime and mem that were used
+            self.walltime_used.add((end - start) * 100 / walltime)
+        mem, peak_mem = _float(record['mem']), _float(record['peak_mem'])
+        if mem and peak_mem:
+            self.mem_used.add(peak_mem * 100 / mem)
+
+    def summary(self):
+        ended = sum(self.ended.values())
+        span = (self.last_submit - self.first_submit
+                if self.submitted > 1 else 0)
+        return {
+            'submitted': self.submitted,
+            'throughput': self.submitted * 3600 / span if span else None,
+            'ended': ended,
+            'failure_rate': (self.ended['failed'] + self.ended['aborted']) /
+                            ended if ended else None,
+            'wait_p50': self.wait.quantile(0.5),
+            'wait_p90': self.wait.quantile(0.9),
+            'run_p50': self.run.quantile(0.5),
+            'run_p90': self.run.quantile(0.9),
+            'walltime_used_p50': self.walltime_used.quantile(0.5),
+            'mem_used_p50': self.mem_used.quantile(0.5),
+        }
+
+
+def summarize(records, by=('queue', 'step')):
+    '''Return summaries of records grouped by the columns in by, with
+    submissions per hour, failure rate of ended jobs, median and 90th
+    percentile of queue wait and run time in seconds, and median percentage
+    of requested walltime and memory that were used.'''
+    groups = defaultdict(GroupSummary)
+    for record in records:
+        groups[tuple(record[x] for x in by)].add(record)
+    return {k: v.summary() for k, v in sorted(groups.items())}
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import subprocess
+import threading
+
+from sos.tasks import TaskFile
+from sos.utils import env, expand_size, expand_time
+
+
+def _size(value):
+    # mem of tasks is in bytes, and mem of the host can have units
+    if not value:
+        return 0
+    return int(value) if str(value).isdigit() else expand_size(value)
+
+
+def shares_filesystem(config):
+    '''Return True if tasks prepared for the host can be executed on the
+    local machine, that is, if sos maps no paths for the host (all paths
+    are shared) or shared_filesystem is set in host configuration.'''
+    shared = config.get('shared', [])
+    if isinstance(shared, str):
+        shared = [shared]
+    return bool(config.get('shared_filesystem', False)) or '/' in shared
+
+
+class LocalPool(object):
+    '''Run short tasks with sos execute on the local machine instead of
+    submitting them when the queue wait of the scheduler is longer than the
+    time needed to run them locally.
+
+    A task is run locally if its walltime is at most local_max_walltime
+    (default 10m), it fits in local_cores (default half of the cores of the
+    local machine) and local_mem (default unlimited), and the estimated queue
+    wait is longer than the estimated runtime of the task plus the time to
+    run tasks that are already waiting in the pool. Running tasks never use
+    more than local_cores cores and local_mem memory together. Task files
+    are sent to the host after tasks are completed so that sos status and
+    sos kill work as for submitted tasks.
+
+    Tasks are prepared with paths of the host, and their inputs and outputs
+    are read and written on the local machine, so the pool is only used if
+    the local machine and the host share their file systems (see
+    shares_filesystem).'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        config = engine.config
+        self.cores = int(
+            config.get('local_cores', max((os.cpu_count() or 2) // 2, 1)))
+        self.mem = _size(config['local_mem']) if 'local_mem' in config else None
+        self.max_walltime = expand_time(config.get('local_max_walltime', '10m'))
+        self.sos = config.get('local_sos', 'sos')
+        self._used_cores = 0
+        self._used_mem = 0
+        # estimated seconds of work of tasks waiting for cores
+        self._backlog = 0
+        # Popen of running tasks, None for waiting ones, and tasks that
+        # could not be run
+        self._procs = {}
+        self._killed = set()
+        self._failed = set()
+        # tasks run by the pool whose ends have not been recorded
+        self.tasks = set()
+        self._cond = threading.Condition()
+
+    def accepts(self, runtime, estimate, wait):
+        '''Return True if a task with runtime (with walltime, cores, and mem)
+        and estimated runtime should be run locally given the estimated queue
+        wait of the scheduler.'''
+        if wait is None or runtime.get('walltime') is None:
+            return False
+        cores = int(runtime.get('cores', 1))
+        mem = _size(runtime.get('mem'))
+        if expand_time(runtime['walltime']) > self.max_walltime or cores > self.cores:
+            return False
+        if self.mem is not None and mem > self.mem:
+            return False
+        with self._cond:
+            return wait > estimate + self._backlog / self.cores
+
+    def submit(self, task_id, runtime, estimate):
+        cores = int(runtime.get('cores', 1))
+        mem = _size(runtime.get('mem')) if self.mem is not None else 0
+        with self._cond:
+            self._procs[task_id] = None
+            self._failed.discard(task_id)
+            self.tasks.add(task_id)
+            self._backlog += estimate * cores
+        threading.Thread(
+            target=self._run,
+            args=(task_id, runtime, cores, mem, estimate),
+            daemon=True).start()
+        env.logger.info(f'{task_id} ``started`` locally')
+
+    def _run(self, task_id, runtime, cores, mem, estimate):
+        with self._cond:
+            self._cond.wait_for(lambda: task_id in self._killed or (
+                self._used_cores + cores <= self.cores and
+                (self.mem is None or self._used_mem + mem <= self.mem)))
+            self._backlog -= estimate * cores
+            if task_id in self._killed:
+                self._procs.pop(task_id, None)
+                return
+            self._used_cores += cores
+            self._used_mem += mem
+        try:
+            with self._cond:
+                if task_id in self._killed:
+                    return
+                self._procs[task_id] = subprocess.Popen(
+                    [
+                        self.sos, 'execute', task_id, '-v',
+                        str(runtime['verbosity']), '-s', runtime['sig_mode'],
+                        '-m', runtime['run_mode']
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+            self._procs[task_id].wait()
+            if task_id not in self._killed:
+                # let sos status on the host see the results
+                self.engine.agent.send_job_file(TaskFile(task_id).task_file)
+        except Exception as e:
+            env.logger.warning(f'Failed to run task {task_id} locally: {e}')
+            with self._cond:
+                self._failed.add(task_id)
+        finally:
+            with self._cond:
+                self._used_cores -= cores
+                self._used_mem -= mem
+                self._procs.pop(task_id, None)
+                self._cond.notify_all()
+
+    def status(self, task_id):
+        '''Return submitted or running for tasks waiting or running in the
+        pool, failed for tasks that could not be run, and None for other
+        tasks.'''
+        with self._cond:
+            if task_id in self._failed:
+                return 'failed'
+            if task_id not in self._procs:
+                return None
+            return 'submitted' if self._procs[task_id] is None else 'running'
+
+    def kill(self, task_ids=None):
+        # kill tasks (all tasks if None) that are waiting or running in the
+        # pool and return their ids
+        killed = []
+        with self._cond:
+            for task_id in list(self._procs) if task_ids is None else task_ids:
+                if task_id not in self._procs:
+                    continue
+                self._killed.add(task_id)
+                if self._procs[task_id] is not None:
+                    self._procs[task_id].terminate()
+                killed.append(task_id)
+            self._cond.notify_all()
+        return killed
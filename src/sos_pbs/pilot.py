@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# Pilot mode of the task engine. Instead of one job per task, up to
+# pilot_jobs long-running worker jobs are submitted with task_template and
+# submit_cmd, and tasks are put in a queue directory under pilot_dir (default
+# $HOME/.sos/pilots) on storage shared by the head and compute nodes:
+#
+#   queue/{seq}-{task}      tasks waiting for a pilot, with their walltime
+#                           (seconds), mem (bytes), cores and sos execute options
+#   running/{seq}-{task}.{pilot}  tasks claimed by a pilot
+#   pilots/{pilot}          pilots that have started, removed when they exit
+#
+# A pilot claims a task by renaming its file from queue to running, which is
+# atomic on local and network file systems so that no lock is needed. A pilot
+# only claims tasks that fit in its cores and mem and finish before its
+# walltime runs out, and tasks that do not fit in any pilot are submitted as
+# jobs of their own. Pilots exit after pilot_idle_timeout (default 5m)
+# without tasks, and stop claiming tasks pilot_reserve (default 10m) before
+# their walltime runs out. Commands are interpolated again with
+# task_template so they cannot contain braces.
+
+import math
+import shlex
+import threading
+import time
+import uuid
+
+from sos.eval import cfg_interpolate
+from sos.tasks import TaskFile
+from sos.utils import env, expand_size, expand_time
+
+from .schedulers import ACTIVE_STATES
+
+PILOT_DIR = '$HOME/.sos/pilots'
+
+
+def _mem_bytes(mem):
+    return int(mem) if str(mem).isdigit() else expand_size(mem)
+
+
+def pilot_command(pilot_id,
+                  pilot_dir,
+                  sos,
+                  poll,
+                  idle_timeout,
+                  lifetime=None,
+                  walltime=None,
+                  cores=None,
+                  mem=None):
+    '''Return the command of a pilot job that runs queued tasks until it
+    has been idle for idle_timeout seconds, or, if lifetime is specified,
+    stops claiming tasks after lifetime seconds. Tasks that need more than
+    the walltime left of the pilot, or more than its cores or mem (bytes),
+    are left to other pilots.'''
+    lines = [
+        f'Q={pilot_dir}',
+        'mkdir -p $Q/queue $Q/running $Q/pilots',
+        f'touch $Q/pilots/{pilot_id}',
+        f"trap 'rm -f $Q/pilots/{pilot_id}' EXIT",
+        'idle=0',
+        'start=$(date +%s)',
+    ]
+    if lifetime is not None:
+        lines.append(f'deadline=$(( start + {int(lifetime)} ))')
+    lines.extend([
+        'while true; do',
+        '  now=$(date +%s)',
+    ])
+    if lifetime is not None:
+        lines.append('  [ $now -ge $deadline ] && break')
+    lines.extend([
+        '  claimed=',
+        '  for f in $Q/queue/*; do',
+        '    [ -e "$f" ] || break',
+        '    read task wt mem cores opts 2>/dev/null < "$f" || continue',
+    ])
+    if walltime is not None:
+        lines.append(
+            f'    [ $(( now + wt )) -le $(( start + {int(walltime)} )) ] || continue')
+    if mem is not None:
+        lines.append(f'    [ $mem -le {int(mem)} ] || continue')
+    if cores is not None:
+        lines.append(f'    [ $cores -le {int(cores)} ] || continue')
+    lines.extend([
+        f'    if mv "$f" "$Q/running/$(basename $f).{pilot_id}" 2>/dev/null; then',
+        f'      claimed="$Q/running/$(basename $f).{pilot_id}"',
+        '      break',
+        '    fi',
+        '  done',
+        '  if [ -z "$claimed" ]; then',
+        f'    [ $idle -ge {int(idle_timeout)} ] && break',
+        f'    sleep {int(poll)}',
+        f'    idle=$(( idle + {int(poll)} ))',
+        '    continue',
+        '  fi',
+        '  idle=0',
+        '  read task wt mem cores opts < "$claimed"',
+        f'  {sos} execute $task $opts',
+        '  rm -f "$claimed"',
+        'done',
+    ])
+    return '\n'.join(lines)
+
+
+class PilotPool(object):
+    '''Queue of tasks on the execution host and the pilot jobs that run
+    them. One pilot is requested for every pilot_backlog (default 10) queued
+    tasks, up to pilot_jobs pilots.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.agent = engine.agent
+        config = engine.config
+        self.max_pilots = int(config['pilot_jobs'])
+        self.backlog_per_pilot = int(config.get('pilot_backlog', 10))
+        self.pilot_dir = config.get('pilot_dir', PILOT_DIR)
+        self.poll = expand_time(config.get('pilot_poll', 5))
+        self.idle_timeout = expand_time(config.get('pilot_idle_timeout', '5m'))
+        self.reserve = expand_time(config.get('pilot_reserve', '10m'))
+        # walltime (seconds), cores and mem (bytes) of pilots, None if unknown
+        walltime = config.get('pilot_walltime', config.get('walltime'))
+        mem = config.get('pilot_mem', config.get('mem'))
+        self.walltime = None if walltime is None else expand_time(walltime)
+        self.cores = int(config.get('pilot_cores', config.get('cores', 1)))
+        self.mem = None if mem is None else _mem_bytes(mem)
+        # pilots submitted by this engine that have not started, and when
+        # their jobs were last checked with status_cmd
+        self._pending = {}
+        self._checked = {}
+        self._scaled = 0
+        self._lock = threading.Lock()
+
+    def requirements(self, task_id):
+        '''Return the walltime (seconds), mem (bytes) and cores of a task, or
+        None if the task does not fit in a pilot.'''
+        runtime, _ = self.engine._task_runtime(task_id)
+        walltime = 0 if runtime.get('walltime') is None else expand_time(
+            runtime['walltime'])
+        mem = 0 if runtime.get('mem') is None else _mem_bytes(runtime['mem'])
+        cores = int(runtime.get('cores', 1))
+        if (self.walltime is not None and walltime > self.walltime) or (
+                self.mem is not None and mem > self.mem) or cores > self.cores:
+            return None
+        return walltime, mem, cores
+
+    def enqueue(self, task_ids):
+        '''Add tasks to the queue, in order, and submit pilots if needed.
+        Return tasks that do not fit in a pilot, which are not queued.'''
+        entries = []
+        remaining = []
+        seq = time.time_ns()
+        for i, task_id in enumerate(task_ids):
+            requirements = self.requirements(task_id)
+            if requirements is None:
+                remaining.append(task_id)
+                continue
+            task_runtime = TaskFile(task_id).runtime['_runtime']
+            opts = f'-v {task_runtime["verbosity"]} -s {task_runtime["sig_mode"]} -m {task_runtime["run_mode"]}'
+            name = f'{seq + i:020d}-{task_id}'
+            # files are written aside and then moved so that pilots never
+            # read partial files
+            entries.append(
+                f'echo {task_id} {" ".join(str(x) for x in requirements)} {opts} > $Q/.{name} && mv $Q/.{name} $Q/queue/{name}'
+            )
+        # in batches to keep commands short
+        for i in range(0, len(entries), 1000):
+            self.agent.check_output(
+                f'Q={self.pilot_dir}; mkdir -p $Q/queue && ' +
+                ' && '.join(entries[i:i + 1000]))
+        if entries:
+            env.log_to_file(
+                'TASK', f'{len(entries)} tasks queued for pilots on {self.engine.alias}')
+            self.scale(force=True)
+        return remaining
+
+    def dequeue(self, task_ids):
+        # remove killed tasks that have not been claimed by pilots
+        if task_ids:
+            self.agent.check_output(
+                'rm -f ' + ' '.join(
+                    f'{self.pilot_dir}/queue/*-{x}' for x in task_ids))
+
+    def _status(self):
+        # number of queued tasks and ids of started pilots
+        lines = self.agent.check_output(
+            f'ls {self.pilot_dir}/queue 2>/dev/null | wc -l; ls {self.pilot_dir}/pilots 2>/dev/null; true'
+        ).split()
+        return int(lines[0]), set(lines[1:])
+
+    def scale(self, force=False):
+        '''Submit pilots for queued tasks, at most once every pilot_poll
+        seconds unless force is True. Return the number of pilots submitted.'''
+        with self._lock:
+            if not force and time.time() - self._scaled < self.poll:
+                return 0
+            self._scaled = time.time()
+            try:
+                backlog, started = self._status()
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to check pilots on {self.engine.alias}: {e}')
+                return 0
+            self._forget_pending(started)
+            wanted = min(self.max_pilots,
+                         math.ceil(backlog / self.backlog_per_pilot))
+            count = 0
+            for _ in range(wanted - len(started) - len(self._pending)):
+                try:
+                    self.submit()
+                    count += 1
+                except Exception as e:
+                    env.logger.warning(
+                        f'Failed to submit pilot job to {self.engine.alias}: {e}')
+                    break
+            return count
+
+    def _forget_pending(self, started):
+        # pilots that have started, or whose jobs ended before starting
+        snapshot = None
+        if self.engine._status_cache is not None:
+            snapshot = self.engine._status_cache.snapshot()
+        for pilot_id, job_id in list(self._pending.items()):
+            if pilot_id in started:
+                ended = True
+            elif snapshot is not None:
+                ended = snapshot['jobs'].get(job_id) is not None and snapshot[
+                    'jobs'][job_id].state not in ACTIVE_STATES
+            else:
+                ended = self._job_ended(pilot_id, job_id)
+            if ended:
+                self._pending.pop(pilot_id)
+                self._checked.pop(pilot_id, None)
+
+    def _job_ended(self, pilot_id, job_id):
+        # check the job of a pending pilot with status_cmd, at most once
+        # every status_check_interval
+        if time.time() - self._checked.get(
+                pilot_id, 0) < self.engine.status_check_interval:
+            return False
+        self._checked[pilot_id] = time.time()
+        try:
+            output = self.agent.check_output(
+                cfg_interpolate(self.engine.status_cmd, {'job_id': job_id}))
+        except Exception as e:
+            # the scheduler no longer knows the job
+            env.logger.debug(f'Pilot {pilot_id} with job id {job_id} is gone: {e}')
+            return True
+        try:
+            record = self.engine.scheduler.parse_status_table(output).get(job_id)
+        except Exception:
+            # the output of status_cmd cannot be parsed
+            return False
+        return record is not None and record.state not in ACTIVE_STATES
+
+    def submit(self):
+        pilot_id = f'pilot_{uuid.uuid4().hex[:12]}'
+        runtime = dict(self.engine.config)
+        for key in ('walltime', 'cores', 'nodes', 'mem', 'queue'):
+            if f'pilot_{key}' in runtime:
+                runtime[key] = runtime[f'pilot_{key}']
+        runtime.setdefault('nodes', 1)
+        runtime.setdefault('cores', 1)
+        runtime.setdefault('workdir', '$HOME')
+        runtime.setdefault('verbosity', env.verbosity)
+        runtime.setdefault('sig_mode', 'default')
+        runtime.setdefault('run_mode', 'run')
+        runtime['cur_dir'] = runtime['workdir']
+        runtime['task'] = runtime['job_name'] = pilot_id
+        runtime['step_name'] = 'pilot'
+        runtime['stage_in'] = runtime['stage_out'] = ''
+        lifetime = None
+        if self.walltime is not None:
+            lifetime = max(self.walltime - self.reserve, 0)
+        runtime['command'] = pilot_command(
+            pilot_id, self.pilot_dir, shlex.quote(runtime.get('sos', 'sos')),
+            self.poll, self.idle_timeout, lifetime, self.walltime, self.cores,
+            self.mem)
+        runtime['job_file'] = f'~/.sos/tasks/{pilot_id}.sh'
+        try:
+            job_text = cfg_interpolate(self.engine.task_template, runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate pilot job file: {e}')
+        job_file = self.engine.spool.path(pilot_id, '.sh', create=True)
+        with open(job_file, 'w', newline='') as job:
+            job.write(job_text)
+        self.agent.send_job_file(job_file)
+        job_id = self.engine.transport.submit(pilot_id, runtime, job_text)
+        self.engine._record_submit(pilot_id, job_id, runtime, 'pilot')
+        self.agent.send_job_file(
+            self.engine.spool.write_job_id(pilot_id, job_id))
+        self._pending[pilot_id] = job_id['job_id']
+        self._checked[pilot_id] = time.time()
+        env.logger.info(
+            f'Pilot {pilot_id} ``submitted`` to {self.engine.alias} with job id {job_id["job_id"]}')
+        return pilot_id
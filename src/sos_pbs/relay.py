@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# This file is copied to and executed on the head node of a cluster, where
+# sos-pbs is not installed, so the relay itself only uses the standard library.
+#
+# The relay reads one JSON submission request per line from stdin
+#
+#   {"task_id": ..., "job_file": ..., "script": ..., "cmd": ...,
+#    "pattern": ..., "job_id_file": ...}
+#
+# writes script to job_file, runs cmd to submit the job, extracts job_id and
+# other fields from the last line of its output with regular expression
+# pattern, writes them to job_id_file, and writes one JSON line
+#
+#   {"task_id": ..., "job_id": ..., "fields": {...}}
+#
+# or {"task_id": ..., "error": ...} to stdout. Requests that arrive together
+# are submitted by a single shell. Optional field extra of a request holds
+# additional fields for job_id_file.
+#
+# A single request can also be submitted without a relay by a command
+# returned by inline_command(), which runs submit_batch() with python -c and
+# prints the result after FRAME_RESULT so that it can be picked out of other
+# output of the remote shell.
+
+import base64
+import inspect
+import io
+import json
+import os
+import re
+import select
+import subprocess
+import sys
+import threading
+
+FRAME = '@@SOS_PBS_RELAY'
+
+
+def _expand(filename):
+    return os.path.expanduser(filename)
+
+
+def _has_input(stream):
+    try:
+        return bool(select.select([stream], [], [], 0)[0])
+    except (ValueError, io.UnsupportedOperation):
+        # in-memory streams have all their input available
+        return True
+
+
+def read_batch(stream, max_size):
+    # block for the first request and take whatever else is already available
+    line = stream.readline()
+    if not line:
+        return None
+    batch = [line]
+    while len(batch) < max_size:
+        if not _has_input(stream):
+            break
+        line = stream.readline()
+        if not line:
+            break
+        batch.append(line)
+    return batch
+
+
+def submit_batch(requests):
+    script = ''
+    for idx, req in enumerate(requests):
+        os.makedirs(os.path.dirname(_expand(req['job_file'])), exist_ok=True)
+        with open(_expand(req['job_file']), 'w', newline='') as job:
+            job.write(req['script'])
+        script += f'echo "{FRAME} {idx}"\n({req["cmd"]}) 2>&1\necho "{FRAME}_END {idx} $?"\n'
+    proc = subprocess.run(['/bin/bash', '-c', script],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          cwd=os.path.expanduser('~'))
+    outputs = {}
+    codes = {}
+    current = None
+    for line in proc.stdout.decode(errors='replace').splitlines():
+        if line.startswith(FRAME + '_END '):
+            _, idx, code = line.split()
+            codes[int(idx)] = int(code)
+            current = None
+        elif line.startswith(FRAME + ' '):
+            current = int(line.split()[1])
+            outputs[current] = []
+        elif current is not None:
+            outputs[current].append(line)
+    #
+    results = []
+    for idx, req in enumerate(requests):
+        output = '\n'.join(outputs.get(idx, [])).strip()
+        if codes.get(idx, 1) != 0:
+            results.append({
+                'task_id': req['task_id'],
+                'error': f'Command {req["cmd"]} failed with output: {output}'
+            })
+            continue
+        if not output:
+            results.append({
+                'task_id': req['task_id'],
+                'error': f'No output returned from command {req["cmd"]}'
+            })
+            continue
+        matched = re.match(req['pattern'], output.splitlines()[-1])
+        if not matched or matched.groupdict().get('job_id') is None:
+            results.append({
+                'task_id': req['task_id'],
+                'error': f'Failed to extract job_id from "{output}"'
+            })
+            continue
+        fields = {k: v for k, v in matched.groupdict().items() if v is not None}
+        if req.get('job_id_file'):
+            with open(_expand(req['job_id_file']), 'w') as job:
+                # e.g. previous_job_ids of resubmitted tasks
+                for k, v in dict(fields, **req.get('extra', {})).items():
+                    job.write(f'{k}: {v}\n')
+        results.append({
+            'task_id': req['task_id'],
+            'job_id': fields['job_id'],
+            'fields': fields
+        })
+    return results
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, max_batch_size=100):
+    while True:
+        batch = read_batch(stdin, max_batch_size)
+        if batch is None:
+            break
+        requests = []
+        for line in batch:
+            try:
+                requests.append(json.loads(line))
+            except ValueError as e:
+                stdout.write(json.dumps({'error': f'Invalid request: {e}'}) + '\n')
+        try:
+            results = submit_batch(requests)
+        except Exception as e:
+            results = [{
+                'task_id': req.get('task_id'),
+                'error': str(e)
+            } for req in requests]
+        for res in results:
+            stdout.write(json.dumps(res) + '\n')
+        stdout.flush()
+
+
+def inline_command(request, python='python3'):
+    '''Return a command that submits a single request on the remote host.
+    The command contains only base64 so that it is not changed by quoting
+    or interpolation of commands by hosts.'''
+    source = '\n'.join([
+        'import json, os, re, subprocess',
+        f'FRAME = {FRAME!r}',
+        inspect.getsource(_expand),
+        inspect.getsource(submit_batch),
+        f'request = json.loads({json.dumps(request)!r})',
+        'print(FRAME + "_RESULT " + json.dumps(submit_batch([request])[0]))',
+    ])
+    code = base64.b64encode(source.encode()).decode()
+    return f'{python} -c "import base64; exec(base64.b64decode(\'{code}\'))"'
+
+
+def parse_inline_output(output):
+    # the framed result of a command returned by inline_command
+    prefix = FRAME + '_RESULT '
+    for line in output.splitlines():
+        if line.startswith(prefix):
+            return json.loads(line[len(prefix):])
+    raise RuntimeError(f'No response from inline submission: {output.strip()}')
+
+
+class RelayClient(object):
+    '''Start a relay on the host of an agent and submit jobs through it.'''
+
+    remote_script = '~/.sos/sos_pbs_relay.py'
+
+    def __init__(self, agent, python='python3'):
+        self.agent = agent
+        self.python = python
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        import shutil
+        from sos.eval import cfg_interpolate
+
+        # copy the relay to ~/.sos of the remote host
+        local_script = _expand(self.remote_script)
+        if os.path.abspath(__file__) != local_script:
+            shutil.copyfile(__file__, local_script)
+        self.agent.send_job_file(local_script, dir='.')
+
+        cmd = f'{self.python} {self.remote_script}'
+        if hasattr(self.agent, '_get_execute_cmd'):
+            cmd = cfg_interpolate(
+                self.agent._get_execute_cmd(
+                    under_workdir=False, use_heredoc=False), {
+                        'host': self.agent.address,
+                        'port': self.agent.port,
+                        'cmd': cmd.replace("'", r"'\''"),
+                        'workdir': os.getcwd(),
+                    })
+        else:
+            cmd = _expand(cmd)
+        self.proc = subprocess.Popen(
+            cmd,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True)
+        return self
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def submit(self, requests):
+        '''Send a list of requests and return results in the same order.'''
+        with self.lock:
+            for req in requests:
+                self.proc.stdin.write(json.dumps(req) + '\n')
+            self.proc.stdin.flush()
+            results = {}
+            while len(results) < len(requests):
+                line = self.proc.stdout.readline()
+                if not line:
+                    raise RuntimeError('Submission relay exited unexpectedly')
+                res = json.loads(line)
+                results[res.get('task_id')] = res
+        return [
+            results.get(req['task_id'], {
+                'task_id': req['task_id'],
+                'error': 'No response from relay'
+            }) for req in requests
+        ]
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except Exception:
+                self.proc.kill()
+            self.proc = None
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import re
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from sos.pattern import regex
+from sos.syntax import SOS_WILDCARD
+
+# A compact record of a job in the job table of a scheduler. state is one of
+# queued, held, running, suspended, completed, failed, cancelled, timeout,
+# oom, node_fail, preempted, requeued, and unknown, or missing for jobs that
+# are not in the job table. native_state is the state reported by the scheduler.
+JobRecord = namedtuple(
+    'JobRecord', ['state', 'native_state', 'exit_code', 'reason', 'queue'])
+JobRecord.__new__.__defaults__ = (None, None, None, None)
+
+# states of jobs that are still queued or running on the cluster
+ACTIVE_STATES = ('queued', 'held', 'running', 'suspended')
+
+# states used by PBS (Pro and Torque), and SGE qstat and squeue short codes
+GENERIC_STATES = {
+    'Q': 'queued',
+    'W': 'queued',
+    'T': 'queued',
+    'PD': 'queued',
+    'qw': 'queued',
+    'H': 'held',
+    'hqw': 'held',
+    'R': 'running',
+    'r': 'running',
+    't': 'running',
+    'E': 'running',
+    'CG': 'running',
+    'S': 'suspended',
+    's': 'suspended',
+    'C': 'completed',
+    'F': 'completed',
+    'CD': 'completed',
+    'X': 'completed',
+    'CA': 'cancelled',
+    'TO': 'timeout',
+    'OOM': 'oom',
+    'NF': 'node_fail',
+    'PR': 'preempted',
+    'RQ': 'requeued',
+    'Eqw': 'failed',
+}
+
+
+# exit codes of jobs killed by the scheduler for exceeding walltime (SIGUSR2
+# of SGE and LSF). Jobs killed for exceeding memory (SIGKILL, 137 or 265 of
+# PBS Pro, which adds 256 to signal numbers) or walltime (SIGTERM, 271 of PBS
+# Pro) exit with the same codes as jobs cancelled with scancel -s KILL or
+# qdel, so they are only recognized by the reason given by the scheduler.
+EXIT_CODE_REASONS = {140: 'timeout'}
+
+# phrases of schedulers and the kernel in comments of killed jobs, e.g.
+# "job killed: walltime 3610 exceeded limit 3600" and "job killed: mem job
+# total 2158592 kb exceeded limit 2097152 kb" of PBS. Job comments also list
+# requested resources such as "(node01:ncpus=1:mem=2gb)" so "mem" alone
+# does not mean that the job ran out of memory.
+TIMEOUT_REASON = re.compile(
+    r'walltime (?:\d+ )?exceeded|exceeded (?:resource |its )?walltime|'
+    r'time ?limit|\btimeout\b')
+OOM_REASON = re.compile(
+    r'out[ _]of[ _]memory|oom[- ]?kill|exceeded (?:resource |its )?mem(?:ory)?\b|'
+    r'\bmem(?:ory)? limit|\b[pv]?mem\b[^:=(]* exceeded limit')
+
+
+def failure_reason(record):
+    '''Return oom, timeout, or node_fail if the job of record was killed for
+    exceeding its memory or walltime or lost its node, None otherwise.
+    Cancelled jobs are never retried.'''
+    if record is None:
+        return None
+    if record.state in ('oom', 'timeout', 'node_fail'):
+        return record.state
+    if record.state != 'failed':
+        return None
+    reason = (record.reason or '').lower()
+    if TIMEOUT_REASON.search(reason):
+        return 'timeout'
+    if OOM_REASON.search(reason):
+        return 'oom'
+    return EXIT_CODE_REASONS.get(record.exit_code)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_table_with_pattern(output, pattern):
+    '''Parse the output of status_table_cmd with a pattern such as
+    "{job_id} {name} {user} {time} {status} {queue}", which is matched against
+    each line with consecutive spaces collapsed. Wildcards without
+    constraint match a single column. Lines that do not match (e.g. headers)
+    are ignored. Returns a dictionary of job_id => fields.'''
+    pattern = SOS_WILDCARD.sub(
+        lambda m: m.group(0) if m.group('constraint') else
+        '{' + m.group('name') + r',\S+}', pattern)
+    matcher = re.compile(regex(pattern))
+    jobs = {}
+    for line in output.splitlines():
+        m = matcher.match(' '.join(line.split()))
+        if m is None or not m.group('job_id'):
+            continue
+        fields = m.groupdict()
+        jobs[fields.pop('job_id')] = fields
+    return jobs
+
+
+class Scheduler(object):
+    '''Default commands of a scheduler and parsers of its machine-readable
+    output. Options in host configurations take precedence over defaults.'''
+
+    name = None
+    submit_cmd = None
+    kill_cmd = None
+    status_cmd = None
+    status_table_cmd = None
+    # regular expression that matches the last line of submit_cmd output
+    submit_regex = r'(?P<job_id>\S+)$'
+    states = GENERIC_STATES
+
+    def state(self, native_state):
+        return self.states.get(native_state, 'unknown')
+
+    def parse_submit_output(self, output):
+        '''Return fields extracted from the last line of the output of
+        submit_cmd, or None if the output is not recognized.'''
+        lines = output.strip().splitlines()
+        if not lines:
+            return None
+        m = re.match(self.submit_regex, lines[-1].strip())
+        if m is None or m.group('job_id') is None:
+            return None
+        return {k: v for k, v in m.groupdict().items() if v is not None}
+
+    def parse_status_table(self, output):
+        '''Convert the output of status_table_cmd to a dictionary of
+        job_id => JobRecord.'''
+        raise NotImplementedError()
+
+
+class JSONScheduler(Scheduler):
+    # decode the output in one pass, converting each job object to a
+    # JobRecord as soon as it is decoded, so that only compact records of
+    # jobs are kept in memory.
+
+    def job_from_object(self, obj):
+        # return (job_id, JobRecord) if obj describes a job, None otherwise
+        raise NotImplementedError()
+
+    def parse_status_table(self, output):
+        jobs = {}
+
+        def hook(obj):
+            job = self.job_from_object(obj)
+            if job is None:
+                return obj
+            if job[0] is not None:
+                jobs[str(job[0])] = job[1]
+            return job[1]
+
+        if output.strip():
+            json.loads(output, object_hook=hook)
+        return jobs
+
+
+class Slurm(JSONScheduler):
+    name = 'slurm'
+    submit_cmd = 'sbatch --parsable {job_file}'
+    kill_cmd = 'scancel {job_id}'
+    status_cmd = 'squeue --json --job {job_id}'
+    status_table_cmd = 'squeue --json --user $USER'
+    # sbatch --parsable prints job_id or job_id;cluster
+    submit_regex = r'(?:Submitted batch job )?(?P<job_id>\d+)(?:;(?P<cluster>\S+))?$'
+    states = dict(
+        GENERIC_STATES, **{
+            'PENDING': 'queued',
+            'CONFIGURING': 'queued',
+            'RUNNING': 'running',
+            'COMPLETING': 'running',
+            'SUSPENDED': 'suspended',
+            'STOPPED': 'suspended',
+            'COMPLETED': 'completed',
+            'FAILED': 'failed',
+            'BOOT_FAIL': 'node_fail',
+            'NODE_FAIL': 'node_fail',
+            'CANCELLED': 'cancelled',
+            'DEADLINE': 'timeout',
+            'TIMEOUT': 'timeout',
+            'OUT_OF_MEMORY': 'oom',
+            'PREEMPTED': 'preempted',
+            'REQUEUED': 'requeued',
+            'REQUEUE_FED': 'requeued',
+            'REQUEUE_HOLD': 'requeued',
+            'RESV_DEL_HOLD': 'held',
+        })
+
+    def job_from_object(self, obj):
+        # squeue --json has job_state, sacct --json has state.current
+        if 'job_id' not in obj or ('job_state' not in obj and
+                                   'state' not in obj):
+            return None
+        native = obj.get('job_state', obj.get('state'))
+        if isinstance(native, dict):
+            native = native.get('current')
+        if isinstance(native, list):
+            native = native[0] if native else None
+        reason = obj.get('state_reason')
+        if reason is None and isinstance(obj.get('state'), dict):
+            reason = obj['state'].get('reason')
+        exit_code = obj.get('exit_code')
+        if isinstance(exit_code, dict):
+            exit_code = exit_code.get('return_code')
+            if isinstance(exit_code, dict):
+                exit_code = exit_code.get('number') if exit_code.get(
+                    'set', True) else None
+        return obj['job_id'], JobRecord(
+            self.state(native), native, _to_int(exit_code),
+            None if reason in (None, 'None') else reason,
+            obj.get('partition'))
+
+
+class PBSPro(JSONScheduler):
+    name = 'pbspro'
+    submit_cmd = 'qsub {job_file}'
+    kill_cmd = 'qdel {job_id}'
+    status_cmd = 'qstat -f -F json {job_id}'
+    # jobs of the current user only, without the history of finished jobs
+    # (-x) of all users, so finished jobs drop out of the table as they do
+    # from squeue
+    status_table_cmd = 'qstat -f -F json -u $USER'
+
+    def job_from_object(self, obj):
+        # job ids are keys of the Jobs object, not part of job objects
+        if 'job_state' not in obj:
+            return None
+        native = obj['job_state']
+        exit_code = _to_int(obj.get('Exit_status'))
+        state = self.state(native)
+        if state == 'completed' and exit_code not in (None, 0):
+            # PBS Pro reports exit status > 256 for jobs killed by signals
+            # and negative values for jobs killed by the server
+            state = 'failed'
+        return None, JobRecord(state, native, exit_code, obj.get('comment'),
+                               obj.get('queue'))
+
+    def parse_status_table(self, output):
+        jobs = {}
+
+        def hook(obj):
+            job = self.job_from_object(obj)
+            if job is not None:
+                return job[1]
+            if 'Jobs' in obj and isinstance(obj['Jobs'], dict):
+                jobs.update({
+                    k: v
+                    for k, v in obj['Jobs'].items()
+                    if isinstance(v, JobRecord)
+                })
+            return obj
+
+        if output.strip():
+            json.loads(output, object_hook=hook)
+        return jobs
+
+
+class LSF(JSONScheduler):
+    name = 'lsf'
+    submit_cmd = 'bsub < {job_file}'
+    kill_cmd = 'bkill {job_id}'
+    status_cmd = 'bjobs -l {job_id}'
+    status_table_cmd = 'bjobs -a -json -o "jobid stat exit_code exit_reason queue"'
+    submit_regex = r'Job <(?P<job_id>\d+)> is submitted to (?:default )?queue <(?P<queue>[^>]+)>\.?$'
+    states = {
+        'PEND': 'queued',
+        'WAIT': 'queued',
+        'PSUSP': 'held',
+        'RUN': 'running',
+        'USUSP': 'suspended',
+        'SSUSP': 'suspended',
+        'DONE': 'completed',
+        'EXIT': 'failed',
+        'ZOMBI': 'node_fail',
+        'UNKWN': 'unknown',
+    }
+
+    def job_from_object(self, obj):
+        if 'JOBID' not in obj or 'STAT' not in obj:
+            return None
+        native = obj['STAT']
+        reason = obj.get('EXIT_REASON') or None
+        state = self.state(native)
+        if state == 'failed' and reason:
+            # e.g. TERM_MEMLIMIT, TERM_RUNLIMIT, TERM_PREEMPT, TERM_REQUEUE_ADMIN
+            if 'MEMLIMIT' in reason:
+                state = 'oom'
+            elif 'RUNLIMIT' in reason:
+                state = 'timeout'
+            elif 'PREEMPT' in reason:
+                state = 'preempted'
+            elif 'REQUEUE' in reason:
+                state = 'requeued'
+        return obj['JOBID'], JobRecord(state, native,
+                                       _to_int(obj.get('EXIT_CODE')), reason,
+                                       obj.get('QUEUE'))
+
+
+class XMLScheduler(Scheduler):
+    # schedulers without JSON output, parsed with a single streaming pass
+    # over XML elements of jobs
+    job_tag = None
+
+    def job_from_element(self, elem):
+        raise NotImplementedError()
+
+    def parse_status_table(self, output):
+        jobs = {}
+        if not output.strip():
+            return jobs
+        parser = ET.XMLPullParser(events=('end',))
+        parser.feed(output)
+        for _, elem in parser.read_events():
+            if elem.tag == self.job_tag:
+                job_id, record = self.job_from_element(elem)
+                if job_id:
+                    jobs[job_id] = record
+                elem.clear()
+        return jobs
+
+
+class Torque(XMLScheduler):
+    name = 'torque'
+    submit_cmd = 'qsub {job_file}'
+    kill_cmd = 'qdel {job_id}'
+    status_cmd = 'qstat -f {job_id}'
+    # qstat of Torque has no JSON output, but -x outputs XML
+    status_table_cmd = 'qstat -x'
+    job_tag = 'Job'
+
+    def job_from_element(self, elem):
+        native = elem.findtext('job_state')
+        exit_code = _to_int(elem.findtext('exit_status'))
+        state = self.state(native)
+        if state == 'completed' and exit_code not in (None, 0):
+            state = 'failed'
+        return elem.findtext('Job_Id'), JobRecord(state, native, exit_code,
+                                                  elem.findtext('comment'),
+                                                  elem.findtext('queue'))
+
+
+class SGE(XMLScheduler):
+    name = 'sge'
+    submit_cmd = 'qsub -terse {job_file}'
+    kill_cmd = 'qdel {job_id}'
+    status_cmd = 'qstat -j {job_id}'
+    # qstat of SGE has no JSON output, but -xml outputs XML
+    status_table_cmd = 'qstat -xml -u $USER'
+    submit_regex = r'(?P<job_id>\d+)(?:\.\S+)?$'
+    job_tag = 'job_list'
+
+    def job_from_element(self, elem):
+        native = elem.findtext('state')
+        return elem.findtext('JB_job_number'), JobRecord(
+            self.state(native), native, None, None,
+            elem.findtext('queue_name'))
+
+
+SCHEDULERS = {x.name: x for x in (PBSPro, Torque, Slurm, LSF, SGE)}
+# alias
+SCHEDULERS['pbs'] = PBSPro
+
+
+def get_scheduler(name):
+    '''Return the adapter of scheduler name, or None if name is None.'''
+    if name is None:
+        return None
+    try:
+        return SCHEDULERS[name.lower()]()
+    except KeyError:
+        raise ValueError(
+            f'Unsupported scheduler {name}, please use one of {", ".join(sorted(SCHEDULERS))}, or specify commands and patterns directly'
+        )
+
+
+class PatternScheduler(Scheduler):
+    '''Scheduler defined only by status_table_output of the host configuration,
+    for systems without a built-in adapter.'''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def parse_status_table(self, output):
+        return {
+            k: JobRecord(
+                self.state(v.get('status')), v.get('status'),
+                _to_int(v.get('exit_code')), v.get('reason'), v.get('queue'))
+            for k, v in parse_table_with_pattern(output, self.pattern).items()
+        }
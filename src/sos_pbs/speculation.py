@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import shutil
+import statistics
+import threading
+import time
+
+from sos.task_engines import TaskEngine
+from sos.tasks import TaskFile
+from sos.utils import env
+
+from .schedulers import ACTIVE_STATES
+from .transport import ShellTransport
+
+
+def backup_id(task_id):
+    # an id of the same length as the task so that neither id is a prefix of
+    # the other, which sos execute would report as ambiguous
+    return 't' + hashlib.md5(f'{task_id} backup'.encode()).hexdigest()[:max(
+        len(task_id) - 1, 16)]
+
+
+class SpeculativeExecutor(object):
+    '''Run backup copies of straggler tasks.
+
+    Tasks are grouped into batches by their step. Once speculative_after
+    (default 0.9) of the tasks of a batch have completed, a task that has
+    been running for more than speculative_factor times the median runtime
+    of the completed tasks gets a backup, submitted to speculative_queue if
+    specified. sos does not execute a task that is already running, so the
+    backup is a copy of the task with its own id and job.
+
+    The copy that completes first wins and the job of the other copy is
+    cancelled. If the backup wins, its task file, with its result and
+    signatures, replaces that of the task after the job of the task has
+    ended. Both copies write the same output files, so backups should only
+    be used for steps that write their outputs at the end of their tasks.
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        config = engine.config
+        self.factor = float(config['speculative_factor'])
+        self.after = float(config.get('speculative_after', 0.9))
+        self.queue = config.get('speculative_queue', None)
+        # step of each task, and tasks of each step
+        self.batches = {}
+        self.batch_of = {}
+        # time at which tasks are first seen running, and runtimes of
+        # completed tasks of each batch
+        self.started = {}
+        self.runtimes = {}
+        # backup of each task, task of each backup, status of backups from
+        # the last poll, and tasks whose jobs are cancelled for their backups
+        self.backups = {}
+        self.originals = {}
+        self.status = {}
+        self.cancelled = set()
+        self.lock = threading.Lock()
+
+    def track(self, task_id, batch):
+        with self.lock:
+            if task_id in self.originals:
+                return
+            self.batch_of[task_id] = batch
+            self.batches.setdefault(batch, set()).add(task_id)
+
+    def update(self, task_id, status, now=None):
+        '''Record the status of a task and return True if a backup should be
+        submitted for it.'''
+        now = time.time() if now is None else now
+        with self.lock:
+            batch = self.batch_of.get(task_id, None)
+            if batch is None or task_id in self.backups:
+                return False
+            if status == 'running':
+                self.started.setdefault(task_id, now)
+            elif status == 'completed' and task_id in self.started:
+                self.runtimes.setdefault(batch, {})[task_id] = now - self.started.pop(task_id)
+                return False
+            if status != 'running':
+                return False
+            runtimes = self.runtimes.get(batch, {})
+            if not runtimes or len(runtimes) < self.after * len(
+                    self.batches[batch]):
+                return False
+            return now - self.started[task_id] > self.factor * statistics.median(
+                runtimes.values())
+
+    def submit_backup(self, task_id):
+        engine = self.engine
+        job_id = engine._get_job_id(task_id)
+        if not job_id or task_id in self.backups:
+            return False
+        backup = backup_id(task_id)
+        # job files are only needed on the host by the shell transport
+        shell = isinstance(engine.transport, ShellTransport)
+        with self.lock:
+            self.originals[backup] = task_id
+        try:
+            shutil.copyfile(TaskFile(task_id).task_file, TaskFile(backup).task_file)
+            TaskFile(backup).status = 'pending'
+            if not engine.agent.prepare_task(backup):
+                raise RuntimeError('failed to prepare task')
+            overrides = {'queue': self.queue} if self.queue else None
+            runtime, job_file, job_text = engine._render_job(backup, overrides)
+            if shell:
+                engine.agent.send_job_file(job_file)
+            backup_job = engine.transport.submit(backup, runtime, job_text)
+            job_id_file = engine.spool.write_job_id(backup, backup_job)
+            if shell:
+                engine.agent.send_job_file(job_id_file)
+        except Exception as e:
+            with self.lock:
+                self.originals.pop(backup, None)
+            env.logger.warning(f'Failed to submit backup of task {task_id}: {e}')
+            return False
+        # both jobs are cancelled if the task is killed
+        job_id.update({
+            'backup_task': backup,
+            'backup_job_id': backup_job['job_id']
+        })
+        job_id_file = engine.spool.write_job_id(task_id, job_id)
+        if shell:
+            engine.agent.send_job_file(job_id_file)
+        with self.lock:
+            self.backups[task_id] = backup
+        env.logger.info(
+            f'{task_id} ``backup`` {backup} submitted with job {backup_job["job_id"]} for straggler job {job_id["job_id"]}'
+        )
+        return True
+
+    def poll(self):
+        # status of all backups, queried together before the tasks
+        with self.lock:
+            backups = list(self.backups.values())
+        if not backups:
+            return
+        status_lines = TaskEngine.query_tasks(self.engine, backups, verbosity=1)
+        self.status = {
+            x.split('\t')[0]: x.split('\t')[1].strip()
+            for x in status_lines.splitlines()
+            if '\t' in x
+        }
+
+    def resolve(self, task_id, status):
+        '''Return the status of a task with a backup, cancel the job of the
+        copy that loses, and take the result of the backup if it wins.'''
+        backup = self.backups[task_id]
+        backup_status = self.status.get(backup, 'pending')
+        if status == 'completed':
+            self._cancel(backup)
+            self._forget(task_id)
+            return status
+        if backup_status in ('failed', 'aborted', 'missing'):
+            self._forget(task_id)
+            return status
+        if backup_status != 'completed':
+            # the task is not failed while its backup is still active
+            return 'running' if status in ('failed', 'aborted') else status
+        if task_id not in self.cancelled:
+            self._cancel(task_id)
+            self.cancelled.add(task_id)
+            return 'running'
+        # the task file of the task is replaced only after its job has ended
+        job_status = self.engine._get_job_status(task_id)
+        if (status == 'running') if job_status is None else (
+                job_status.state in ACTIVE_STATES):
+            return 'running'
+        try:
+            self._adopt(task_id, backup)
+        except Exception as e:
+            env.logger.warning(
+                f'Failed to take the result of backup {backup} of task {task_id}: {e}')
+            self._forget(task_id)
+            return status
+        self._forget(task_id)
+        env.logger.info(f'{task_id} ``completed`` by its backup {backup}')
+        return 'completed'
+
+    def _cancel(self, task_id):
+        job_id = self.engine._get_job_id(task_id)
+        if not job_id:
+            return
+        job_id = {
+            k: v for k, v in job_id.items()
+            if k not in ('backup_task', 'backup_job_id')
+        }
+        job_id.update({'task': task_id})
+        self.engine.transport.cancel([job_id])
+        env.log_to_file('TASK', f'Cancelled job {job_id["job_id"]} of {task_id}')
+
+    def _adopt(self, task_id, backup):
+        # copy the task file of the backup, with its result and signatures,
+        # to the task locally and on the host
+        self.engine.agent.receive_result(backup)
+        shutil.copyfile(TaskFile(backup).task_file, TaskFile(task_id).task_file)
+        task_file = TaskFile(task_id)
+        task_file.add_result(
+            dict(task_file.result, task=task_id, signature=task_file.signature))
+        self.engine.agent.send_job_file(task_file.task_file)
+
+    def _forget(self, task_id):
+        with self.lock:
+            backup = self.backups.pop(task_id, None)
+            self.originals.pop(backup, None)
+            self.status.pop(backup, None)
+            self.cancelled.discard(task_id)
+            # a task gets at most one backup
+            self.batch_of.pop(task_id, None)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+
+
+class JobSpool(object):
+    '''Local store of job scripts (.sh) and job id files (.job_id).
+
+    Files are kept under {spool_dir}/{kind}/{prefix}/ where prefix is the
+    first shard_width characters of the task id (or workflow job name), so
+    that no single directory has to hold all jobs ever submitted. The
+    leading t of task ids is skipped because it is shared by all tasks. The
+    spool_dir of a queue defaults to ~/.sos and can point to a node-local
+    disk or tmpfs. Files written by earlier versions of sos-pbs directly
+    under ~/.sos/{kind} are still found by lookups.
+    '''
+
+    def __init__(self, config, kind='tasks'):
+        self.kind = kind
+        self.root = os.path.join(
+            os.path.expanduser(config.get('spool_dir', '~/.sos')), kind)
+        self.shard_width = int(config.get('spool_shard_width', 2))
+        self.legacy_dirs = [self.root]
+        legacy_dir = os.path.join(os.path.expanduser('~'), '.sos', kind)
+        if legacy_dir != self.root:
+            self.legacy_dirs.append(legacy_dir)
+
+    def shard_dir(self, name):
+        if self.shard_width <= 0:
+            return self.root
+        # task ids are t followed by hex digits
+        key = name[1:] if name.startswith('t') else name
+        return os.path.join(self.root, key[:self.shard_width])
+
+    def path(self, name, ext, create=False):
+        '''Return the path of file name + ext in the spool, creating its
+        shard directory if create is True.'''
+        shard_dir = self.shard_dir(name)
+        if create:
+            os.makedirs(shard_dir, exist_ok=True)
+        return os.path.join(shard_dir, name + ext)
+
+    def find(self, name, ext):
+        '''Return the path of an existing file name + ext, looking in the
+        sharded location first and then in the flat legacy directories.
+        None is returned if the file does not exist.'''
+        filename = self.path(name, ext)
+        if os.path.isfile(filename):
+            return filename
+        for legacy_dir in self.legacy_dirs:
+            filename = os.path.join(legacy_dir, name + ext)
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def write_job_id(self, name, job_id):
+        job_id_file = self.path(name, '.job_id', create=True)
+        with open(job_id_file, 'w') as job:
+            for k, v in job_id.items():
+                job.write(f'{k}: {v}\n')
+        return job_id_file
+
+    def read_job_id(self, name):
+        job_id_file = self.find(name, '.job_id')
+        if job_id_file is None:
+            return {}
+        with open(job_id_file) as job:
+            result = {}
+            for line in job:
+                if ':' not in line:
+                    continue
+                k, v = line.split(':', 1)
+                result[k.strip()] = v.strip()
+            return result
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# Shell commands that copy input files of a task to a node-local directory
+# before the task is executed, and output files back afterwards. They are
+# available to task_template as {stage_in} and {stage_out}, e.g.
+#
+#   {stage_in}
+#   {command}
+#   {stage_out}
+#
+# The staging directory is exported as SOS_STAGE_DIR and mirrors the
+# working directory of the task: inputs are copied there with their relative
+# (or absolute) paths, or symlinked if they are not on a network file system.
+# Tasks are not moved to the staging directory, so staging is used only for
+# paths that a task reads or writes under $SOS_STAGE_DIR, e.g.
+#
+#   sh:
+#     cd "$SOS_STAGE_DIR"
+#     cat a.txt > out.txt
+#
+# Outputs in the working directory are replaced with symlinks to their paths
+# under $SOS_STAGE_DIR before the task starts, so that sos execute finds the
+# outputs and writes their signatures. Afterwards the outputs are copied back
+# over the symlinks with their modification times, which keeps the
+# signatures valid. Note that the commands are interpolated again with the
+# template so they cannot contain braces.
+
+import shlex
+
+from sos.targets import file_target
+
+# types of network file systems reported by stat -f -c %T, from which inputs
+# are always copied. Unknown types are taken as network file systems.
+NETWORK_FS = ('nfs*', 'cifs', 'smb*', 'gpfs', 'lustre', 'fhgfs', 'beegfs',
+              'panfs', 'ceph', 'afs', 'fuse*', 'gfs*', 'ocfs2', 'UNKNOWN*')
+
+
+def _file_names(targets):
+    if targets is None:
+        return []
+    try:
+        return [str(x) for x in targets if isinstance(x, file_target)]
+    except Exception:
+        # undetermined or otherwise unavailable targets
+        return []
+
+
+def _copy_cmd(names, src, dest, jobs, compress, skip_local):
+    # copy names relative to src (or absolute) to dest, and symlink files
+    # that are not on a network file system
+    files = ' '.join(shlex.quote(x) for x in names)
+    if skip_local:
+        select = (f'for f in {files}; do case "$(stat -f -c %T "$f" 2>/dev/null)" in '
+                  f'{"|".join(NETWORK_FS)}|"") printf \'%s\\0\' "$f";; '
+                  f'*) mkdir -p {dest}/"$(dirname "$f")" && ln -sfn "$(readlink -f "$f")" {dest}/"$f";; '
+                  f'esac; done')
+    else:
+        select = f'for f in {files}; do printf \'%s\\0\' "$f"; done'
+    if compress:
+        return (f'(cd {src} && {select} | tar --null -T - -c{compress}f - 2>/dev/null) | '
+                f'tar -C {dest} -x{compress}f -')
+    return f'(cd {src} && {select} | xargs -0 -r -n 16 -P {jobs} cp --parents -p -t {dest})'
+
+
+def stage_commands(task_id, sos_dict, runtime):
+    '''Return commands (stage_in, stage_out) for a task, which are empty if
+    the task has no input or output files.
+
+    Options stage_dir (default $TMPDIR/sos_stage_{task}, or /tmp if TMPDIR is
+    not set), stage_jobs (number of parallel copies, default 4), and
+    stage_compress (gzip, bzip2, xz, or true for gzip, default to no
+    compression), and stage_skip_local (symlink instead of copy inputs that
+    are not on a network file system, default to True) can be specified in
+    host configuration or task runtime.'''
+    inputs = _file_names(sos_dict.get('_input', None))
+    outputs = _file_names(sos_dict.get('_output', None))
+    if not inputs and not outputs:
+        return '', ''
+    workdir = shlex.quote(runtime.get('workdir', '.'))
+    jobs = int(runtime.get('stage_jobs', 4))
+    compress = {
+        True: 'z',
+        'gzip': 'z',
+        'bzip2': 'j',
+        'xz': 'J'
+    }.get(runtime.get('stage_compress', False), '')
+    if 'stage_dir' in runtime:
+        stage_dir = f'export SOS_STAGE_DIR={shlex.quote(runtime["stage_dir"])}'
+    else:
+        stage_dir = (f'export SOS_STAGE_DIR=$TMPDIR/sos_stage_{task_id}\n'
+                     f'[ -n "$TMPDIR" ] || export SOS_STAGE_DIR=/tmp/sos_stage_{task_id}')
+    stage_in = [
+        '# stage input files to node-local storage', stage_dir,
+        'mkdir -p "$SOS_STAGE_DIR"'
+    ]
+    if inputs:
+        stage_in.append(
+            _copy_cmd(inputs, workdir, '"$SOS_STAGE_DIR"', jobs, compress,
+                      runtime.get('stage_skip_local', True)))
+    #
+    stage_out = ['# copy output files back and clean up']
+    relative = [x for x in outputs if not x.startswith('/')]
+    absolute = [x.lstrip('/') for x in outputs if x.startswith('/')]
+    for names, dest in ((relative, workdir), (absolute, '/')):
+        if not names:
+            continue
+        files = ' '.join(shlex.quote(x) for x in names)
+        # outputs are written to the staging directory through symlinks
+        stage_in.append(
+            f'(cd {dest} && for f in {files}; do mkdir -p "$SOS_STAGE_DIR/$(dirname "$f")" "$(dirname "$f")" && '
+            f'ln -sfn "$SOS_STAGE_DIR/$f" "$f"; done)')
+        # the symlinks are removed even if the task has failed, and inputs
+        # that were symlinked are not outputs written by the task
+        stage_out.append(
+            f'(cd "$SOS_STAGE_DIR" && for f in {files}; do '
+            f'[ "$(readlink {dest}/"$f")" = "$SOS_STAGE_DIR/$f" ] && rm -f {dest}/"$f"; '
+            f'[ -e "$f" ] && [ ! -L "$f" ] && printf \'%s\\0\' "$f"; done '
+            f'| xargs -0 -r -n 16 -P {jobs} cp --parents -p -t {dest})')
+    stage_out.append('rm -rf "$SOS_STAGE_DIR"')
+    return '\n'.join(stage_in), '\n'.join(stage_out)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import getpass
+import json
+import os
+import re
+import threading
+import time
+
+import fasteners
+from sos.utils import env, expand_time
+
+from .schedulers import JobRecord
+
+
+class SchedulerStatusCache(object):
+    '''A snapshot of the job table of a scheduler shared by all sos processes
+    of the same user on the same machine.
+
+    Only one process per (host, user), which holds a file lock, fetches the
+    job table every interval seconds and writes the parsed job table
+    to a snapshot file. All other processes read the snapshot, which is
+    considered stale after ttl seconds. If the polling process exits, another
+    process takes over the lock.'''
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, agent, **kwargs):
+        # one cache per (host, user) in each process
+        key = cls.cache_key(agent.config)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(agent, **kwargs).start()
+            return cls._instances[key]
+
+    @staticmethod
+    def cache_key(config):
+        address = str(config.get('address', 'localhost'))
+        if '@' in address:
+            user, address = address.split('@', 1)
+        else:
+            user = getpass.getuser()
+        return re.sub(r'[^\w.-]', '_', f'{address}-{user}')
+
+    def __init__(self,
+                 agent,
+                 fetch,
+                 interval=60,
+                 ttl=None,
+                 cache_dir='~/.sos/pbs_status'):
+        self.agent = agent
+        # a function that returns the job table as a dictionary of
+        # job_id => JobRecord
+        self.fetch = fetch
+        self.interval = expand_time(interval)
+        self.ttl = self.interval * 3 if ttl is None else expand_time(ttl)
+        cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        key = self.cache_key(agent.config)
+        self.snapshot_file = os.path.join(cache_dir, key + '.json')
+        self._lock = fasteners.InterProcessLock(
+            os.path.join(cache_dir, key + '.lock'))
+        self._is_poller = False
+        # parsed snapshot and the mtime of the file it was read from
+        self._snapshot = None
+        self._snapshot_mtime = None
+
+    def start(self):
+        thread = threading.Thread(target=self._poll, daemon=True)
+        thread.start()
+        return self
+
+    def _poll(self):
+        while True:
+            if not self._is_poller:
+                self._is_poller = self._lock.acquire(blocking=False)
+            if self._is_poller:
+                # refresh only if no other process has just refreshed it,
+                # which can happen right after a takeover
+                snapshot = self._read_snapshot()
+                if snapshot is None or time.time(
+                ) - snapshot['time'] >= self.interval:
+                    self.refresh()
+            time.sleep(self.interval if self._is_poller else
+                       max(self.interval / 2, 1))
+
+    def refresh(self):
+        try:
+            snapshot = {'time': time.time(), 'jobs': self.fetch()}
+        except Exception as e:
+            env.logger.debug(
+                f'Failed to get job table of {self.agent.alias}: {e}')
+            return
+        tmp_file = f'{self.snapshot_file}.{os.getpid()}'
+        with open(tmp_file, 'w') as snap:
+            json.dump(snapshot, snap)
+        os.replace(tmp_file, self.snapshot_file)
+        env.log_to_file(
+            'TASK',
+            f'Updated scheduler status of {len(snapshot["jobs"])} jobs in {self.snapshot_file}'
+        )
+
+    def _read_snapshot(self):
+        try:
+            mtime = os.stat(self.snapshot_file).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime != self._snapshot_mtime:
+            try:
+                with open(self.snapshot_file) as snap:
+                    snapshot = json.load(snap)
+                # records are saved as lists
+                snapshot['jobs'] = {
+                    k: JobRecord(*v) for k, v in snapshot['jobs'].items()
+                }
+                self._snapshot = snapshot
+                self._snapshot_mtime = mtime
+            except ValueError:
+                return None
+        return self._snapshot
+
+    def snapshot(self):
+        '''Return the current snapshot {'time': ..., 'jobs': {job_id: JobRecord}}, or None if
+        there is no snapshot or it is older than ttl.'''
+        snapshot = self._read_snapshot()
+        if snapshot is None or time.time() - snapshot['time'] > self.ttl:
+            return None
+        return snapshot
@@ -3,14 +3,81 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 
+import itertools
+import math
 import os
-import subprocess
+import threading
+import time
+import uuid
+from collections import namedtuple
 
-from sos.utils import env
+from sos.utils import env, expand_size, expand_time, format_HHMMSS
 from sos.eval import cfg_interpolate
 from sos.task_engines import TaskEngine
 from sos.tasks import TaskFile
-from sos.pattern import extract_pattern
+from sos.pattern import extract_pattern, regex
+
+from .backfill import BackfillShaper
+from .broker import SubmissionBroker
+from .checkpoint import CheckpointMonitor, checkpoint_command, checkpoint_directive
+from .compactor import JobFileCompactor
+from .dryrun import BulkDryRun
+from .heartbeat import HeartbeatMonitor
+from .history import RuntimeHistory, runtime_key
+from .job_history import JobHistory, requested_resources
+from .local_pool import LocalPool, shares_filesystem
+from .pilot import PilotPool
+from .relay import RelayClient, inline_command, parse_inline_output
+from .speculation import SpeculativeExecutor
+from .staging import stage_commands
+from .spool import JobSpool
+from .schedulers import (ACTIVE_STATES, JobRecord, PatternScheduler,
+                         failure_reason, get_scheduler)
+from .status_cache import SchedulerStatusCache
+from .transport import ShellTransport, get_transport
+
+# Result of a task returned by iter_kill_tasks and iter_query_tasks. status is
+# the status reported by sos, job_id is the id of the job of the task (None
+# if unknown), and response is the output of kill_cmd, or JobRecord of the
+# job in the job table of the scheduler for status queries.
+TaskRecord = namedtuple('TaskRecord',
+                        ['task_id', 'status', 'job_id', 'response'])
+
+# number of tasks handled by one sos status or kill command
+STREAM_BATCH_SIZE = 1000
+
+
+def _batches(tasks, size):
+    # all tasks are handled at once if they are not specified
+    if not tasks:
+        yield tasks
+        return
+    for i in range(0, len(tasks), size):
+        yield tasks[i:i + size]
+
+
+class _PendingTasks(list):
+    # pending tasks of an engine, kept in submit_order as the base engine
+    # appends tasks to it and takes slots of tasks from its front
+
+    def __init__(self, tasks, engine):
+        super(_PendingTasks, self).__init__(tasks)
+        self.engine = engine
+
+    def append(self, task_id):
+        engine = self.engine
+        if engine.config.get('submit_order', 'fifo') != 'longest_first':
+            return super(_PendingTasks, self).append(task_id)
+        # after all pending tasks that are submitted before it
+        key = engine._order_key(task_id)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < engine._order_key(self[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        self.insert(lo, task_id)
 
 
 class PBS_TaskEngine(TaskEngine):
@@ -37,23 +104,183 @@ class PBS_TaskEngine(TaskEngine):
             raise ValueError(
                 f'A task_template is required for queue {self.alias}')
 
-        if 'submit_cmd' not in self.config:
+        # built-in adapter of the scheduler, which provides default commands
+        # and parsers of machine-readable output
+        self.scheduler = get_scheduler(self.config.get('scheduler', None))
+
+        if 'submit_cmd' in self.config:
+            self.submit_cmd = self.config['submit_cmd']
+        elif self.scheduler is not None:
+            self.submit_cmd = self.scheduler.submit_cmd
+        else:
             raise ValueError(
                 f'Missing configuration submit_cmd for queue {self.alias}')
-        else:
-            self.submit_cmd = self.config['submit_cmd']
 
-        if 'status_cmd' not in self.config:
+        if 'status_cmd' in self.config:
+            self.status_cmd = self.config['status_cmd']
+        elif self.scheduler is not None:
+            self.status_cmd = self.scheduler.status_cmd
+        else:
             raise ValueError(
                 f'Missing configuration status_cmd for queue {self.alias}')
-        else:
-            self.status_cmd = self.config['status_cmd']
 
-        if 'kill_cmd' not in self.config:
+        if 'kill_cmd' in self.config:
+            self.kill_cmd = self.config['kill_cmd']
+        elif self.scheduler is not None:
+            self.kill_cmd = self.scheduler.kill_cmd
+        else:
             raise ValueError(
                 f'Missing configuration kill_cmd for queue {self.alias}')
-        else:
-            self.kill_cmd = self.config['kill_cmd']
+
+        # local copies of job scripts and job id files
+        self.spool = JobSpool(self.config, 'tasks')
+
+        # remove job files of tasks that have completed for a while
+        if 'job_file_retention' in self.config:
+            JobFileCompactor(self, self.config['job_file_retention']).start(
+                self.config.get('job_file_compact_interval', '1d'))
+
+        # submit jobs through a relay process on the remote host
+        self._relay = None
+        self._relay_failed = False
+        if self.config.get('submit_relay', False):
+            # tasks submitted together are sent to the relay in one batch
+            self.batch_size = self.config.get('batch_size', 20)
+
+        # how to talk to the scheduler, by running commands or through REST
+        self.transport = get_transport(self)
+
+        # job table of the scheduler shared by all sessions on this machine
+        self._status_cache = None
+        # the REST transport parses job tables itself
+        table_parser = None
+        if 'status_table_output' in self.config:
+            table_parser = PatternScheduler(
+                self.config['status_table_output']).parse_status_table
+        elif self.scheduler is not None:
+            table_parser = self.scheduler.parse_status_table
+        elif 'status_table_cmd' in self.config:
+            raise ValueError(
+                f'Missing configuration status_table_output for queue {self.alias}'
+            )
+        if 'status_table_cmd' in self.config or self.scheduler is not None or not isinstance(
+                self.transport, ShellTransport):
+            table_cmd = self.config.get(
+                'status_table_cmd',
+                getattr(self.scheduler, 'status_table_cmd', None))
+            self._status_cache = SchedulerStatusCache.get(
+                self.agent,
+                fetch=lambda: self.transport.job_table(table_cmd, table_parser),
+                interval=self.config.get('status_cache_interval', 60),
+                ttl=self.config.get('status_cache_ttl', None))
+
+        # jobs in these states are cancelled and submitted again, optionally
+        # to fallback_queue, at most max_resubmits times per task
+        self.resubmit_states = self.config.get(
+            'resubmit_states', ['preempted', 'requeued', 'node_fail'])
+        if isinstance(self.resubmit_states, str):
+            self.resubmit_states = self.resubmit_states.split()
+        self.max_resubmits = int(self.config.get('max_resubmits', 3))
+        self._resubmit_lock = threading.Lock()
+
+        # jobs killed for exceeding mem or walltime are submitted again with
+        # the option multiplied by retry_factor, up to retry_max_mem and
+        # retry_max_walltime (default to max_mem and max_walltime of the
+        # host), at most max_retries times per task
+        self.retry_factor = float(self.config.get('retry_factor', 2))
+        self.max_retries = int(self.config.get('max_retries', 2))
+
+        # runtimes of completed tasks of each step, records of all submitted
+        # and ended jobs, and tasks submitted by this session whose ends have
+        # not been recorded
+        self._history = RuntimeHistory(
+            self.config,
+            min_samples=int(self.config.get('history_min_samples', 5)))
+        self._jobs = JobHistory(self.config)
+        self._unrecorded = set()
+
+        # reduce walltime of tasks to fit backfill windows
+        self._backfill = None
+        if self.config.get('backfill_shaping', False):
+            self._backfill = BackfillShaper(self)
+
+        # heartbeats of running jobs
+        self._heartbeats = None
+        if 'heartbeat_interval' in self.config:
+            self._heartbeats = HeartbeatMonitor(self)
+
+        # run long tasks that allow it as chains of jobs of checkpoint_segment
+        self._checkpoints = None
+        if 'checkpoint_segment' in self.config:
+            self._checkpoints = CheckpointMonitor(self)
+
+        # number of jobs submitted so far, and sort keys of tasks in
+        # submit_order
+        self._submit_ranks = itertools.count()
+        self._order_keys = {}
+
+        # run short tasks locally when the queue wait is long
+        self._local = None
+        if self.config.get('hybrid_local', False):
+            if shares_filesystem(self.config):
+                self._local = LocalPool(self)
+            else:
+                env.logger.warning(
+                    f'Option hybrid_local of {self.alias} is ignored because the host does not share file systems with the local machine. Set shared_filesystem if it does.'
+                )
+
+        # run tasks in long-running pilot jobs instead of one job per task
+        self._pilots = None
+        if 'pilot_jobs' in self.config:
+            self._pilots = PilotPool(self)
+
+        # share the job limit of the account with other sessions
+        self._broker = None
+        if 'fair_share_limit' in self.config:
+            self._broker = SubmissionBroker(self)
+
+        # check job scripts of tasks locally in dry runs, created with the
+        # first task of a dry run
+        self._dryrun = None
+        self._dryrun_lock = threading.Lock()
+
+        # backup copies of straggler tasks
+        self._speculation = None
+        if 'speculative_factor' in self.config:
+            self._speculation = SpeculativeExecutor(self)
+
+    @property
+    def max_running_jobs(self):
+        # the base engine submits pending tasks while fewer than
+        # max_running_jobs tasks are being submitted or running
+        if getattr(self, '_broker', None) is None:
+            return self._max_running_jobs
+        waiting = len(self.pending_tasks) + sum(
+            len(x) for x in self.submitting_tasks)
+        return min(self._max_running_jobs, self._broker.quota(waiting))
+
+    @max_running_jobs.setter
+    def max_running_jobs(self, value):
+        self._max_running_jobs = value
+
+    @property
+    def pending_tasks(self):
+        return self._pending_tasks
+
+    @pending_tasks.setter
+    def pending_tasks(self, tasks):
+        # the base engine replaces the list as it submits tasks
+        self._pending_tasks = _PendingTasks(tasks, self)
+
+    def submit_task(self, task_id):
+        if self.config.get('bulk_dryrun', False) and env.config.get(
+                'run_mode', 'run') == 'dryrun':
+            self.engine_ready.wait()
+            with self._dryrun_lock:
+                if self._dryrun is None:
+                    self._dryrun = BulkDryRun(self)
+            return self._dryrun.submit(task_id)
+        return super(PBS_TaskEngine, self).submit_task(task_id)
 
     def execute_tasks(self, task_ids):
         #
@@ -61,32 +288,223 @@ class PBS_TaskEngine(TaskEngine):
             return False
 
         try:
-            for task_id in task_ids:
+            task_ids = self._order_tasks(task_ids)
+            if self._local is not None:
+                task_ids = self._run_locally(task_ids)
+            if not task_ids:
+                return True
+            if self._pilots is not None:
+                remaining = self._pilots.enqueue(task_ids)
+                self._unrecorded.update(set(task_ids) - set(remaining))
+                # tasks that do not fit in a pilot are submitted as jobs
+                task_ids = remaining
+                if not task_ids:
+                    return True
+            if self._broker is not None:
+                self._broker.take(task_ids)
+                try:
+                    return self._submit_tasks(task_ids)
+                finally:
+                    self._broker.finish(task_ids)
+            return self._submit_tasks(task_ids)
+        except Exception as e:
+            env.logger.error(str(e))
+            return False
+
+    def _submit_tasks(self, task_ids):
+        if self._get_relay() is not None:
+            return self._submit_with_relay(task_ids)
+        for task_id in task_ids:
+            if not self._prepare_script(task_id):
+                return False
+        return True
+
+    def _task_runtime(self, task_id):
+        # runtime options of a task with defaults from host configuration,
+        # and the name of its step
+        task_file = TaskFile(task_id)
+        sos_dict = task_file.params.sos_dict
+        runtime = dict(self.config, **sos_dict.get('_runtime', {}))
+        runtime.update(task_file.runtime.get('_runtime', {}))
+        return runtime, sos_dict.get('step_name', '')
+
+    def _estimate_runtime(self, task_id):
+        # return (priority, estimated runtime in seconds) of a task
+        task_runtime, _ = self._task_runtime(task_id)
+        priority = float(task_runtime.get('priority', 0))
+        # median runtime of completed tasks of the same step, if known
+        estimate = self._history.estimate(
+            runtime_key(TaskFile(task_id).params), 0.5)
+        if estimate is not None:
+            return priority, estimate
+        walltime = task_runtime.get('walltime')
+        return priority, 0 if walltime is None else expand_time(walltime)
+
+    def _queue_wait(self):
+        # queue_wait of the host, or the median queue wait of recent jobs
+        if 'queue_wait' in self.config:
+            return expand_time(self.config['queue_wait'])
+        return self._history.estimate(
+            f'@wait:{self.config.get("queue", self.alias)}', 0.5)
+
+    def _run_locally(self, task_ids):
+        # run tasks that would finish before they start on the cluster in
+        # the local pool, and return the other tasks
+        wait = self._queue_wait()
+        remaining = []
+        for task_id in task_ids:
+            try:
+                runtime, step = self._task_runtime(task_id)
+                _, estimate = self._estimate_runtime(task_id)
+                if not self._local.accepts(runtime, estimate, wait):
+                    remaining.append(task_id)
+                    continue
+                self._record_submit(task_id, {'job_id': 'local'},
+                                    dict(runtime, queue='local', step_name=step))
+                self._local.submit(task_id, runtime, estimate)
+            except Exception as e:
+                env.logger.debug(f'Failed to run {task_id} locally: {e}')
+                remaining.append(task_id)
+        return remaining
+
+    def _order_key(self, task_id):
+        # tasks with higher priority and longer runtime are submitted first
+        # so that long tasks do not end up at the end of the queue
+        if task_id not in self._order_keys:
+            try:
+                priority, estimate = self._estimate_runtime(task_id)
+            except Exception as e:
+                env.logger.debug(f'Failed to estimate runtime of {task_id}: {e}')
+                priority, estimate = 0, 0
+            self._order_keys[task_id] = (-priority, -estimate)
+        return self._order_keys[task_id]
+
+    def _order_tasks(self, task_ids):
+        # tasks are queued in submit_order (see _PendingTasks), and tasks of
+        # a batch are sorted again for tasks that are not queued by the base
+        # engine
+        order = self.config.get('submit_order', 'fifo')
+        if order not in ('fifo', 'longest_first'):
+            raise ValueError(
+                f'Unsupported submit_order {order} for queue {self.alias}, should be fifo or longest_first'
+            )
+        if order == 'longest_first':
+            task_ids = sorted(task_ids, key=self._order_key)
+        return task_ids
+
+    def _get_relay(self):
+        # start the submission relay on the remote host if requested
+        if not self.config.get('submit_relay', False) or self._relay_failed or not isinstance(
+                self.transport, ShellTransport):
+            return None
+        if self._relay is not None and self._relay.is_alive():
+            return self._relay
+        try:
+            self._relay = RelayClient(
+                self.agent, self.config.get('relay_python', 'python3')).start()
+            env.log_to_file('TASK', f'Submission relay started on {self.alias}')
+            return self._relay
+        except Exception as e:
+            env.logger.warning(
+                f'Failed to start submission relay on {self.alias}, submitting tasks directly: {e}'
+            )
+            self._relay_failed = True
+            return None
+
+    def _submit_with_relay(self, task_ids):
+        requests = []
+        runtimes = {}
+        # written to job id files on the host so that jobs submitted by a
+        # relay that fails can be told from jobs of earlier submissions
+        token = uuid.uuid4().hex
+        for task_id in task_ids:
+            runtime, job_file, job_text = self._render_job(task_id)
+            if runtime['run_mode'] == 'dryrun':
                 if not self._prepare_script(task_id):
                     return False
+                continue
+            runtimes[task_id] = runtime
+            requests.append({
+                'task_id': task_id,
+                'job_file': runtime['job_file'],
+                'script': job_text,
+                'cmd': self._get_submit_cmd(runtime),
+                'pattern': self._get_submit_regex(),
+                'job_id_file': f'~/.sos/tasks/{task_id}.job_id',
+                'extra': {'submission': token},
+            })
+        if not requests:
             return True
+        try:
+            results = self._relay.submit(requests)
         except Exception as e:
-            env.logger.error(str(e))
-            return False
+            env.logger.warning(
+                f'Submission relay on {self.alias} failed, submitting tasks directly: {e}'
+            )
+            self._relay.close()
+            self._relay_failed = True
+            # the relay might have submitted some of the jobs
+            submitted = self._submitted_by_relay(runtimes, token)
+            for task_id, job_id in submitted.items():
+                self._record_submit(task_id, job_id, runtimes[task_id])
+                self._record_job_id(task_id, job_id, send_to_host=False)
+            return all(
+                self._prepare_script(x) for x in runtimes if x not in submitted)
+        # record all submitted jobs before reporting failed ones
+        errors = []
+        for res in results:
+            if 'error' in res:
+                errors.append(f'{res["task_id"]}: {res["error"]}')
+                continue
+            self._record_submit(res['task_id'], res['fields'],
+                                runtimes[res['task_id']])
+            # the relay has written the job id file on the remote host
+            self._record_job_id(
+                res['task_id'], res['fields'], send_to_host=False)
+        if errors:
+            raise RuntimeError(f'Failed to submit tasks {"; ".join(errors)}')
+        return True
+
+    def _submitted_by_relay(self, task_ids, token):
+        # job ids of tasks with job id files written by the relay with token
+        output = self.agent.check_output(
+            'cd ~/.sos/tasks && grep -H . ' +
+            ' '.join(f'{x}.job_id' for x in task_ids) + ' 2>/dev/null; true')
+        fields = {}
+        for line in output.splitlines():
+            task_id, sep, field = line.partition('.job_id:')
+            key, _, value = field.partition(':')
+            if sep and key.strip():
+                fields.setdefault(task_id, {})[key.strip()] = value.strip()
+        return {
+            task_id: {k: v for k, v in job_id.items() if k != 'submission'}
+            for task_id, job_id in fields.items()
+            if job_id.get('submission') == token and 'job_id' in job_id
+        }
 
-    def _prepare_script(self, task_id):
+    def _render_job(self, task_id, overrides=None):
         # read the task file and look for runtime info
         #
         task_runtime = TaskFile(task_id).runtime
+        sos_dict = TaskFile(task_id).params.sos_dict
         # individual task can have its own _runtime in sos_dict
-        for x,y in TaskFile(task_id).params.sos_dict.get('_runtime', {}).items():
+        for x,y in sos_dict.get('_runtime', {}).items():
             if x not in task_runtime['_runtime']:
                 task_runtime['_runtime'][x] = y
 
         # for this task, we will need walltime, nodes, cores, mem
         # however, these could be fixed in the job template and we do not need to have them all in the runtime
-        runtime = self.config
+        # a copy so that options of one task do not leak to the next
+        runtime = dict(self.config)
         # we also use saved verbosity and sig_mode because the current sig_mode might have been changed
         # (e.g. in Jupyter) after the job is saved.
 
         # task_runtime['_runtime'] can contain arbitrary keyword parameter that could override
         # self.config from configuration files.
         runtime.update(task_runtime['_runtime'])
+        # e.g. queue of resubmitted jobs
+        if overrides:
+            runtime.update(overrides)
         # workdir should exist, cur_dir is kept for backward compatibility
         runtime['cur_dir'] = runtime['workdir']
         if 'name' in task_runtime['_runtime']:
@@ -94,16 +512,57 @@ class PBS_TaskEngine(TaskEngine):
                 "Runtime option name is deprecated. Please use tags to keep track of task names."
             )
         runtime['task'] = task_id
+        runtime['step_name'] = sos_dict.get('step_name', '')
+        if self._speculation is not None:
+            self._speculation.track(task_id, runtime['step_name'])
+        # the order in which the job is submitted, available to templates
+        # as submit_rank, e.g. for --nice
+        runtime['submit_rank'] = next(self._submit_ranks)
+        self._order_keys.pop(task_id, None)
+        dryrun = runtime['run_mode'] == 'dryrun'
         # job_name is recommended because of compatibility with workflow_template
         runtime['job_name'] = task_id
         runtime[
             'command'] = f'{runtime.get("sos", "sos")} execute {task_id} -v {runtime["verbosity"]} -s {runtime["sig_mode"]} -m {runtime["run_mode"]}'
+        runtime['checkpoint_directive'] = ''
+        segmented = False
+        # only tasks that trap checkpoint_signal opt in with checkpoint=True
+        if self._checkpoints is not None and runtime.get(
+                'walltime') is not None and task_runtime['_runtime'].get(
+                    'checkpoint', False):
+            seconds = expand_time(runtime['checkpoint_segment'])
+            if expand_time(runtime['walltime']) > seconds:
+                segmented = True
+                warning = min(self._checkpoints.warning, seconds // 2)
+                runtime['segment'] = int(runtime.get('segment', 0))
+                runtime['walltime'] = format_HHMMSS(seconds)
+                runtime['command'] = checkpoint_command(
+                    task_id, runtime['command'], runtime['segment'],
+                    seconds - warning, self._checkpoints.signal)
+                runtime['checkpoint_directive'] = checkpoint_directive(
+                    getattr(self.scheduler, 'name', None),
+                    self._checkpoints.signal, warning)
         if 'nodes' not in runtime:
             runtime['nodes'] = 1
         if 'cores' not in runtime:
             runtime['cores'] = 1
         # for backward compatibility
         runtime['job_file'] = f'~/.sos/tasks/{task_id}.sh'
+        if 'stage_in' in self.task_template or 'stage_out' in self.task_template:
+            runtime['stage_in'], runtime['stage_out'] = stage_commands(
+                task_id, sos_dict, runtime)
+        # dry runs do not probe the scheduler, and the walltime requested by
+        # a task is only reduced if the task allows it with backfill=True
+        if self._backfill is not None and not segmented and not dryrun and (
+                'walltime' not in task_runtime['_runtime'] or
+                runtime.get('backfill', False)):
+            walltime = self._backfill.shape(
+                runtime,
+                self._history.estimate(runtime_key(TaskFile(task_id).params)))
+            if walltime is not None:
+                env.logger.debug(
+                    f'Walltime of {task_id} reduced from {runtime["walltime"]} to {walltime} to fit a backfill window')
+                runtime['walltime'] = walltime
 
         # let us first prepare a task file
         try:
@@ -113,46 +572,23 @@ class PBS_TaskEngine(TaskEngine):
                 f'Failed to generate job file for task {task_id}: {e}')
 
         # now we need to write a job file
-        job_file = os.path.join(
-            os.path.expanduser('~'), '.sos', 'tasks', task_id + '.sh')
+        job_file = self.spool.path(task_id, '.sh', create=True)
         # do not translate newline under windows because the script will be executed
         # under linux/mac
         with open(job_file, 'w', newline='') as job:
             job.write(job_text)
+        return runtime, job_file, job_text
 
-        # then copy the job file to remote host if necessary
-        self.agent.send_job_file(job_file)
-
-        if runtime['run_mode'] == 'dryrun':
-            try:
-                cmd = f'bash ~/.sos/tasks/{task_id}.sh'
-                print(self.agent.check_output(cmd))
-            except Exception as e:
-                raise RuntimeError(f'Failed to submit task {task_id}: {e}')
-            return
-        #
+    def _get_submit_cmd(self, runtime):
         # now we need to figure out a command to submit the task
         try:
-            cmd = cfg_interpolate(self.submit_cmd, runtime)
+            return cfg_interpolate(self.submit_cmd, runtime)
         except Exception as e:
             raise ValueError(
                 f'Failed to generate job submission command from template "{self.submit_cmd}": {e}'
             )
-        env.logger.debug(f'submit {task_id}: {cmd}')
-        try:
-            # There was an option
-            cmd_output = self.agent.check_output(cmd).strip()
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(
-                f'Failed to submit task {task_id}:\n{e.output.decode()}')
-        except Exception as e:
-            raise RuntimeError(f'Failed to submit task {task_id}:\n{e}')
-
-        if not cmd_output:
-            raise RuntimeError(
-                f'Failed to submit task {task_id} with command {cmd}. No output returned.'
-            )
 
+    def _get_submit_cmd_output(self):
         if 'submit_cmd_output' not in self.config:
             submit_cmd_output = '{job_id}'
         else:
@@ -162,47 +598,451 @@ class PBS_TaskEngine(TaskEngine):
             raise ValueError(
                 f'Option submit_cmd_output should have at least a pattern for job_id, "{submit_cmd_output}" specified.'
             )
+        return submit_cmd_output
 
-        #
+    def _get_submit_regex(self):
+        # regular expression used by the relay to extract job_id
+        if 'submit_cmd_output' not in self.config and self.scheduler is not None:
+            return self.scheduler.submit_regex
+        return regex(self._get_submit_cmd_output())
+
+    def _parse_submit_output(self, cmd_output):
         # try to extract job_id from command output
+        if 'submit_cmd_output' not in self.config and self.scheduler is not None:
+            res = self.scheduler.parse_submit_output(cmd_output)
+            if res is not None:
+                return res
+        submit_cmd_output = self._get_submit_cmd_output()
+        res = extract_pattern(submit_cmd_output, [cmd_output.strip().splitlines()[-1]])
+        if 'job_id' not in res or len(
+                res['job_id']) != 1 or res['job_id'][0] is None:
+            raise RuntimeError(
+                f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{submit_cmd_output}"'
+            )
+        # other variables
+        return {k: v[0] for k, v in res.items()}
+
+    def _prepare_script(self, task_id, overrides=None, history=None):
+        runtime, job_file, job_text = self._render_job(task_id, overrides)
+
+        if self.config.get('inline_submit', False) and runtime[
+                'run_mode'] != 'dryrun' and isinstance(self.transport,
+                                                       ShellTransport):
+            return self._submit_inline(task_id, runtime, job_text, history)
+
+        # then copy the job file to remote host if necessary. The REST
+        # transport sends the script with the job and needs no job files on
+        # the host, except to print the script in dryrun mode
+        shell = isinstance(self.transport, ShellTransport)
+        if shell or runtime['run_mode'] == 'dryrun':
+            self.agent.send_job_file(job_file)
+
+        if runtime['run_mode'] == 'dryrun':
+            try:
+                cmd = f'bash ~/.sos/tasks/{task_id}.sh'
+                print(self.agent.check_output(cmd))
+            except Exception as e:
+                raise RuntimeError(f'Failed to submit task {task_id}: {e}')
+            return
+        #
+        job_id = self.transport.submit(task_id, runtime, job_text)
+        if history:
+            job_id.update(history)
+        self._record_submit(task_id, job_id, runtime,
+                            'resubmitted' if history else 'submitted')
+        #
         # let us write an job_id file so that we can check status of tasks more easily
-        job_id_file = os.path.join(
-            os.path.expanduser('~'), '.sos', 'tasks', task_id + '.job_id')
-        with open(job_id_file, 'w') as job:
-            res = extract_pattern(submit_cmd_output, [cmd_output.strip().splitlines()[-1]])
-            if 'job_id' not in res or len(
-                    res['job_id']) != 1 or res['job_id'][0] is None:
-                raise RuntimeError(
-                    f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{submit_cmd_output}"'
-                )
-            else:
-                job_id = res['job_id'][0]
-                # other variables
-                for k, v in res.items():
-                    job.write(f'{k}: {v[0]}\n')
+        return self._record_job_id(task_id, job_id, send_to_host=shell)
+
+    def _submit_inline(self, task_id, runtime, job_text, history=None):
+        # write the job file, submit it, and write the job id file on the
+        # remote host with a single command
+        request = {
+            'task_id': task_id,
+            'job_file': runtime['job_file'],
+            'script': job_text,
+            'cmd': self._get_submit_cmd(runtime),
+            'pattern': self._get_submit_regex(),
+            'job_id_file': f'~/.sos/tasks/{task_id}.job_id',
+            'extra': history or {},
+        }
+        env.logger.debug(f'submit {task_id} inline: {request["cmd"]}')
+        try:
+            res = parse_inline_output(
+                self.agent.check_output(
+                    inline_command(request,
+                                   self.config.get('relay_python', 'python3'))))
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit task {task_id}: {e}')
+        if 'error' in res:
+            raise RuntimeError(f'Failed to submit task {task_id}: {res["error"]}')
+        job_id = dict(res['fields'], **(history or {}))
+        self._record_submit(task_id, job_id, runtime,
+                            'resubmitted' if history else 'submitted')
+        return self._record_job_id(task_id, job_id, send_to_host=False)
+
+    def _record_submit(self, task_id, job_id, runtime, status='submitted'):
+        # add a submit record of the job to the job history
+        self._unrecorded.add(task_id)
+        if self._broker is not None:
+            self._broker.submitted(task_id, job_id['job_id'])
+        self._jobs.record(
+            'submit',
+            kind='task',
+            name=task_id,
+            job_id=job_id['job_id'],
+            queue=runtime.get('queue', self.alias),
+            step=runtime.get('step_name', ''),
+            status=status,
+            submit_time=round(time.time(), 1),
+            **requested_resources(runtime))
+
+    def _record_job_id(self, task_id, job_id, send_to_host=True):
+        job_id_file = self.spool.write_job_id(task_id, job_id)
         try:
             # Send job id files to remote host so that
             # 1. the job could be properly killed (with job_id) on remote host (not remotely)
             # 2. the job status could be perperly probed in case the job was not properly submitted (#911)
-            self.agent.send_job_file(job_id_file)
+            if send_to_host:
+                self.agent.send_job_file(job_id_file)
             # output job id to stdout
             env.logger.info(
-                f'{task_id} ``submitted`` to {self.alias} with job id {job_id}')
+                f'{task_id} ``submitted`` to {self.alias} with job id {job_id["job_id"]}')
             return True
         except Exception as e:
             raise RuntimeError(f'Failed to submit task {task_id}: {e}')
 
     def _get_job_id(self, task_id):
-        job_id_file = os.path.join(
-            os.path.expanduser('~'), '.sos', 'tasks', task_id + '.job_id')
-        if not os.path.isfile(job_id_file):
-            return {}
-        with open(job_id_file) as job:
-            result = {}
-            for line in job:
-                k, v = line.split(':', 1)
-                result[k.strip()] = v.strip()
-            return result
+        return self.spool.read_job_id(task_id)
+
+    def _get_job_status(self, task_id):
+        # return the JobRecord of the job of the task in the shared job
+        # table, or None if the status is unknown
+        if self._status_cache is None:
+            return None
+        snapshot = self._status_cache.snapshot()
+        job_id = self._get_job_id(task_id)
+        if snapshot is None or not job_id:
+            return None
+        record = snapshot['jobs'].get(job_id['job_id'], JobRecord('missing'))
+        return record
+
+    def _is_job_lost(self, task_id):
+        # a job submitted well before the last snapshot that is no longer
+        # known to the scheduler died before sos could start the task (#608)
+        if self._status_cache is None:
+            return False
+        snapshot = self._status_cache.snapshot()
+        job_id = self._get_job_id(task_id)
+        if snapshot is None or not job_id or job_id['job_id'] in snapshot['jobs']:
+            return False
+        job_id_file = self.spool.find(task_id, '.job_id')
+        return os.path.getmtime(
+            job_id_file) < snapshot['time'] - self._status_cache.interval
+
+    def _scaled_resource(self, task_id, job_id, key):
+        # mem or walltime of the last job of a task multiplied by
+        # retry_factor, or None if it cannot be increased
+        current = job_id.get(key)
+        if current is None:
+            current = self._task_runtime(task_id)[0].get(key)
+        if current is None:
+            return None
+        cap = self.config.get(f'retry_max_{key}',
+                              self.config.get(f'max_{key}', None))
+        if key == 'mem':
+            expand = lambda x: int(x) if str(x).isdigit() else expand_size(x)
+        else:
+            expand = expand_time
+        value = expand(current) * self.retry_factor
+        if cap is not None:
+            value = min(value, expand(cap))
+        if value <= expand(current):
+            return None
+        return int(value) if key == 'mem' else format_HHMMSS(int(value))
+
+    def _resubmit(self, task_id, job_status, reason=None, scale=None):
+        # cancel and submit again a job that has been preempted, requeued,
+        # or lost with its node, or, with scale, a job that has been killed
+        # for exceeding mem or walltime, with the option increased
+        reason = job_status.state if reason is None else reason
+        with self._resubmit_lock:
+            job_id = self._get_job_id(task_id)
+            if not job_id or self._get_job_status(task_id) != job_status:
+                # resubmitted by another thread
+                return False
+            counter, limit = ('retries', self.max_retries) if scale else (
+                'resubmits', self.max_resubmits)
+            count = int(job_id.get(counter, 0))
+            if count >= limit:
+                env.logger.warning(
+                    f'Job {job_id["job_id"]} of task {task_id} is {reason}, but it has been resubmitted {count} times'
+                )
+                return False
+            # mem and walltime increased for earlier jobs are kept
+            overrides = {
+                k: job_id[k] for k in ('mem', 'walltime') if k in job_id
+            }
+            if scale:
+                value = self._scaled_resource(task_id, job_id, scale)
+                if value is None:
+                    env.logger.warning(
+                        f'Job {job_id["job_id"]} of task {task_id} is {reason}, but its {scale} cannot be increased'
+                    )
+                    return False
+                overrides[scale] = value
+            else:
+                job_id.update({'task': task_id})
+                self.transport.cancel([job_id])
+                if 'fallback_queue' in self.config:
+                    overrides['queue'] = self.config['fallback_queue']
+            history = {
+                k: v for k, v in job_id.items() if k in ('resubmits', 'retries')
+            }
+            history.update(overrides)
+            history.update({
+                'previous_job_ids':
+                    ' '.join(job_id.get('previous_job_ids', '').split() +
+                             [job_id['job_id']]),
+                'previous_reasons':
+                    ' '.join(job_id.get('previous_reasons', '').split() +
+                             [reason.replace(' ', '_')]),
+                counter:
+                    count + 1,
+            })
+            history.pop('queue', None)
+            try:
+                # reset the task on the execution host, where the killed
+                # job might have left it running or failed
+                if not self.agent.prepare_task(task_id):
+                    raise RuntimeError('failed to prepare task')
+                self._prepare_script(task_id, overrides, history)
+            except Exception as e:
+                env.logger.warning(
+                    f'Failed to resubmit {reason} task {task_id}: {e}'
+                )
+                return False
+            if scale:
+                env.logger.info(
+                    f'{task_id} ``resubmitted`` with {scale} {overrides[scale]} after job {job_id["job_id"]} was killed for {reason}'
+                )
+            else:
+                env.logger.info(
+                    f'{task_id} ``resubmitted`` to {overrides.get("queue", self.alias)} after job {job_id["job_id"]} was {reason}'
+                )
+            return True
+
+    def _continue_task(self, task_id, status, segment):
+        # submit the next segment of a task after the job of a signalled
+        # segment has ended
+        with self._resubmit_lock:
+            job_id = self._get_job_id(task_id)
+            if not job_id or int(job_id.get('segment', 0)) != segment:
+                # not the current segment, or continued by another thread
+                return False
+            if status != 'failed':
+                job_status = self._get_job_status(task_id)
+                if job_status is None or job_status.state in ACTIVE_STATES:
+                    return False
+            # by default as many segments as needed for the walltime of the
+            # task, without the time reserved for writing checkpoints
+            runtime, _ = self._task_runtime(task_id)
+            seconds = expand_time(runtime['checkpoint_segment'])
+            useful = seconds - min(self._checkpoints.warning, seconds // 2)
+            max_segments = int(
+                runtime.get('max_segments',
+                            math.ceil(expand_time(runtime['walltime']) / useful)))
+            if segment + 1 >= max_segments:
+                env.logger.warning(
+                    f'Task {task_id} has not completed after {segment + 1} segments'
+                )
+                return False
+            history = {
+                k: v for k, v in job_id.items() if k in ('resubmits', 'retries')
+            }
+            history.update({
+                'previous_job_ids':
+                    ' '.join(job_id.get('previous_job_ids', '').split() +
+                             [job_id['job_id']]),
+                'previous_reasons':
+                    ' '.join(job_id.get('previous_reasons', '').split() +
+                             ['checkpoint']),
+                'segment':
+                    segment + 1,
+            })
+            try:
+                # the task has been killed or failed on the execution host
+                if not self.agent.prepare_task(task_id):
+                    raise RuntimeError('failed to prepare task')
+                self._prepare_script(task_id, {'segment': segment + 1}, history)
+            except Exception as e:
+                env.logger.warning(
+                    f'Failed to submit segment {segment + 1} of task {task_id}: {e}')
+                return False
+            env.logger.info(
+                f'{task_id} ``continued`` with segment {segment + 1} after job {job_id["job_id"]}')
+            return True
+
+    def _update_status(self, task_id, status):
+        # act on the status of a task reported by sos and return the status
+        # corrected with the job table of the scheduler
+        if self._local is not None and self._local.status(task_id) is not None:
+            status = self._local.status(task_id)
+            if status == 'failed':
+                self._record_end(task_id, status)
+            return status
+        if self._speculation is not None and task_id in self._speculation.backups:
+            status = self._speculation.resolve(task_id, status)
+            if status in ('completed', 'failed', 'aborted'):
+                self._record_end(task_id, status)
+            return status
+        if status in ('submitted', 'running', 'failed'):
+            job_status = self._get_job_status(task_id)
+            reason = failure_reason(job_status)
+            if reason in ('oom', 'timeout') and self._resubmit(
+                    task_id, job_status, reason,
+                    'mem' if reason == 'oom' else 'walltime'):
+                status = 'submitted'
+            elif status != 'failed' and job_status is not None and job_status.state in self.resubmit_states and self._resubmit(
+                    task_id, job_status):
+                status = 'submitted'
+        if self._heartbeats is not None:
+            if status != 'running':
+                self._heartbeats.forget(task_id)
+            elif self._heartbeats.stale(task_id):
+                env.logger.warning(
+                    f'Job of task {task_id} is suspected dead because its heartbeat is older than {self._heartbeats.timeout} seconds'
+                )
+                if self._resubmit(task_id, self._get_job_status(task_id),
+                                  'suspected dead'):
+                    self._heartbeats.forget(task_id)
+                    status = 'submitted'
+        if self._checkpoints is not None:
+            segment = self._checkpoints.markers().get(task_id)
+            if segment is not None and status == 'completed':
+                self._checkpoints.clear(task_id)
+            elif segment is not None and self._continue_task(
+                    task_id, status, segment):
+                status = 'submitted'
+        if status == 'submitted' and self._is_job_lost(task_id):
+            env.logger.warning(
+                f'Job of task {task_id} is no longer known to the scheduler of {self.alias}'
+            )
+            status = 'failed'
+        if self._speculation is not None and self._speculation.update(
+                task_id, status):
+            self._speculation.submit_backup(task_id)
+        if status in ('completed', 'failed', 'aborted'):
+            self._record_end(task_id, status)
+        return status
+
+    def query_tasks(self,
+                    tasks=None,
+                    check_all=False,
+                    verbosity=1,
+                    html=False,
+                    **kwargs):
+        if self._pilots is not None:
+            # replace pilots that have exited while tasks are queued
+            self._pilots.scale()
+        if self._speculation is not None:
+            self._speculation.poll()
+        status_lines = super(PBS_TaskEngine, self).query_tasks(
+            tasks, check_all, verbosity, html, **kwargs)
+        if html or verbosity not in (1, 2, 3):
+            return status_lines
+        lines = [line.split('\t') for line in status_lines.splitlines()]
+        if self._heartbeats is not None:
+            self._heartbeats.watch(
+                x[0] for x in lines if x[-1].strip() == 'running')
+        res = []
+        for fields in lines:
+            status = fields[-1].strip()
+            new_status = self._update_status(fields[0], status)
+            if new_status != status:
+                fields[-1] = new_status
+            res.append('\t'.join(fields) + '\n')
+        return ''.join(res)
+
+    def iter_query_tasks(self,
+                         tasks=None,
+                         batch_size=STREAM_BATCH_SIZE,
+                         **kwargs):
+        '''Query the status of tasks with sos status, batch_size tasks at a
+        time, and yield a TaskRecord for each task.'''
+        if self._speculation is not None:
+            self._speculation.poll()
+        for batch in _batches(tasks, batch_size):
+            status_lines = super(PBS_TaskEngine, self).query_tasks(
+                batch, verbosity=1, **kwargs)
+            lines = [
+                line.split('\t')[:2]
+                for line in status_lines.splitlines()
+                if '\t' in line
+            ]
+            if self._heartbeats is not None:
+                self._heartbeats.watch(
+                    x[0] for x in lines if x[1].strip() == 'running')
+            for task_id, status in lines:
+                status = self._update_status(task_id, status.strip())
+                yield TaskRecord(task_id, status,
+                                 self._get_job_id(task_id).get('job_id'),
+                                 self._get_job_status(task_id))
+
+    def _record_end(self, task_id, status):
+        # record the runtime of a completed task, and the end of its job in
+        # the job history, once for each task submitted by this session so
+        # that tasks of other and earlier sessions are not recorded again
+        if task_id not in self._unrecorded:
+            return
+        self._unrecorded.discard(task_id)
+        if self._broker is not None:
+            self._broker.release(task_id)
+        try:
+            task_file = TaskFile(task_id)
+            runtime, step = self._task_runtime(task_id)
+            queue = runtime.get('queue', self.alias)
+            job_id = self._get_job_id(task_id)
+            if self._local is not None and task_id in self._local.tasks:
+                self._local.tasks.discard(task_id)
+                queue = 'local'
+                job_id = {'job_id': 'local'}
+            _, _, start, duration = task_file.tags_created_start_and_duration()
+            if status == 'completed' and start and duration:
+                self._history.record(runtime_key(task_file.params), duration)
+            result = task_file.result if status != 'aborted' else {}
+            if not isinstance(result, dict):
+                result = {}
+            job_id_file = self.spool.find(task_id, '.job_id')
+            if job_id_file is not None and start:
+                # queue waits of jobs are used to decide if tasks should be
+                # run locally
+                self._history.record(f'@wait:{queue}',
+                                     max(start - os.path.getmtime(job_id_file), 0))
+            self._jobs.record(
+                'end',
+                kind='task',
+                name=task_id,
+                job_id=job_id.get('job_id', ''),
+                queue=queue,
+                step=step,
+                status=status,
+                submit_time='' if job_id_file is None else round(
+                    os.path.getmtime(job_id_file), 1),
+                start_time=round(result.get('start_time') or start or 0, 1) or '',
+                end_time=round(
+                    result.get('end_time') or
+                    (start + duration if start and duration else 0), 1) or '',
+                peak_cpu=result.get('peak_cpu', ''),
+                peak_mem=result.get('peak_mem', ''),
+                **requested_resources(runtime))
+        except Exception as e:
+            env.logger.debug(f'Failed to record end of {task_id}: {e}')
+
+    def compact_job_files(self, retention=None):
+        if retention is None:
+            retention = self.config.get('job_file_retention', '30d')
+        return JobFileCompactor(self, retention).compact()
 
 
 #     def _query_job_status(self, job_id, task_id):
@@ -273,33 +1113,63 @@ class PBS_TaskEngine(TaskEngine):
 #                     f'Failed to get status of task {task_id} (job_id: {job_id}) from template "{self.status_cmd}": {e}')
 #         return res
 
-    def kill_tasks(self, tasks, **kwargs):
-        # remove the task from SoS task queue, this would also give us a list of
-        # tasks on the remote server
-        output = super(PBS_TaskEngine, self).kill_tasks(tasks, **kwargs)
-        # then we call the real PBS commands to kill tasks
-        res = ''
-        for line in output.split('\n'):
-            if not line.strip():
-                continue
-            task_id, status = line.split('\t')
-            res += f'{task_id}\t{status}\t'
-            # only run kill_cmd on killed or aborted jobs
-            if status.strip() not in ('killed', 'aborted'):
-                res += '.\n'
-                continue
-
-            job_id = self._get_job_id(task_id)
-            if not job_id:
-                env.logger.debug(f'No job_id for task {task_id}')
-                continue
-            try:
+    def iter_kill_tasks(self, tasks, batch_size=STREAM_BATCH_SIZE, **kwargs):
+        '''Kill tasks with sos kill and cancel their jobs, batch_size tasks
+        at a time, and yield a TaskRecord for each task. response is the
+        output of kill_cmd, or None if no job is cancelled.'''
+        if kwargs.get('all_tasks', False):
+            # the list of tasks is decided by the base class
+            batches = [tasks]
+        else:
+            batches = _batches(tasks, batch_size)
+        for batch in batches:
+            # remove the task from SoS task queue, this would also give us a list of
+            # tasks on the remote server
+            if self._local is not None:
+                self._local.kill(batch or None)
+            output = super(PBS_TaskEngine, self).kill_tasks(batch, **kwargs)
+            if self._pilots is not None:
+                # tasks that have not been claimed by pilots
+                self._pilots.dequeue(
+                    [x.split('\t')[0] for x in output.splitlines() if '\t' in x])
+            killed = []
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                task_id, status = line.split('\t')
+                # only run kill_cmd on killed or aborted jobs
+                job_id = self._get_job_id(task_id) if status.strip() in (
+                    'killed', 'aborted') else {}
+                if not job_id:
+                    if status.strip() in ('killed', 'aborted'):
+                        env.logger.debug(f'No job_id for task {task_id}')
+                    killed.append((task_id, status, job_id, []))
+                    continue
                 job_id.update({'task': task_id})
-                cmd = cfg_interpolate(self.kill_cmd, job_id)
-                env.logger.debug(f'Running {cmd}')
-                res += self.agent.check_output(cmd) + '\n'
-            except Exception as e:
-                env.logger.debug(
-                    f'Failed to kill job {task_id} (job_id: {job_id}) from template "{self.kill_cmd}": {e}'
-                )
-        return res
+                job_ids = [job_id]
+                if 'backup_job_id' in job_id:
+                    job_ids.append(
+                        dict(job_id,
+                             job_id=job_id['backup_job_id'],
+                             task=job_id['backup_task']))
+                killed.append((task_id, status, job_id, job_ids))
+            # jobs of all tasks of the batch are cancelled together
+            outputs = iter(
+                self.transport.cancel([x for item in killed for x in item[3]]))
+            for task_id, status, job_id, job_ids in killed:
+                responses = [
+                    x for x in (next(outputs) for _ in job_ids) if x is not None
+                ]
+                yield TaskRecord(task_id, status, job_id.get('job_id'),
+                                 '\n'.join(responses) if responses else None)
+
+    def kill_tasks(self, tasks, **kwargs):
+        # text output of iter_kill_tasks
+        res = []
+        for record in self.iter_kill_tasks(tasks, **kwargs):
+            res.append(f'{record.task_id}\t{record.status}\t')
+            if record.status.strip() not in ('killed', 'aborted'):
+                res.append('.\n')
+            elif record.response is not None:
+                res.append(record.response + '\n')
+        return ''.join(res)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import http.client
+import json
+import os
+import queue
+import subprocess
+import time
+import urllib.parse
+
+from sos.eval import cfg_interpolate
+from sos.utils import env
+
+from .schedulers import Slurm
+
+
+class ShellTransport(object):
+    '''Submit, query and cancel jobs by running submit_cmd, status_table_cmd
+    and kill_cmd on the host through the agent.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.agent = engine.agent
+
+    def submit(self, task_id, runtime, job_text):
+        cmd = self.engine._get_submit_cmd(runtime)
+        env.logger.debug(f'submit {task_id}: {cmd}')
+        try:
+            # There was an option
+            cmd_output = self.agent.check_output(cmd).strip()
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                f'Failed to submit task {task_id}:\n{e.output.decode()}')
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit task {task_id}:\n{e}')
+
+        if not cmd_output:
+            raise RuntimeError(
+                f'Failed to submit task {task_id} with command {cmd}. No output returned.'
+            )
+        return self.engine._parse_submit_output(cmd_output)
+
+    def job_table(self, cmd, parser):
+        return parser(
+            self.agent.check_output(cfg_interpolate(cmd, self.agent.config)))
+
+    def cancel(self, job_ids):
+        # job_ids is a list of job id dictionaries, with task
+        res = []
+        for job_id in job_ids:
+            try:
+                cmd = cfg_interpolate(self.engine.kill_cmd, job_id)
+                env.logger.debug(f'Running {cmd}')
+                res.append(self.agent.check_output(cmd))
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to kill job {job_id["task"]} (job_id: {job_id}) from template "{self.engine.kill_cmd}": {e}'
+                )
+                res.append(None)
+        return res
+
+
+class RESTTransport(object):
+    '''Submit, query and cancel jobs through the REST API of a scheduler, by
+    default that of slurmrestd, over a small pool of keep-alive connections.
+
+    Options of the host configuration:
+
+    rest_url: URL of the REST server, e.g. http://head-node:6820
+    rest_user, rest_token: credentials sent as X-SLURM-USER-NAME and
+        X-SLURM-USER-TOKEN headers
+    rest_api_version: version of slurmrestd API, default to v0.0.39
+    rest_submit_path, rest_jobs_path, rest_cancel_path: paths of the
+        endpoints to submit a job, list jobs, and cancel jobs, for servers
+        other than slurmrestd. rest_cancel_path can contain {job_id}. Jobs
+        are listed in the format of scheduler, or status_table_output if
+        specified, and in that of slurmrestd otherwise.
+    rest_batch_cancel_path: path of an endpoint that cancels a list of jobs
+        in one request.
+    rest_environment: environment of jobs as a dictionary or a list of
+        NAME=value, default to HOME and PATH (rest_path, default to
+        /bin:/usr/bin:/usr/local/bin, after the directory of option sos if
+        it is an absolute path)
+    rest_home: home directory on the cluster, used as the working directory
+        of tasks without workdir, default to the local home directory
+    '''
+
+    def __init__(self, engine, pool_size=2):
+        self.engine = engine
+        self.config = engine.config
+        if 'rest_url' not in self.config:
+            raise ValueError(
+                f'Missing configuration rest_url for queue {engine.alias}')
+        # the default endpoints are those of slurmrestd, and jobs of other
+        # schedulers can only be listed from a configured endpoint
+        scheduler = getattr(engine.scheduler, 'name', None)
+        paths = ('rest_submit_path', 'rest_jobs_path', 'rest_cancel_path')
+        if scheduler not in (None, 'slurm') and not all(
+                x in self.config for x in paths):
+            raise ValueError(
+                f'Scheduler {scheduler} of queue {engine.alias} is not supported by the REST transport without {", ".join(paths)}'
+            )
+        url = urllib.parse.urlparse(self.config['rest_url'])
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip('/')
+        version = self.config.get('rest_api_version', 'v0.0.39')
+        self.submit_path = self.config.get('rest_submit_path',
+                                           f'/slurm/{version}/job/submit')
+        self.jobs_path = self.config.get('rest_jobs_path',
+                                         f'/slurm/{version}/jobs')
+        self.cancel_path = self.config.get('rest_cancel_path',
+                                           f'/slurm/{version}/job/{{job_id}}')
+        self.headers = {'Content-Type': 'application/json'}
+        if 'rest_user' in self.config:
+            self.headers['X-SLURM-USER-NAME'] = self.config['rest_user']
+        if 'rest_token' in self.config:
+            self.headers['X-SLURM-USER-TOKEN'] = self.config['rest_token']
+        # slurmrestd does not pass the environment of the client
+        self.home = self.config.get('rest_home', os.path.expanduser('~'))
+        environment = self.config.get('rest_environment', None)
+        if environment is None:
+            path = self.config.get('rest_path', '/bin:/usr/bin:/usr/local/bin')
+            sos = self.config.get('sos', 'sos')
+            if os.path.isabs(sos):
+                path = f'{os.path.dirname(sos)}:{path}'
+            environment = {'HOME': self.home, 'PATH': path}
+        if isinstance(environment, dict):
+            environment = [f'{k}={v}' for k, v in environment.items()]
+        self.environment = list(environment)
+        # idle connections and the time they were last used, reused for all
+        # requests
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=60)
+        return http.client.HTTPConnection(self.netloc, timeout=60)
+
+    def request(self, method, path, body=None, decode=True):
+        # requests that are not idempotent are not sent again, and only over
+        # connections that are unlikely to have been closed by the server
+        idempotent = method in ('GET', 'HEAD', 'PUT', 'DELETE')
+        try:
+            conn, last_used = self._pool.get_nowait()
+            if not idempotent and time.time() - last_used > 2:
+                conn.close()
+                conn = self._new_connection()
+        except queue.Empty:
+            conn = self._new_connection()
+        data = None if body is None else json.dumps(body)
+        try:
+            try:
+                conn.request(method, self.base_path + path, data, self.headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                if not idempotent:
+                    raise
+                # the server might have closed an idle connection
+                conn.close()
+                conn.request(method, self.base_path + path, data, self.headers)
+                response = conn.getresponse()
+            content = response.read()
+        except Exception:
+            conn.close()
+            raise
+        try:
+            self._pool.put_nowait((conn, time.time()))
+        except queue.Full:
+            conn.close()
+        if not decode:
+            if response.status >= 400:
+                raise RuntimeError(
+                    f'{method} {path} failed with status {response.status}: {content.decode()}'
+                )
+            return content.decode()
+        result = json.loads(content) if content.strip() else {}
+        errors = [
+            x for x in result.get('errors', [])
+            if x.get('error_number', x.get('errno', 0))
+        ] if isinstance(result, dict) else []
+        if response.status >= 400 or errors:
+            raise RuntimeError(
+                f'{method} {path} failed with status {response.status}: {errors or content.decode()}'
+            )
+        return result
+
+    def submit(self, task_id, runtime, job_text):
+        job = {
+            'name': task_id,
+            'current_working_directory': runtime.get('workdir', self.home),
+            'environment': self.environment,
+        }
+        if 'queue' in runtime:
+            job['partition'] = runtime['queue']
+        try:
+            result = self.request('POST', self.submit_path, {
+                'script': job_text,
+                'job': job
+            })
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit task {task_id}:\n{e}')
+        if result.get('job_id') is None:
+            raise RuntimeError(
+                f'Failed to submit task {task_id}: no job_id returned from {self.submit_path}'
+            )
+        # the same record as the output of sbatch --parsable
+        return {'job_id': str(result['job_id'])}
+
+    def job_table(self, cmd=None, parser=None):
+        # all jobs are listed with a single request, and parsed by the parser
+        # of the queue, or as the output of slurmrestd
+        if parser is None:
+            parser = Slurm().parse_status_table
+        return parser(self.request('GET', self.jobs_path, decode=False))
+
+    def cancel(self, job_ids):
+        if 'rest_batch_cancel_path' in self.config and len(job_ids) > 1:
+            # e.g. DELETE /slurm/v0.0.40/jobs of slurmrestd 23.11 and later
+            try:
+                self.request('DELETE', self.config['rest_batch_cancel_path'],
+                             {'jobs': [str(x['job_id']) for x in job_ids]})
+                return [f'{x["job_id"]} cancelled' for x in job_ids]
+            except Exception as e:
+                env.logger.debug(f'Failed to kill jobs {job_ids}: {e}')
+                return [None] * len(job_ids)
+        res = []
+        for job_id in job_ids:
+            try:
+                self.request(
+                    'DELETE',
+                    self.cancel_path.replace('{job_id}', str(job_id['job_id'])))
+                res.append(f'{job_id["job_id"]} cancelled')
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to kill job {job_id["task"]} (job_id: {job_id}): {e}'
+                )
+                res.append(None)
+        return res
+
+
+def get_transport(engine):
+    transport = engine.config.get('transport', 'shell')
+    if transport == 'shell':
+        return ShellTransport(engine)
+    if transport == 'rest':
+        return RESTTransport(engine)
+    raise ValueError(
+        f'Unsupported transport {transport} for queue {engine.alias}, should be shell or rest'
+    )
@@ -3,14 +3,19 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 
-import os
 import subprocess
+import time
 
 from sos.utils import env
 from sos.eval import cfg_interpolate
 from sos.workflow_engines import WorkflowEngine
 from sos.pattern import extract_pattern
 
+from .content_store import ContentStore
+from .job_history import JobHistory, requested_resources
+from .schedulers import get_scheduler
+from .spool import JobSpool
+
 
 class PBS_WorkflowEngine(WorkflowEngine):
 
@@ -26,11 +31,28 @@ class PBS_WorkflowEngine(WorkflowEngine):
             raise ValueError(
                 f'A workflow_template is required for queue {self.alias}')
 
-        if 'submit_cmd' not in self.config:
+        # built-in adapter of the scheduler
+        self.scheduler = get_scheduler(self.config.get('scheduler', None))
+
+        if 'submit_cmd' in self.config:
+            self.submit_cmd = self.config['submit_cmd']
+        elif self.scheduler is not None:
+            self.submit_cmd = self.scheduler.submit_cmd
+        else:
             raise ValueError(
                 f'Missing configuration submit_cmd for queue {self.alias}')
-        else:
-            self.submit_cmd = self.config['submit_cmd']
+
+        # local copies of job id files
+        self.spool = JobSpool(self.config, 'workflows')
+
+        # submit records of workflow jobs
+        self._jobs = JobHistory(self.config)
+
+        # send workflow files and job scripts by their content so that a
+        # file that the host already has is not sent again
+        self._store = None
+        if self.config.get('workflow_store', False):
+            self._store = ContentStore(self.agent)
 
     def execute_workflow(self, filename, command, **template_args):
         #
@@ -43,21 +65,32 @@ class PBS_WorkflowEngine(WorkflowEngine):
                 f'Failed to prepare workflow with command "{command}"')
             return False
 
+        if self._store is not None:
+            # run the workflow from its copy in the store
+            blob = self._store.put_file(self.filename)
+            self.command = self.command.replace(
+                subprocess.list2cmdline([self.filename]), blob, 1)
+            self.filename = blob
+
         self.expand_template()
 
         # then copy the job file to remote host if necessary
-        self.agent.send_job_file(self.job_file, dir='workflows')
+        if self._store is not None:
+            job_file = self._store.put_text(self.job_text, '.sh')
+        else:
+            self.agent.send_job_file(self.job_file, dir='workflows')
+            job_file = f'~/.sos/workflows/{self.job_name}.sh'
 
         if 'run_mode' in self.config and self.config['run_mode'] == 'dryrun':
             try:
-                cmd = f'bash ~/.sos/workflows/{self.job_name}.sh'
+                cmd = f'bash {job_file}'
                 print(self.agent.check_output(cmd))
             except Exception as e:
                 raise RuntimeError(
                     f'Failed to submit workflow {self.job_name}: {e}')
             return
         #
-        self.template_args['job_file'] = f'~/.sos/workflows/{self.job_name}.sh'
+        self.template_args['job_file'] = job_file
         # now we need to figure out a command to submit the workflow
         try:
             cmd = cfg_interpolate(self.submit_cmd, self.template_args)
@@ -81,34 +114,23 @@ class PBS_WorkflowEngine(WorkflowEngine):
                 f'Failed to submit workflow {self.job_name} with command {cmd}. No output returned.'
             )
 
-        if 'submit_cmd_output' not in self.config:
-            submit_cmd_output = '{job_id}'
-        else:
-            submit_cmd_output = self.config['submit_cmd_output']
-        #
-        if '{job_id}' not in submit_cmd_output:
-            raise ValueError(
-                f'Option submit_cmd_output should have at least a pattern for job_id, "{submit_cmd_output}" specified.'
-            )
-
-        #
-        # try to extract job_id from command output
-        # let us write an job_id file so that we can check status of workflows more easily
-        job_id_file = os.path.join(
-            os.path.expanduser('~'), '.sos', 'workflows',
-            self.job_name + '.job_id')
-        with open(job_id_file, 'w') as job:
-            res = extract_pattern(submit_cmd_output, [cmd_output.strip()])
-            if 'job_id' not in res or len(
-                    res['job_id']) != 1 or res['job_id'][0] is None:
-                raise RuntimeError(
-                    f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{submit_cmd_output}"'
-                )
-            else:
-                job_id = res['job_id'][0]
-                # other variables
-                for k, v in res.items():
-                    job.write(f'{k}: {v[0]}\n')
+        res = None
+        if 'submit_cmd_output' not in self.config and self.scheduler is not None:
+            res = self.scheduler.parse_submit_output(cmd_output)
+        if res is None:
+            res = self._extract_job_id(cmd_output)
+        job_id = res['job_id']
+        # other variables
+        job_id_file = self.spool.write_job_id(self.job_name, res)
+        self._jobs.record(
+            'submit',
+            kind='workflow',
+            name=self.job_name,
+            job_id=job_id,
+            queue=self.template_args.get('queue', self.alias),
+            status='submitted',
+            submit_time=round(time.time(), 1),
+            **requested_resources(self.template_args))
         try:
             # Send job id files to remote host so that
             # 1. the job could be properly killed (with job_id) on remote host (not remotely)
@@ -123,14 +145,26 @@ class PBS_WorkflowEngine(WorkflowEngine):
             raise RuntimeError(
                 f'Failed to submit workflow {self.job_name}: {e}')
 
+    def _extract_job_id(self, cmd_output):
+        if 'submit_cmd_output' not in self.config:
+            submit_cmd_output = '{job_id}'
+        else:
+            submit_cmd_output = self.config['submit_cmd_output']
+        #
+        if '{job_id}' not in submit_cmd_output:
+            raise ValueError(
+                f'Option submit_cmd_output should have at least a pattern for job_id, "{submit_cmd_output}" specified.'
+            )
+
+        #
+        # try to extract job_id from command output
+        res = extract_pattern(submit_cmd_output, [cmd_output.strip()])
+        if 'job_id' not in res or len(
+                res['job_id']) != 1 or res['job_id'][0] is None:
+            raise RuntimeError(
+                f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{submit_cmd_output}"'
+            )
+        return {k: v[0] for k, v in res.items()}
+
     def _get_job_id(self, job_name):
-        job_id_file = os.path.join(
-            os.path.expanduser('~'), '.sos', 'workflows', job_name + '.job_id')
-        if not os.path.isfile(job_id_file):
-            return {}
-        with open(job_id_file) as job:
-            result = {}
-            for line in job:
-                k, v = line.split(':', 1)
-                result[k.strip()] = v.strip()
-            return result
+        return self.spool.read_job_id(job_name)
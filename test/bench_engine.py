@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+#
+# Offline micro-benchmarks of the submission paths of the task and workflow
+# engines. The agent and TaskFile are replaced with in-memory fakes so that
+# no cluster, docker, or ts is needed. For each target and number of tasks,
+# wall time, peak and retained memory of allocations, number of file system
+# and process calls (counted with an audit hook), and number of files left
+# in the spool are reported.
+#
+#   python bench_engine.py                        # 10, 1000 and 100000 tasks
+#   python bench_engine.py --sizes 10 1000 --save baseline.json
+#   python bench_engine.py --compare baseline.json --threshold 0.2
+#
+# With --compare, the exit code is 1 if the throughput (tasks per second) of
+# any target drops by more than threshold from the baseline. Each benchmark
+# runs in a separate process because audit hooks cannot be removed.
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import FakeAgent  # noqa: E402
+
+TARGETS = ('prepare_script', 'execute_tasks', 'kill_tasks', 'get_job_id',
+           'execute_workflow')
+
+CONFIG = {
+    'alias': 'bench',
+    'task_template': '#!/bin/bash\n#PBS -N {job_name}\n#PBS -l nodes={nodes}:ppn={cores}\ncd {workdir}\n{command}\n',
+    'workflow_template': '#!/bin/bash\n#PBS -N {job_name}\n{command}\n',
+    'submit_cmd': 'qsub {job_file}',
+    'status_cmd': 'qstat {job_id}',
+    'kill_cmd': 'qdel {job_id}',
+    'submit_order': 'fifo',
+}
+
+WORKFLOW = '''
+[default]
+parameter: n = 0
+print(n)
+'''
+
+# counts of audited events, only updated while a benchmark is running
+_events = collections.Counter()
+_counting = False
+
+
+def _audit(event, args):
+    if _counting and (event == 'open' or event.startswith(('os.', 'subprocess.', 'shutil.'))):
+        _events[event] += 1
+
+
+class FakeTaskFile(object):
+    # TaskFile with the runtime and parameters of a typical task
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.runtime = {
+            '_runtime': {
+                'verbosity': 1,
+                'sig_mode': 'default',
+                'run_mode': 'run',
+                'workdir': os.path.expanduser('~'),
+            }
+        }
+
+    @property
+    def params(self):
+        from sos.tasks import TaskParams
+        return TaskParams(
+            name='default_10',
+            global_def='',
+            task='print(1)',
+            sos_dict={
+                '_runtime': {
+                    'walltime': '01:00:00',
+                    'cores': 2
+                },
+                'step_name': 'default_10'
+            },
+            tags=['default_10'])
+
+
+def _respond(cmd):
+    # answers of the fake scheduler and sos
+    if cmd.startswith('qsub'):
+        return '1234.bench-server'
+    if cmd.startswith('sos kill'):
+        return ''.join(f'{x}\tkilled\n' for x in cmd.split()[2:])
+    return ''
+
+
+def _task_ids(n):
+    return [f't{i:015x}' for i in range(n)]
+
+
+def _engine():
+    from sos_pbs.task_engine import PBS_TaskEngine
+    engine = PBS_TaskEngine(FakeAgent(dict(CONFIG), _respond))
+    engine.engine_ready.set()
+    return engine
+
+
+def _setup(target, n):
+    # return a function that runs target for n tasks
+    task_ids = _task_ids(n)
+    if target == 'execute_workflow':
+        from sos.utils import env
+        from sos_pbs.workflow_engine import PBS_WorkflowEngine
+
+        env.sos_dict.set('CONFIG', {})
+        script = os.path.join(os.path.expanduser('~'), 'bench.sos')
+        with open(script, 'w') as sos_file:
+            sos_file.write(WORKFLOW)
+        engine = PBS_WorkflowEngine(FakeAgent(dict(CONFIG), _respond))
+        return lambda: [
+            engine.execute_workflow(script, ['sos', 'run', script, '--n', str(i)])
+            for i in range(n)
+        ]
+    engine = _engine()
+    if target == 'prepare_script':
+        return lambda: [engine._prepare_script(x) for x in task_ids]
+    if target == 'execute_tasks':
+        return lambda: engine.execute_tasks(task_ids)
+    # kill and job id lookups need job id files of submitted tasks
+    for task_id in task_ids:
+        engine.spool.write_job_id(task_id, {'job_id': f'{task_id}.bench-server'})
+    if target == 'kill_tasks':
+        return lambda: engine.kill_tasks(task_ids)
+    if target == 'get_job_id':
+        return lambda: [engine._get_job_id(x) for x in task_ids]
+    raise ValueError(f'Unknown benchmark target {target}')
+
+
+def _count_files(root):
+    return sum(len(files) for _, _, files in os.walk(root))
+
+
+@contextlib.contextmanager
+def _temp_home():
+    # a temporary HOME with an empty ~/.sos
+    saved = os.environ.get('HOME')
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['HOME'] = home
+        try:
+            for d in ('tasks', 'workflows'):
+                os.makedirs(os.path.join(home, '.sos', d))
+            yield home
+        finally:
+            if saved is None:
+                os.environ.pop('HOME', None)
+            else:
+                os.environ['HOME'] = saved
+
+
+def run_benchmark(target, n, trace_limit):
+    # run the benchmark in a separate process with the audit hook installed
+    proc = subprocess.run([
+        sys.executable, os.path.abspath(__file__), '--run', target, str(n),
+        '--trace-limit', str(trace_limit)
+    ], stdout=subprocess.PIPE, check=True)
+    return json.loads(proc.stdout.decode().splitlines()[-1])
+
+
+def _run_benchmark(target, n, trace_limit):
+    global _counting
+    from sos.utils import env
+
+    with _temp_home() as home:
+        env.verbosity = 0
+        func = _setup(target, n)
+        files_before = _count_files(home)
+        _events.clear()
+        _counting = True
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        _counting = False
+        result = {
+            'tasks': n,
+            'time': elapsed,
+            'throughput': n / elapsed if elapsed else float('inf'),
+            'syscalls': sum(_events.values()),
+            'opens': _events['open'],
+            'files': _count_files(home) - files_before,
+        }
+    # allocations are traced in a separate run because tracing slows down
+    # execution several times
+    if n <= trace_limit:
+        with _temp_home():
+            func = _setup(target, n)
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            func()
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = after.compare_to(before, 'filename')
+            result['alloc_peak_kb'] = round(peak / 1024, 1)
+            result['alloc_blocks'] = sum(max(x.count_diff, 0) for x in stats)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # return a list of regressions
+    regressions = []
+    for target, sizes in results.items():
+        for size, res in sizes.items():
+            base = baseline.get(target, {}).get(size)
+            if base is None:
+                continue
+            ratio = res['throughput'] / base['throughput']
+            status = 'REGRESSION' if ratio < 1 - threshold else 'ok'
+            print(f'{target:>18} {size:>8} tasks: {ratio:6.2f}x of baseline {status}')
+            if ratio < 1 - threshold:
+                regressions.append((target, size, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Offline benchmarks of task and workflow submission')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 1000, 100000])
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--trace-limit', type=int, default=1000,
+                        help='trace allocations for up to this number of tasks')
+    parser.add_argument('--save', help='save results as a baseline to this file')
+    parser.add_argument('--compare', help='compare results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed drop of throughput from the baseline')
+    parser.add_argument('--run', nargs=2, metavar=('TARGET', 'N'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run:
+        # a single benchmark in the process started by run_benchmark
+        sys.addaudithook(_audit)
+        with mock.patch('sos_pbs.task_engine.TaskFile', FakeTaskFile):
+            res = _run_benchmark(args.run[0], int(args.run[1]), args.trace_limit)
+        print(json.dumps(res))
+        return 0
+    results = {}
+    print(f'{"target":>18} {"tasks":>8} {"time (s)":>10} {"tasks/s":>10} '
+          f'{"syscalls":>9} {"files":>7} {"peak KB":>9} {"blocks":>8}')
+    for target in args.targets:
+        results[target] = {}
+        for n in args.sizes:
+            res = run_benchmark(target, n, args.trace_limit)
+            results[target][str(n)] = res
+            print(f'{target:>18} {n:>8} {res["time"]:>10.3f} {res["throughput"]:>10.0f} '
+                  f'{res["syscalls"]:>9} {res["files"]:>7} '
+                  f'{res.get("alloc_peak_kb", "-"):>9} {res.get("alloc_blocks", "-"):>8}')
+    if args.save:
+        with open(args.save, 'w') as baseline:
+            json.dump(results, baseline, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
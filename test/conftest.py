@@ -120,4 +120,108 @@ def clear_now_and_after():
 
 @pytest.fixture
 def purge_tasks():
-    subprocess.check_output('sos purge --all', shell=True).decode()
\ No newline at end of file
+    subprocess.check_output('sos purge --all', shell=True).decode()
+
+
+class FakeAgent(object):
+    '''An agent that records commands and files sent to a host and answers
+    commands with a responder function instead of running them.'''
+
+    def __init__(self, config, responder=None):
+        self.config = config
+        self.alias = config['alias']
+        self.address = 'fake'
+        self.responder = responder
+        self.commands = []
+        self.sent_files = []
+        self.prepared = []
+
+    def send_job_file(self, job_file, dir='tasks'):
+        self.sent_files.append((job_file, dir))
+
+    def prepare_task(self, task_id):
+        self.prepared.append(task_id)
+        return True
+
+    def receive_result(self, task_id):
+        return {'task': task_id, 'ret_code': 0}
+
+    def check_output(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if self.responder is None:
+            return ''
+        return self.responder(cmd)
+
+
+@pytest.fixture
+def fake_agent():
+    # FakeAgent(config, responder) for tests that do not need an engine
+    return FakeAgent
+
+
+@pytest.fixture
+def sos_home(tmp_path, monkeypatch):
+    # a temporary home directory with ~/.sos/tasks and ~/.sos/workflows
+    monkeypatch.setenv('HOME', str(tmp_path))
+    for d in ('tasks', 'workflows'):
+        os.makedirs(os.path.join(str(tmp_path), '.sos', d))
+    return tmp_path
+
+
+@pytest.fixture
+def pbs_config():
+    return {
+        'alias': 'pbs',
+        'task_template': '#!/bin/bash\n#PBS -N {job_name}\n{command}\n',
+        'submit_cmd': 'qsub {job_file}',
+        'status_cmd': 'qstat {job_id}',
+        'kill_cmd': 'qdel {job_id}',
+    }
+
+
+@pytest.fixture
+def task_factory(sos_home):
+    from sos.targets import sos_targets
+    from sos.tasks import TaskFile, TaskParams
+
+    def get_task(task_id, step_name='default_10', input=None, output=None,
+                 **runtime):
+        task_runtime = {
+            'verbosity': 1,
+            'sig_mode': 'default',
+            'run_mode': 'run',
+            'workdir': str(sos_home),
+        }
+        params = TaskParams(
+            name=step_name,
+            global_def='',
+            task='print(1)',
+            sos_dict={
+                '_runtime': dict(task_runtime, **runtime),
+                '_input': sos_targets(input or []),
+                '_output': sos_targets(output or []),
+                '_depends': sos_targets(),
+                'step_name': step_name,
+            },
+            tags=[step_name])
+        TaskFile(task_id).save(params)
+        TaskFile(task_id).runtime = {'_runtime': task_runtime}
+        return task_id
+
+    return get_task
+
+
+@pytest.fixture
+def pbs_engine(sos_home, pbs_config):
+    from sos_pbs.status_cache import SchedulerStatusCache
+    from sos_pbs.task_engine import PBS_TaskEngine
+
+    # do not share job tables between tests
+    SchedulerStatusCache._instances.clear()
+
+    def get_engine(responder=None, **config):
+        engine = PBS_TaskEngine(FakeAgent(dict(pbs_config, **config), responder))
+        engine.engine_ready.set()
+        return engine
+
+    return get_engine
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import datetime
+
+from sos.tasks import TaskFile
+
+from sos_pbs.backfill import parse_showbf
+from sos_pbs.history import RuntimeHistory, runtime_key
+
+SHOWBF_OUTPUT = '''
+Partition     Tasks  Nodes      Duration   StartOffset       StartDate
+---------     -----  -----  ------------  ------------  --------------
+ALL              64      4      INFINITY      00:00:00  09:22:25_07/20
+ALL             128      8       2:00:00      00:00:00  09:22:25_07/20
+ALL             256     16    1:00:00:00      01:00:00  10:22:25_07/20
+'''
+
+
+def test_parse_showbf():
+    assert parse_showbf(SHOWBF_OUTPUT) == [(64, 4, float('inf')),
+                                           (128, 8, 7200)]
+
+
+def test_runtime_history(sos_home, pbs_config):
+    history = RuntimeHistory(pbs_config, max_records=10)
+    assert history.estimate('default_10') is None
+    # at least min_samples runtimes are needed for an estimate
+    for i in range(1, 5):
+        history.record('default_10', i * 60)
+    assert history.estimate('default_10') is None
+    for i in range(5, 21):
+        history.record('default_10', i * 60)
+    # only the last 10 records are kept, also by other sessions
+    other = RuntimeHistory(pbs_config)
+    assert other.runtimes('default_10') == [i * 60 for i in range(11, 21)]
+    assert other.estimate('default_10') == 20 * 60
+    assert other.estimate('default_10', 0.5) == 16 * 60
+
+
+def test_runtime_key():
+    from sos.tasks import TaskParams
+
+    def params(step_name, task):
+        return TaskParams(
+            name=step_name,
+            global_def='',
+            task=task,
+            sos_dict={'step_name': step_name},
+            tags=[])
+
+    # steps of the same name of different workflows are kept apart
+    assert runtime_key(params('default_10', 'print(1)')) == runtime_key(
+        params('default_10', 'print(1)'))
+    assert runtime_key(params('default_10', 'print(1)')) != runtime_key(
+        params('default_10', 'print(2)'))
+    assert runtime_key(params('default_10', 'print(1)')).startswith('default_10@')
+
+
+def test_shape_walltime(pbs_engine, task_factory):
+    engine = pbs_engine(
+        lambda cmd: SHOWBF_OUTPUT if cmd == 'showbf' else '1.server',
+        backfill_shaping=True,
+        walltime='24:00:00',
+        task_template='#!/bin/bash\n#PBS -l walltime={walltime}\n{command}\n')
+    fast = task_factory('t1000000000000000')
+    slow = task_factory('t2000000000000000', step_name='other_10')
+    big = task_factory('t3000000000000000', nodes=10)
+    new = task_factory('t4000000000000000', step_name='new_10')
+    requested = task_factory('t5000000000000000', walltime='24:00:00')
+    allowed = task_factory(
+        't6000000000000000', walltime='24:00:00', backfill=True)
+    for i in range(10):
+        engine._history.record(runtime_key(TaskFile(fast).params), 3000)
+        engine._history.record(runtime_key(TaskFile(slow).params), 7000)
+    rendered = {
+        x: engine._render_job(x)[2].splitlines()[1]
+        for x in (fast, slow, big, new, requested, allowed)
+    }
+    # 3000 * 1.5 seconds fits in the 2 hour window
+    assert rendered[fast] == '#PBS -l walltime=02:00:00'
+    assert rendered[slow] == '#PBS -l walltime=24:00:00'
+    assert rendered[big] == '#PBS -l walltime=24:00:00'
+    assert rendered[new] == '#PBS -l walltime=24:00:00'
+    # walltime requested by the task is kept unless it allows backfill
+    assert rendered[requested] == '#PBS -l walltime=24:00:00'
+    assert rendered[allowed] == '#PBS -l walltime=02:00:00'
+    # windows are cached
+    assert engine.agent.commands.count('showbf') == 1
+
+
+def test_probe_slurm(pbs_engine, task_factory):
+    now = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+    def respond(cmd):
+        # only jobs of up to 2 hours start now
+        minutes = int(cmd.split('-t ')[1].split()[0])
+        start = now if minutes <= 120 else '2099-01-01T00:00:00'
+        return f'sbatch: Job 123 to start at {start} using 1 processors on nodes n1'
+
+    engine = pbs_engine(
+        respond, scheduler='slurm', backfill_shaping=True, walltime='10:00:00')
+    task_id = task_factory('t1000000000000000')
+    for i in range(10):
+        engine._history.record(runtime_key(TaskFile(task_id).params), 3000)
+    runtime = engine._render_job(task_id)[0]
+    assert runtime['walltime'] == '01:15:00'
+    assert engine.config['walltime'] == '10:00:00'
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+
+import bench_engine
+
+
+def test_benchmark_baseline(sos_home):
+    baseline = str(sos_home / 'baseline.json')
+    assert bench_engine.main(
+        ['--sizes', '10', '--targets', 'prepare_script', 'get_job_id', '--save', baseline]) == 0
+    with open(baseline) as base:
+        results = json.load(base)
+    assert results['prepare_script']['10']['files'] == 20
+    assert results['get_job_id']['10']['files'] == 0
+    assert 'alloc_peak_kb' in results['get_job_id']['10']
+    # a baseline that is much faster than the current code fails the comparison
+    for sizes in results.values():
+        sizes['10']['throughput'] *= 1000
+    with open(baseline, 'w') as base:
+        json.dump(results, base)
+    assert bench_engine.main([
+        '--sizes', '10', '--targets', 'prepare_script', 'get_job_id',
+        '--compare', baseline
+    ]) == 1
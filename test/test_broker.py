@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import subprocess
+import time
+
+
+def _wait(func, timeout=10):
+    for i in range(int(timeout * 20)):
+        if func():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_priority_lane(pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(1, 5)]
+    bulk = pbs_engine(fair_share_limit=2, fair_share_reserve=1,
+                      fair_share_small=1, fair_share_poll=0)._broker
+    # the last slot is reserved for sessions with few waiting tasks
+    assert bulk.quota(3) == 1
+    engine = pbs_engine(lambda cmd: '1001.server', fair_share_limit=2,
+                        fair_share_reserve=1, fair_share_poll=0)
+    assert engine._broker.quota(1) == 1
+    assert engine.execute_tasks(tasks[3:])
+    with open(bulk.ledger_file) as ledger:
+        state = json.load(ledger)
+    assert state['jobs'][tasks[3]]['job_id'] == '1001.server'
+    # the reserved slot is free again when the task ends, and is not given
+    # to the bulk session, which stays in the bulk lane while it drains
+    engine._record_end(tasks[3], 'completed')
+    with open(bulk.ledger_file) as ledger:
+        assert not json.load(ledger)['jobs']
+    assert bulk.quota(3) == 1
+    assert bulk.quota(1) == 1
+    with open(bulk.ledger_file) as ledger:
+        assert not json.load(ledger)['sessions'][bulk.session]['priority']
+
+
+def test_weighted_fair_queuing(pbs_engine):
+    brokers = [
+        pbs_engine(fair_share_limit=3, fair_share_small=0, fair_share_poll=0,
+                   fair_share_weight=w)._broker for w in (2, 1)
+    ]
+    counts = [0, 0]
+    for n in range(60):
+        for i, broker in enumerate(brokers):
+            ready = broker.quota(1000)
+            task_ids = [f'{broker.session}-{n}-{x}' for x in range(ready)]
+            counts[i] += broker._update(lambda state: broker._take(state, task_ids))
+            for task_id in task_ids:
+                broker.release(task_id)
+    # slots are shared by the weights of the sessions
+    assert sum(counts) >= 170
+    assert 1.8 < counts[0] / counts[1] < 2.2
+
+
+def test_dead_sessions(pbs_engine):
+    broker = pbs_engine(fair_share_limit=1)._broker
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    with open(broker.ledger_file, 'w') as ledger:
+        json.dump({
+            'vtime': 0,
+            'sessions': {
+                'dead': {'pid': proc.pid, 'want': 5, 'ready': 0, 'finish': 0,
+                         'weight': 1, 'priority': False}
+            },
+            'jobs': {
+                't1000000000000000': {'session': 'dead', 'job_id': '1001.server',
+                                      'time': 0}
+            },
+        }, ledger)
+    # the slot of the exited session is given to this one
+    assert broker.quota(1) == 1
+
+
+def test_engine_shares_limit(pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(1, 5)]
+    status = {}
+
+    def respond(cmd):
+        if cmd.startswith('qsub'):
+            task_id = cmd.split('/')[-1][:-3]
+            status[task_id] = 'running'
+            return f'{len(status)}.server'
+        if cmd.startswith('sos status'):
+            return ''.join(f'{x}\t\t\t\t\t{status[x]}\n'
+                           for x in cmd.split() if x in status)
+        return ''
+
+    engine = pbs_engine(respond, fair_share_limit=2, fair_share_poll=0.1,
+                        status_check_interval=0.2)
+    for task_id in tasks:
+        assert engine.submit_task(task_id) == 'pending'
+    engine.start()
+    # two jobs are submitted, and the engine keeps checking their status
+    # instead of waiting for slots
+    assert _wait(lambda: len(status) == 2)
+    time.sleep(1)
+    assert len(status) == 2
+    queries = len([x for x in engine.agent.commands if x.startswith('sos status')])
+    assert queries > 1
+    # slots of completed tasks are given to the waiting ones
+    for task_id in list(status):
+        status[task_id] = 'completed'
+    assert _wait(lambda: len(status) == 4)
+    assert all(x in status for x in tasks)
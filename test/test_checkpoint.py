@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import subprocess
+import time
+
+from sos_pbs.checkpoint import checkpoint_command
+
+PATTERN = r'{job_id,\d\S*} {name} {status} {queue}'
+
+
+def test_checkpoint_wrapper(sos_home):
+    task = "bash -c 'trap \"echo checkpointed; exit 3\" USR1; sleep 30 & wait'"
+    script = checkpoint_command('t1000000000000000', task, 2, 1, 'USR1')
+    start = time.time()
+    proc = subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, timeout=20)
+    # the task is signalled after one second and its exit code is kept
+    assert time.time() - start < 10
+    assert proc.stdout.decode().strip() == 'checkpointed'
+    assert proc.returncode == 3
+    marker = sos_home / '.sos' / 'checkpoints' / 't1000000000000000'
+    assert marker.read_text().strip() == '2'
+
+
+def test_checkpoint_segments(pbs_engine, task_factory):
+    task_id = task_factory(
+        't1000000000000000', walltime='10:00:00', checkpoint=True)
+    other = task_factory('t2000000000000000', walltime='10:00:00')
+    status = {'sos': 'running'}
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return '1001.server t1 C batch\n'
+        if cmd.startswith('grep'):
+            return f'/home/user/.sos/checkpoints/{task_id}:0\n'
+        if cmd.startswith('qsub'):
+            return '2001.server'
+        if cmd.startswith('sos status'):
+            return f'{task_id}\t{status["sos"]}\n'
+        return ''
+
+    engine = pbs_engine(
+        respond,
+        status_table_cmd='qstat',
+        status_table_output=PATTERN,
+        checkpoint_segment='4h',
+        task_template='#!/bin/bash\n#PBS -l walltime={walltime}\n{checkpoint_directive}\n{command}\n')
+    engine._prepare_script(task_id)
+    with open(engine.spool.path(task_id, '.sh')) as job_file:
+        script = job_file.read()
+    assert '#PBS -l walltime=04:00:00' in script
+    assert 'sleep 13800' in script
+    # tasks that do not opt in run in one job of their walltime
+    script = engine._render_job(other)[2]
+    assert '#PBS -l walltime=10:00:00' in script
+    assert 'sleep' not in script
+    engine.spool.write_job_id(task_id, {'job_id': '1001.server'})
+    for i in range(50):
+        if engine._status_cache.snapshot() is not None:
+            break
+        time.sleep(0.1)
+    # the job of the first segment has ended after it was signalled
+    assert engine.query_tasks([task_id]) == f'{task_id}\tsubmitted\n'
+    assert engine._get_job_id(task_id) == {
+        'job_id': '2001.server',
+        'previous_job_ids': '1001.server',
+        'previous_reasons': 'checkpoint',
+        'segment': '1',
+    }
+    n_submits = len([x for x in engine.agent.commands if x.startswith('qsub')])
+    assert n_submits == 2
+    # the marker of the first segment does not continue the second one
+    engine.query_tasks([task_id])
+    assert len([x for x in engine.agent.commands if x.startswith('qsub')]) == n_submits
+    status['sos'] = 'completed'
+    engine.query_tasks([task_id])
+    assert f'rm -f $HOME/.sos/checkpoints/{task_id}' in engine.agent.commands
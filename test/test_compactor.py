@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import time
+
+STATUS = {
+    't1000000000000000': 'completed',
+    't2000000000000000': 'running',
+    't3000000000000000': 'failed',
+    't4000000000000000': 'submitted',
+    't6000000000000000': 'completed',
+    't7000000000000000': 'missing',
+}
+# t6 has old job files but completed recently
+OLD = time.time() - 40 * 24 * 3600
+END = {x: time.time() if x == 't6000000000000000' else OLD for x in STATUS}
+
+
+def respond(cmd):
+    if cmd.startswith('find'):
+        return '\n'.join(f'/home/user/.sos/tasks/{x}.sh' for x in STATUS)
+    if ' status ' in cmd:
+        return '\n'.join(
+            f'{x}\t\t\t\t\t{STATUS[x]}' if STATUS[x] == 'missing' else
+            f'{x}\tdefault_10\t{OLD}\t{END[x] - 10}\t10\t{STATUS[x]}'
+            for x in STATUS
+            if x in cmd)
+    return ''
+
+
+def test_compact_job_files(pbs_engine):
+    engine = pbs_engine(respond)
+    for task_id in STATUS:
+        for ext in ('.sh', '.job_id'):
+            filename = engine.spool.path(task_id, ext, create=True)
+            open(filename, 'w').close()
+            os.utime(filename, (OLD, OLD))
+    # recent files of a completed task are kept
+    recent = engine.spool.path('t5000000000000000', '.sh', create=True)
+    open(recent, 'w').close()
+
+    assert engine.compact_job_files('30d') == (3, 3)
+    for task_id in STATUS:
+        assert (engine.spool.find(task_id, '.sh') is None) == (
+            STATUS[task_id] in ('completed', 'failed', 'missing') and
+            END[task_id] == OLD)
+    assert os.path.isfile(recent)
+    rm_cmd = [x for x in engine.agent.commands if x.startswith('cd ')]
+    assert len(rm_cmd) == 1
+    assert 't1000000000000000.sh' in rm_cmd[0]
+    assert 't3000000000000000.job_id' in rm_cmd[0]
+    # job files of purged tasks are removed after the retention period
+    assert 't7000000000000000.sh' in rm_cmd[0]
+    assert 't2000000000000000' not in rm_cmd[0]
+    assert 't4000000000000000' not in rm_cmd[0]
+    assert 't6000000000000000' not in rm_cmd[0]
+    # the status of tasks is not acted upon by the engine
+    assert not any(x.startswith('qsub') for x in engine.agent.commands)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+
+from sos.utils import env
+
+from sos_pbs.content_store import ContentStore
+
+WORKFLOW = '''
+[default]
+parameter: n = 0
+print(n)
+'''
+
+
+def test_content_store(sos_home, pbs_config, fake_agent):
+    agent = fake_agent(pbs_config)
+    store = ContentStore(agent)
+    sha = hashlib.sha256(b'echo 1\n').hexdigest()
+    assert store.put_text('echo 1\n', '.sh') == f'~/.sos/workflows/blobs/{sha}.sh'
+    assert store.put_text('echo 1\n', '.sh') == f'~/.sos/workflows/blobs/{sha}.sh'
+    assert len(agent.sent_files) == 1
+    # the manifest is shared by sessions
+    agent = fake_agent(pbs_config)
+    ContentStore(agent).put_text('echo 1\n', '.sh')
+    assert not agent.sent_files
+
+
+def test_workflow_store(sos_home, pbs_config, fake_agent):
+    from sos_pbs.workflow_engine import PBS_WorkflowEngine
+
+    env.sos_dict.set('CONFIG', {})
+    script = str(sos_home / 'test.sos')
+    with open(script, 'w') as sos_file:
+        sos_file.write(WORKFLOW)
+    sha = hashlib.sha256(WORKFLOW.encode()).hexdigest()
+    engine = PBS_WorkflowEngine(
+        fake_agent(
+            dict(pbs_config,
+                 workflow_template='#!/bin/bash\n{command}\n',
+                 workflow_store=True), lambda cmd: '1001.server'))
+
+    def sent_blobs(n):
+        engine.agent.sent_files = []
+        engine.execute_workflow(script, ['sos', 'run', script, '--n', str(n)])
+        return [x for x, d in engine.agent.sent_files if d == 'workflows/blobs']
+
+    # the workflow file is sent once, and job scripts once per arguments
+    blobs = sent_blobs(1)
+    assert len(blobs) == 2 and blobs[0].endswith(f'{sha}.sos')
+    assert len(sent_blobs(2)) == 1
+    assert sent_blobs(1) == []
+    with open(blobs[1]) as job_file:
+        assert f'sos run ~/.sos/workflows/blobs/{sha}.sos --n 1' in job_file.read()
+    assert engine.agent.commands[-1] == f'qsub ~/.sos/workflows/blobs/{blobs[1].split("/")[-1]}'
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import logging
+import threading
+
+from sos.utils import env
+
+from sos_pbs.dryrun import BulkDryRun
+
+
+def _hold_checks(monkeypatch):
+    # tasks are checked only after the returned event is set
+    submitted = threading.Event()
+    check = BulkDryRun.check
+    monkeypatch.setattr(BulkDryRun, 'check',
+                        lambda self, x: submitted.wait() and check(self, x))
+    return submitted
+
+
+def test_bulk_dryrun(pbs_engine, task_factory, monkeypatch, caplog):
+    monkeypatch.setitem(env.config, 'run_mode', 'dryrun')
+    tasks = [
+        task_factory('t1000000000000000', walltime='01:00:00', cores=2, account='lab'),
+        task_factory('t2000000000000000', walltime='48:00:00', account='lab'),
+        task_factory('t3000000000000000', walltime='01:00:00'),
+        task_factory('t4000000000000000', walltime='01:00:00', account='lab"'),
+    ]
+    engine = pbs_engine(
+        bulk_dryrun=True,
+        max_walltime='24:00:00',
+        task_template='#!/bin/bash\n#PBS -A {account}\necho {account}\n{command}\n')
+    # tasks are submitted one at a time by the workflow, and checked after
+    # the last one is submitted
+    submitted = _hold_checks(monkeypatch)
+    assert all(engine.submit_task(x) == 'submitted' for x in tasks)
+    submitted.set()
+    with caplog.at_level(logging.INFO):
+        results = engine.get_results(tasks)
+    assert [results[x]['ret_code'] for x in tasks] == [0, 1, 1, 1]
+    assert [engine.check_task_status(x) for x in tasks] == [
+        'completed', 'failed', 'failed', 'failed'
+    ]
+    # nothing is sent to or run on the host
+    assert not engine.agent.commands
+    assert not engine.agent.sent_files
+    assert not engine.agent.prepared
+    # and one summary of all tasks is logged before the results are
+    # returned, so the atexit report has nothing left to log
+    engine._dryrun.report()
+    assert len(caplog.records) == 1
+    lines = caplog.records[0].getMessage().splitlines()
+    assert lines[0] == '4 jobs to pbs: 4 cores, 51.0 core hours requested (1 jobs without walltime)'
+    assert lines[1] == '3 jobs failed to validate:'
+    assert sorted(lines[2:])[0] == f'{tasks[1]}\twalltime 172800 exceeds max_walltime 24:00:00'
+    assert sorted(lines[2:])[1].startswith(f'{tasks[2]}\tFailed to generate job file')
+    assert sorted(lines[2:])[2].startswith(f'{tasks[3]}\tinvalid job script')
+
+
+def test_bulk_dryrun_passes(pbs_engine, task_factory, monkeypatch, caplog):
+    monkeypatch.setitem(env.config, 'run_mode', 'dryrun')
+    tasks = [task_factory(f't{i}000000000000000', walltime='00:30:00') for i in range(1, 5)]
+    engine = pbs_engine(bulk_dryrun=True)
+    submitted = _hold_checks(monkeypatch)
+    for task_id in tasks:
+        engine.submit_task(task_id)
+    submitted.set()
+    with caplog.at_level(logging.INFO):
+        assert all(x['ret_code'] == 0 for x in engine.get_results(tasks).values())
+    assert [x.getMessage() for x in caplog.records] == [
+        '4 jobs to pbs: 4 cores, 2.0 core hours requested'
+    ]
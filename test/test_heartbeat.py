@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+
+def test_stale_heartbeats(pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(1, 5)]
+
+    def respond(cmd):
+        if cmd.startswith('date +%s'):
+            # t1 is alive, t2 is stale, and t3 has not started
+            return ('10000\nt1000000000000000.pulse 9990\n'
+                    't2000000000000000.pulse 9000\n')
+        if cmd.startswith('qsub'):
+            return '2002.server'
+        if cmd.startswith('sos status'):
+            return ''.join(f'{x}\trunning\n' for x in tasks[:3]) + f'{tasks[3]}\tcompleted\n'
+        return ''
+
+    engine = pbs_engine(respond, heartbeat_interval=60)
+    for i, task_id in enumerate(tasks):
+        engine.spool.write_job_id(task_id, {'job_id': f'100{i + 1}.server'})
+    assert engine.query_tasks(tasks) == (f'{tasks[0]}\trunning\n'
+                                         f'{tasks[1]}\tsubmitted\n'
+                                         f'{tasks[2]}\trunning\n'
+                                         f'{tasks[3]}\tcompleted\n')
+    # pulse files of all running tasks are read with a single command
+    checks = [x for x in engine.agent.commands if x.startswith('date')]
+    assert len(checks) == 1
+    assert all(f'{x}.pulse' in checks[0] for x in tasks[:3])
+    assert f'{tasks[3]}.pulse' not in checks[0]
+    assert 'qdel 1002.server' in engine.agent.commands
+    assert engine.agent.prepared == [tasks[1]]
+    assert engine._get_job_id(tasks[1])['job_id'] == '2002.server'
+    # the resubmitted task is no longer checked until it runs again
+    assert tasks[1] not in engine._heartbeats._running
+
+
+def test_no_heartbeat_loop(pbs_engine, task_factory):
+    engine = pbs_engine(heartbeat_interval=60)
+    _, _, job_text = engine._render_job(task_factory('t1000000000000000'))
+    # liveness comes from the pulse file written by sos itself
+    assert 'touch' not in job_text and 'while true' not in job_text
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from sos_pbs.__main__ import main
+from sos_pbs.job_history import JobHistory, iter_records, summarize
+
+
+def test_job_history_records(pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000', walltime='01:00:00', mem='2G')
+             for i in range(1, 4)]
+
+    def respond(cmd):
+        if cmd.startswith('qsub'):
+            return '1001.server'
+        if cmd.startswith('sos status'):
+            return (f'{tasks[0]}\tcompleted\n{tasks[1]}\tfailed\n'
+                    f'{tasks[2]}\trunning\n')
+        return ''
+
+    engine = pbs_engine(respond)
+    for task_id in tasks:
+        engine._prepare_script(task_id)
+    engine.query_tasks(tasks)
+    # ends are recorded once
+    engine.query_tasks(tasks)
+    engine._jobs.flush()
+    records = list(iter_records())
+    assert [(x['event'], x['name'], x['status']) for x in records] == [
+        ('submit', tasks[0], 'submitted'),
+        ('submit', tasks[1], 'submitted'),
+        ('submit', tasks[2], 'submitted'),
+        ('end', tasks[0], 'completed'),
+        ('end', tasks[1], 'failed'),
+    ]
+    assert records[0]['queue'] == 'pbs'
+    assert records[0]['step'] == 'default_10'
+    assert records[0]['walltime'] == '3600'
+    assert records[0]['mem'] == '2000000000'
+    assert records[3]['job_id'] == '1001.server'
+
+
+def test_job_history_other_sessions(pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(1, 3)]
+
+    def respond(cmd):
+        if cmd.startswith('sos status'):
+            return ''.join(f'{x}\tcompleted\n' for x in tasks)
+        return ''
+
+    engine = pbs_engine(respond)
+    engine.spool.write_job_id(tasks[0], {'job_id': '1001.server'})
+    # completed tasks of earlier sessions are found when the engine starts
+    engine.query_tasks(check_all=True)
+    engine._jobs.flush()
+    assert not list(iter_records())
+
+
+def test_summarize_and_report(sos_home, pbs_config, capsys):
+    history = JobHistory(pbs_config, flush_size=1000)
+    for i in range(2000):
+        history.record('submit', step='align', submit_time=1000 + i)
+        history.record(
+            'end',
+            step='align',
+            status='failed' if i % 4 == 0 else 'completed',
+            submit_time=1000 + i,
+            start_time=1100 + i,
+            end_time=1500 + i,
+            walltime=800,
+            mem=1000,
+            peak_mem=250)
+    history.record('submit', step='call', submit_time=5000)
+    history.flush()
+    summary = summarize(iter_records())
+    align = summary[('pbs', 'align')]
+    assert align['submitted'] == 2000
+    assert align['ended'] == 2000
+    assert align['failure_rate'] == 0.25
+    assert abs(align['throughput'] - 2000 * 3600 / 1999) < 1e-6
+    # quantiles are accurate to the width of histogram buckets
+    assert abs(align['wait_p50'] - 100) < 10
+    assert abs(align['run_p90'] - 400) < 40
+    assert abs(align['walltime_used_p50'] - 50) < 5
+    assert abs(align['mem_used_p50'] - 25) < 3
+    assert summary[('pbs', 'call')]['run_p50'] is None
+    #
+    main(['report', '--by', 'step'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('step\tsubmitted\tjobs/h')
+    assert lines[1].startswith('align\t2000\t3601.8\t2000\t25.0%')
+    assert lines[2].startswith('call\t1\t-\t0\t-')
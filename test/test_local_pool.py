@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import stat
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fake_sos(sos_home):
+    # sos execute that runs for $SOS_SLEEP seconds and leaves a file
+    sos = os.path.join(str(sos_home), 'sos')
+    with open(sos, 'w') as script:
+        script.write('#!/bin/sh\n'
+                     'sleep ${SOS_SLEEP:-0.5}\n'
+                     'touch "$HOME/$2.done"\n')
+    os.chmod(sos, os.stat(sos).st_mode | stat.S_IEXEC)
+    return sos
+
+
+def _wait(func, timeout=10):
+    for i in range(int(timeout * 10)):
+        if func():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def test_hybrid_local(pbs_engine, task_factory, fake_sos, sos_home):
+    local = task_factory('t1000000000000000', walltime='00:01:00')
+    long_task = task_factory('t2000000000000000', walltime='02:00:00')
+    big_task = task_factory('t3000000000000000', walltime='00:01:00', cores=4)
+
+    def respond(cmd):
+        if cmd.startswith('qsub'):
+            return '1001.server'
+        return ''.join(f'{x}\tsubmitted\n' for x in (local, long_task, big_task))
+
+    engine = pbs_engine(
+        respond,
+        hybrid_local=True,
+        shared_filesystem=True,
+        queue_wait='1h',
+        local_cores=2,
+        local_sos=fake_sos,
+        submit_order='fifo')
+    assert engine.execute_tasks([local, long_task, big_task])
+    # only tasks that are too long or too big for the pool are submitted
+    assert len([x for x in engine.agent.commands if x.startswith('qsub')]) == 2
+    assert engine.spool.find(local, '.job_id') is None
+    assert engine.query_tasks([local]).splitlines()[0] in (f'{local}\tsubmitted',
+                                                           f'{local}\trunning')
+    assert _wait(lambda: engine._local.status(local) is None)
+    assert os.path.isfile(str(sos_home / f'{local}.done'))
+    # the task file is sent to the host for sos status
+    assert engine.agent.sent_files[-1][0].endswith(f'{local}.task')
+
+
+def test_hybrid_without_queue_wait(pbs_engine, task_factory, fake_sos):
+    task_id = task_factory('t1000000000000000', walltime='00:01:00')
+    engine = pbs_engine(
+        lambda cmd: '1001.server', hybrid_local=True,
+        shared_filesystem=True, local_sos=fake_sos)
+    # tasks are submitted if queue wait is unknown
+    assert engine.execute_tasks([task_id])
+    assert engine.spool.find(task_id, '.job_id') is not None
+
+
+def test_hybrid_without_shared_filesystem(pbs_engine, task_factory, fake_sos):
+    from sos_pbs.local_pool import shares_filesystem
+
+    task_id = task_factory('t1000000000000000', walltime='00:01:00')
+    engine = pbs_engine(
+        lambda cmd: '1001.server', hybrid_local=True, queue_wait='1h',
+        local_sos=fake_sos)
+    # tasks with paths mapped for the host are not run locally
+    assert engine._local is None
+    assert engine.execute_tasks([task_id])
+    assert engine.spool.find(task_id, '.job_id') is not None
+    # sos maps no paths for hosts that share all paths with the local machine
+    assert shares_filesystem({'shared': ['/']})
+    assert not shares_filesystem({'shared': ['/home/']})
+
+
+def test_kill_local_task(pbs_engine, task_factory, fake_sos, sos_home, monkeypatch):
+    monkeypatch.setenv('SOS_SLEEP', '30')
+    tasks = [task_factory(f't{i}000000000000000', walltime='00:01:00') for i in (1, 2)]
+
+    def respond(cmd):
+        if cmd.startswith('sos kill'):
+            return ''.join(f'{x}\tkilled\n' for x in cmd.split()[2:])
+        return ''
+
+    engine = pbs_engine(
+        respond, hybrid_local=True, shared_filesystem=True, queue_wait='1h',
+        local_cores=1, local_sos=fake_sos)
+    assert engine.execute_tasks(tasks)
+    assert _wait(lambda: engine._local.status(tasks[0]) == 'running')
+    # the second task waits for the core used by the first one
+    assert engine._local.status(tasks[1]) == 'submitted'
+    engine.kill_tasks(tasks)
+    assert _wait(lambda: all(engine._local.status(x) is None for x in tasks))
+    assert not any(os.path.isfile(str(sos_home / f'{x}.done')) for x in tasks)
+    assert not engine.agent.sent_files
+
+
+def test_local_task_not_started(pbs_engine, task_factory, sos_home):
+    tasks = [task_factory(f't{i}000000000000000', walltime='00:01:00') for i in (1, 2)]
+    engine = pbs_engine(
+        lambda cmd: ''.join(f'{x}\tpending\n' for x in tasks), hybrid_local=True,
+        shared_filesystem=True, queue_wait='1h', local_cores=1,
+        local_sos=str(sos_home / 'missing'))
+    assert engine.execute_tasks(tasks)
+    # tasks that cannot be started are failed and do not keep their cores
+    assert _wait(lambda: all(engine._local.status(x) == 'failed' for x in tasks))
+    assert engine._local._used_cores == 0
+    assert engine.query_tasks(tasks) == ''.join(f'{x}\tfailed\n' for x in tasks)
+
+
+def test_local_task_history(pbs_engine, task_factory, fake_sos):
+    from sos_pbs.job_history import iter_records
+
+    task_id = task_factory('t1000000000000000', walltime='00:01:00')
+    status = {'sos': 'running'}
+    engine = pbs_engine(
+        lambda cmd: f'{task_id}\t{status["sos"]}\n',
+        hybrid_local=True,
+        shared_filesystem=True,
+        queue_wait='1h',
+        local_sos=fake_sos)
+    assert engine.execute_tasks([task_id])
+    assert _wait(lambda: engine._local.status(task_id) is None)
+    # the end of a local task is recorded like that of a submitted one
+    status['sos'] = 'completed'
+    engine.query_tasks([task_id])
+    engine._jobs.flush()
+    assert [(x['event'], x['queue'], x['job_id'], x['status'])
+            for x in iter_records()] == [
+                ('submit', 'local', 'local', 'submitted'),
+                ('end', 'local', 'local', 'completed'),
+            ]
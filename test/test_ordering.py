@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import time
+
+import pytest
+
+
+def test_longest_first(pbs_engine, task_factory):
+    engine = pbs_engine(
+        lambda cmd: cmd.split('/')[-1].split('.')[0] + '.server',
+        submit_order='longest_first',
+        submit_cmd='qsub -p -{submit_rank} {job_file}')
+    short = task_factory('t1000000000000000', walltime='00:10:00')
+    default = task_factory('t2000000000000000')
+    long = task_factory('t3000000000000000', walltime='10h')
+    urgent = task_factory('t4000000000000000', walltime='1h', priority=10)
+    assert engine.execute_tasks([short, default, long, urgent])
+    assert [x for x in engine.agent.commands if x.startswith('qsub')] == [
+        f'qsub -p -0 ~/.sos/tasks/{urgent}.sh',
+        f'qsub -p -1 ~/.sos/tasks/{long}.sh',
+        f'qsub -p -2 ~/.sos/tasks/{short}.sh',
+        f'qsub -p -3 ~/.sos/tasks/{default}.sh',
+    ]
+
+
+def test_order_pending_tasks(pbs_engine, task_factory):
+    # tasks are queued one at a time and submitted in slots of batch_size 1
+    engine = pbs_engine(
+        lambda cmd: '1001.server' if cmd.startswith('qsub') else '',
+        submit_order='longest_first',
+        submit_cmd='qsub -p -{submit_rank} {job_file}')
+    short = task_factory('t1000000000000000', walltime='00:10:00')
+    default = task_factory('t2000000000000000')
+    long = task_factory('t3000000000000000', walltime='10h')
+    urgent = task_factory('t4000000000000000', walltime='1h', priority=10)
+    for task_id in (short, default, long, urgent):
+        assert engine.submit_task(task_id) == 'pending'
+    assert engine.pending_tasks == [urgent, long, short, default]
+    engine.start()
+    for i in range(100):
+        qsub = [x for x in engine.agent.commands if x.startswith('qsub')]
+        if len(qsub) == 4:
+            break
+        time.sleep(0.1)
+    # ranks are the order in which the jobs are submitted
+    assert qsub == [
+        f'qsub -p -0 ~/.sos/tasks/{urgent}.sh',
+        f'qsub -p -1 ~/.sos/tasks/{long}.sh',
+        f'qsub -p -2 ~/.sos/tasks/{short}.sh',
+        f'qsub -p -3 ~/.sos/tasks/{default}.sh',
+    ]
+
+
+def test_fifo(pbs_engine, task_factory):
+    # tasks are submitted in the order they are queued by default
+    engine = pbs_engine(lambda cmd: '1.server')
+    tasks = [
+        task_factory('t1000000000000000', walltime='1h'),
+        task_factory('t2000000000000000', walltime='2h')
+    ]
+    assert engine._order_tasks(tasks) == tasks
+    for task_id in reversed(tasks):
+        engine.pending_tasks.append(task_id)
+    assert engine.pending_tasks == tasks[::-1]
+    engine.config['submit_order'] = 'random'
+    with pytest.raises(ValueError, match='submit_order'):
+        engine._order_tasks(tasks)
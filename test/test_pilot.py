@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import subprocess
+
+
+def _respond(cmd):
+    # submit to a fake scheduler, and run other commands locally
+    if cmd.startswith('qsub'):
+        return '3001.server'
+    return subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE).stdout.decode()
+
+
+def test_pilot_mode(sos_home, pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(3, 0, -1)]
+    engine = pbs_engine(
+        _respond,
+        pilot_jobs=2,
+        pilot_backlog=2,
+        pilot_poll=1,
+        pilot_idle_timeout=1,
+        sos='echo',
+        submit_order='fifo')
+    assert engine.execute_tasks(tasks)
+    pilot_dir = sos_home / '.sos' / 'pilots'
+    assert len(os.listdir(str(pilot_dir / 'queue'))) == 3
+    # two pilots for three queued tasks, and no job for any task
+    qsub = [x for x in engine.agent.commands if x.startswith('qsub')]
+    assert len(qsub) == 2
+    assert all('pilot_' in x for x in qsub)
+    assert engine.spool.find(tasks[0], '.job_id') is None
+    # pilots are not submitted again before they start
+    engine._pilots.scale(force=True)
+    assert len([x for x in engine.agent.commands if x.startswith('qsub')]) == 2
+    #
+    # a pilot runs all queued tasks in order and exits when idle
+    job_file = engine.spool.path(qsub[0].split('/')[-1][:-3], '.sh')
+    proc = subprocess.run(['bash', job_file], stdout=subprocess.PIPE, timeout=30)
+    assert proc.stdout.decode().splitlines() == [
+        f'execute {x} -v 1 -s default -m run' for x in tasks
+    ]
+    for d in ('queue', 'running', 'pilots'):
+        assert os.listdir(str(pilot_dir / d)) == []
+
+
+def test_pilot_dequeue(sos_home, pbs_engine, task_factory):
+    tasks = [task_factory(f't{i}000000000000000') for i in range(1, 3)]
+    engine = pbs_engine(_respond, pilot_jobs=1)
+    engine._pilots.enqueue(tasks)
+    engine._pilots.dequeue(tasks[:1])
+    queued = os.listdir(str(sos_home / '.sos' / 'pilots' / 'queue'))
+    assert [x.split('-')[1] for x in queued] == tasks[1:]
+
+
+def test_pilot_died_pending(sos_home, pbs_engine):
+
+    def respond(cmd):
+        if cmd.startswith('qsub'):
+            return '3001.server'
+        if cmd.startswith('qstat'):
+            raise subprocess.CalledProcessError(153, cmd)
+        return subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE).stdout.decode()
+
+    engine = pbs_engine(respond, pilot_jobs=1, status_check_interval=60)
+    pilots = engine._pilots
+    os.makedirs(str(sos_home / '.sos' / 'pilots' / 'queue'))
+    (sos_home / '.sos' / 'pilots' / 'queue' / '1-t1000000000000000').write_text('')
+    assert pilots.scale(force=True) == 1
+    # the job of the pilot is not checked right after submission
+    assert pilots.scale(force=True) == 0
+    assert not [x for x in engine.agent.commands if x.startswith('qstat')]
+    # a pilot whose job is no longer known to the scheduler is replaced
+    for pilot_id in pilots._checked:
+        pilots._checked[pilot_id] = 0
+    assert pilots.scale(force=True) == 1
+    assert 'qstat 3001.server' in engine.agent.commands
+    assert len(pilots._pending) == 1
+
+
+def test_pilot_fit(sos_home, pbs_engine, task_factory):
+    small = task_factory('t1000000000000000', walltime='10m', mem='1G')
+    wide = task_factory('t2000000000000000', cores=4)
+    long = task_factory('t3000000000000000', walltime='2h')
+    engine = pbs_engine(
+        _respond,
+        pilot_jobs=1,
+        pilot_walltime='1h',
+        pilot_cores=2,
+        pilot_mem='4G',
+        pilot_poll=1,
+        pilot_idle_timeout=1,
+        pilot_reserve=0,
+        sos='echo',
+        submit_order='fifo')
+    assert engine.execute_tasks([small, wide, long])
+    pilot_dir = sos_home / '.sos' / 'pilots'
+    queued = os.listdir(str(pilot_dir / 'queue'))
+    assert [x.split('-')[1] for x in queued] == [small]
+    assert (pilot_dir / 'queue' / queued[0]).read_text().split()[:4] == [
+        small, '600', '1000000000', '1'
+    ]
+    # tasks that do not fit in a pilot are submitted as jobs of their own
+    assert engine._get_job_id(wide) == {'job_id': '3001.server'}
+    assert engine._get_job_id(long) == {'job_id': '3001.server'}
+    assert engine._get_job_id(small) == {}
+    # a pilot leaves tasks that it cannot finish to other pilots
+    (pilot_dir / 'queue' / '0-t4000000000000000').write_text(
+        't4000000000000000 7200 0 1 -v 1\n')
+    qsub = [x for x in engine.agent.commands if 'pilot_' in x]
+    job_file = engine.spool.path(qsub[-1].split('/')[-1][:-3], '.sh')
+    proc = subprocess.run(['bash', job_file], stdout=subprocess.PIPE, timeout=30)
+    assert proc.stdout.decode().splitlines() == [
+        f'execute {small} -v 1 -s default -m run'
+    ]
+    assert os.listdir(str(pilot_dir / 'queue')) == ['0-t4000000000000000']
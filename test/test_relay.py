@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import io
+import json
+import os
+import stat
+import sys
+
+import pytest
+from sos.pattern import regex
+
+from sos_pbs.relay import RelayClient, serve
+
+
+@pytest.fixture
+def fake_qsub(sos_home):
+    # a fake scheduler that checks the job file and prints a job id
+    qsub = os.path.join(str(sos_home), 'qsub')
+    with open(qsub, 'w') as script:
+        script.write('#!/bin/sh\n'
+                     'test -f "$1" || { echo "no job file $1"; exit 1; }\n'
+                     'echo "Job $$.fake-server is submitted"\n')
+    os.chmod(qsub, os.stat(qsub).st_mode | stat.S_IEXEC)
+    return qsub
+
+
+def _request(task_id, qsub):
+    return {
+        'task_id': task_id,
+        'job_file': f'~/.sos/tasks/{task_id}.sh',
+        'script': 'echo hello\n',
+        'cmd': f'{qsub} ~/.sos/tasks/{task_id}.sh',
+        'pattern': regex('Job {job_id}.{server} is submitted'),
+        'job_id_file': f'~/.sos/tasks/{task_id}.job_id',
+    }
+
+
+def test_relay_serve(sos_home, fake_qsub):
+    stdin = io.StringIO(''.join(
+        json.dumps(_request(x, fake_qsub)) + '\n'
+        for x in ('t1', 't2')) + json.dumps(_request('t3', '/bin/false')) +
+                        '\n')
+    stdout = io.StringIO()
+    serve(stdin, stdout)
+    results = [json.loads(x) for x in stdout.getvalue().splitlines()]
+    assert [x['task_id'] for x in results] == ['t1', 't2', 't3']
+    assert results[0]['fields']['server'] == 'fake-server'
+    assert results[0]['job_id'] != results[1]['job_id']
+    assert 'error' in results[2]
+    # job file and job id file are written on the "remote" host
+    task_dir = os.path.join(str(sos_home), '.sos', 'tasks')
+    with open(os.path.join(task_dir, 't1.job_id')) as job_id:
+        assert f'job_id: {results[0]["job_id"]}\n' in job_id.read()
+    with open(os.path.join(task_dir, 't2.sh')) as job_file:
+        assert job_file.read() == 'echo hello\n'
+
+
+def test_relay_client(sos_home, fake_qsub, pbs_config, fake_agent):
+    relay = RelayClient(fake_agent(pbs_config), sys.executable).start()
+    try:
+        results = relay.submit([_request(f't{i}', fake_qsub) for i in range(5)])
+        assert [x['task_id'] for x in results] == [f't{i}' for i in range(5)]
+        assert all('job_id' in x for x in results)
+    finally:
+        relay.close()
+
+
+def test_engine_with_relay(pbs_engine, task_factory, fake_qsub):
+    engine = pbs_engine(
+        submit_relay=True,
+        relay_python=sys.executable,
+        submit_cmd=fake_qsub + ' {job_file}',
+        submit_cmd_output='Job {job_id}.{server} is submitted')
+    tasks = [task_factory(f't{i}000000000000000') for i in range(3)]
+    assert engine.execute_tasks(tasks)
+    for task_id in tasks:
+        assert engine._get_job_id(task_id)['server'] == 'fake-server'
+    # no submit command goes through the agent
+    assert not engine.agent.commands
+    engine._relay.close()
+
+
+def test_relay_errors(pbs_engine, task_factory, fake_qsub, monkeypatch):
+    engine = pbs_engine(
+        submit_relay=True,
+        relay_python=sys.executable,
+        submit_cmd=fake_qsub + ' {job_file}',
+        submit_cmd_output='Job {job_id}.{server} is submitted')
+    tasks = [task_factory(f't{i}000000000000000') for i in range(3)]
+    relay = engine._get_relay()
+    submit = relay.submit
+
+    def submit_with_error(requests):
+        results = submit(requests)
+        results[1] = {'task_id': requests[1]['task_id'], 'error': 'rejected'}
+        return results
+
+    monkeypatch.setattr(relay, 'submit', submit_with_error)
+    assert not engine.execute_tasks(tasks)
+    # jobs submitted before and after the failed one are recorded
+    assert engine._get_job_id(tasks[0])['server'] == 'fake-server'
+    assert engine._get_job_id(tasks[2])['server'] == 'fake-server'
+    relay.close()
+
+
+def test_relay_failure(pbs_engine, task_factory, fake_qsub, monkeypatch):
+    import subprocess
+
+    def respond(cmd):
+        if cmd.startswith(fake_qsub):
+            return 'Job 99.direct is submitted'
+        return subprocess.run(
+            cmd, shell=True, stdout=subprocess.PIPE).stdout.decode()
+
+    engine = pbs_engine(
+        respond,
+        submit_relay=True,
+        relay_python=sys.executable,
+        submit_cmd=fake_qsub + ' {job_file}',
+        submit_cmd_output='Job {job_id}.{server} is submitted')
+    tasks = [task_factory(f't{i}000000000000000') for i in range(3)]
+    # a job id file of an earlier submission of the last task
+    with open(os.path.expanduser(f'~/.sos/tasks/{tasks[2]}.job_id'), 'w') as job_id:
+        job_id.write('job_id: 1\n')
+    relay = engine._get_relay()
+    submit = relay.submit
+
+    def submit_and_fail(requests):
+        submit(requests[:2])
+        raise RuntimeError('connection lost')
+
+    monkeypatch.setattr(relay, 'submit', submit_and_fail)
+    assert engine.execute_tasks(tasks)
+    # only the task that the relay did not submit is submitted again
+    qsub = [x for x in engine.agent.commands if x.startswith(fake_qsub)]
+    assert len(qsub) == 1 and tasks[2] in qsub[0]
+    assert engine._get_job_id(tasks[0])['server'] == 'fake-server'
+    assert 'submission' not in engine._get_job_id(tasks[1])
+    assert engine._get_job_id(tasks[2])['server'] == 'direct'
+
+
+def test_engine_with_inline_submit(pbs_engine, task_factory, fake_qsub, sos_home):
+    import subprocess
+
+    def respond(cmd):
+        # the remote host is the local host with a banner
+        return 'Welcome to the cluster\n' + subprocess.run(
+            cmd, shell=True, stdout=subprocess.PIPE).stdout.decode()
+
+    engine = pbs_engine(
+        respond,
+        inline_submit=True,
+        relay_python=sys.executable,
+        submit_cmd=fake_qsub + ' {job_file}',
+        submit_cmd_output='Job {job_id}.{server} is submitted')
+    task_id = task_factory('t1000000000000000')
+    assert engine._prepare_script(task_id, history={'resubmits': 1})
+    # one remote command, and no files sent to the host
+    assert len(engine.agent.commands) == 1
+    assert not engine.agent.sent_files
+    job_id = engine._get_job_id(task_id)
+    assert job_id['server'] == 'fake-server'
+    tasks_dir = sos_home / '.sos' / 'tasks'
+    with open(str(tasks_dir / f'{task_id}.job_id')) as job_id_file:
+        assert job_id_file.read() == (f'job_id: {job_id["job_id"]}\n'
+                                      'server: fake-server\nresubmits: 1\n')
+    assert (tasks_dir / f'{task_id}.sh').read_text().startswith('#!/bin/bash')
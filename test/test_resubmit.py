@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import time
+
+PATTERN = r'{job_id,\d\S*} {name} {status} {queue}'
+
+
+def _wait_for_snapshot(engine):
+    for i in range(50):
+        if engine._status_cache.snapshot() is not None:
+            return
+        time.sleep(0.1)
+
+
+def test_resubmit_preempted(pbs_engine, task_factory):
+    tasks = ['t1000000000000000', 't2000000000000000', 't3000000000000000']
+    table = ('1001.server t1 PR preemptible\n'
+             '1002.server t2 R preemptible\n'
+             '1003.server t3 NF preemptible\n')
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return table
+        if cmd.startswith('qsub'):
+            return '2001.server'
+        if cmd.startswith('qdel'):
+            return ''
+        return ''.join(f'{x}\trunning\n' for x in tasks)
+
+    engine = pbs_engine(
+        respond,
+        status_table_cmd='qstat',
+        status_table_output=PATTERN,
+        fallback_queue='standard',
+        task_template='#!/bin/bash\n#PBS -q {queue}\n{command}\n',
+        queue='preemptible')
+    for task_id, job_id in zip(tasks, ['1001.server', '1002.server', '1003.server']):
+        task_factory(task_id)
+        engine.spool.write_job_id(task_id, {'job_id': job_id})
+    _wait_for_snapshot(engine)
+    assert engine.query_tasks(tasks) == (f'{tasks[0]}\tsubmitted\n'
+                                         f'{tasks[1]}\trunning\n'
+                                         f'{tasks[2]}\tsubmitted\n')
+    assert 'qdel 1001.server' in engine.agent.commands
+    assert 'qdel 1002.server' not in engine.agent.commands
+    # tasks are reset on the host before they are submitted again
+    assert engine.agent.prepared == [tasks[0], tasks[2]]
+    assert engine._get_job_id(tasks[0]) == {
+        'job_id': '2001.server',
+        'previous_job_ids': '1001.server',
+        'previous_reasons': 'preempted',
+        'resubmits': '1',
+    }
+    with open(engine.spool.path(tasks[2], '.sh')) as job_file:
+        assert '#PBS -q standard' in job_file.read()
+    # the new jobs are not resubmitted again
+    n_commands = len(engine.agent.commands)
+    engine.query_tasks(tasks)
+    assert not any(
+        x.startswith('qsub') for x in engine.agent.commands[n_commands:])
+
+
+def test_max_resubmits(pbs_engine, task_factory):
+    task_id = task_factory('t1000000000000000')
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return '1001.server t1 RQ batch\n'
+        return f'{task_id}\tsubmitted\n'
+
+    engine = pbs_engine(
+        respond,
+        status_table_cmd='qstat',
+        status_table_output=PATTERN,
+        max_resubmits=2)
+    engine.spool.write_job_id(task_id, {
+        'job_id': '1001.server',
+        'previous_job_ids': '999.server 1000.server',
+        'resubmits': 2
+    })
+    _wait_for_snapshot(engine)
+    assert engine.query_tasks([task_id]) == f'{task_id}\tsubmitted\n'
+    assert not any(x.startswith('qsub') for x in engine.agent.commands)
+
+
+def test_resubmit_unprepared(pbs_engine, task_factory, monkeypatch):
+    task_id = task_factory('t1000000000000000')
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return '1001.server t1 PR batch\n'
+        return f'{task_id}\trunning\n'
+
+    engine = pbs_engine(
+        respond, status_table_cmd='qstat', status_table_output=PATTERN)
+    monkeypatch.setattr(engine.agent, 'prepare_task', lambda task_id: False)
+    engine.spool.write_job_id(task_id, {'job_id': '1001.server'})
+    _wait_for_snapshot(engine)
+    # the task is not submitted if it cannot be reset on the host
+    assert engine.query_tasks([task_id]) == f'{task_id}\trunning\n'
+    assert not any(x.startswith('qsub') for x in engine.agent.commands)
+
+
+def test_failure_reason():
+    from sos_pbs.schedulers import JobRecord, failure_reason
+
+    assert failure_reason(JobRecord('oom')) == 'oom'
+    assert failure_reason(JobRecord('failed', 'F', 140)) == 'timeout'
+    # the exit codes of jobs killed by scancel -s KILL and qdel need a reason
+    assert failure_reason(JobRecord('failed', 'F', 137)) is None
+    assert failure_reason(JobRecord('failed', 'F', 271)) is None
+    assert failure_reason(JobRecord('failed', 'F', 137, 'OUT_OF_MEMORY')) == 'oom'
+    assert failure_reason(JobRecord('failed', 'F', 271, 'TIMEOUT')) == 'timeout'
+    assert failure_reason(
+        JobRecord('failed', 'F', 271, 'job killed: walltime exceeded')) == 'timeout'
+    assert failure_reason(
+        JobRecord('failed', 'F', -11, 'job exceeded resource walltime')) == 'timeout'
+    assert failure_reason(JobRecord('failed', 'F', 1)) is None
+    assert failure_reason(JobRecord('running', 'R', 137)) is None
+    # comments of PBS
+    assert failure_reason(JobRecord(
+        'failed', 'F', -10,
+        'job killed: mem job total 2158592 kb exceeded limit 2097152 kb')) == 'oom'
+    assert failure_reason(JobRecord(
+        'failed', 'F', -11, 'job killed: walltime 3610 exceeded limit 3600')) == 'timeout'
+    assert failure_reason(JobRecord(
+        'failed', 'F', 1,
+        'Job run at Mon Oct 19 at 10:11 on (node01:ncpus=1:mem=2097152kb) and finished')) is None
+    # cancelled jobs are not retried
+    assert failure_reason(JobRecord('cancelled', 'CA', 0, 'OOM-Kill event detected')) is None
+    assert failure_reason(JobRecord('cancelled', 'CA', 271, 'TIMEOUT')) is None
+
+
+def test_retry_with_more_resources(pbs_engine, task_factory):
+    tasks = ['t1000000000000000', 't2000000000000000', 't3000000000000000']
+    table = ('1001.server t1 OOM batch\n'
+             '1002.server t2 TO batch\n'
+             '1003.server t3 OOM batch\n')
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return table
+        if cmd.startswith('qsub'):
+            return '2001.server'
+        return ''.join(f'{x}\tfailed\n' for x in tasks)
+
+    engine = pbs_engine(
+        respond,
+        status_table_cmd='qstat',
+        status_table_output=PATTERN,
+        retry_max_walltime='01:30:00',
+        task_template='#!/bin/bash\n#PBS -l mem={mem},walltime={walltime}\n{command}\n')
+    for task_id, job_id in zip(tasks, ['1001.server', '1002.server', '1003.server']):
+        task_factory(task_id, mem=2000000000, walltime='01:00:00')
+        engine.spool.write_job_id(task_id, {'job_id': job_id})
+    engine.spool.write_job_id(tasks[2], {'job_id': '1003.server', 'retries': 2})
+    _wait_for_snapshot(engine)
+    assert engine.query_tasks(tasks) == (f'{tasks[0]}\tsubmitted\n'
+                                         f'{tasks[1]}\tsubmitted\n'
+                                         f'{tasks[2]}\tfailed\n')
+    assert engine._get_job_id(tasks[0]) == {
+        'job_id': '2001.server',
+        'mem': '4000000000',
+        'previous_job_ids': '1001.server',
+        'previous_reasons': 'oom',
+        'retries': '1',
+    }
+    with open(engine.spool.path(tasks[0], '.sh')) as job_file:
+        assert 'mem=4000000000,walltime=01:00:00' in job_file.read()
+    # walltime is capped by retry_max_walltime
+    with open(engine.spool.path(tasks[1], '.sh')) as job_file:
+        assert 'mem=2000000000,walltime=01:30:00' in job_file.read()
+    # jobs that have ended are not cancelled
+    assert not any(x.startswith('qdel') for x in engine.agent.commands)
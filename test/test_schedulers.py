@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+
+import pytest
+
+from sos_pbs.schedulers import JobRecord, get_scheduler
+
+SQUEUE_JSON = json.dumps({
+    'meta': {'plugin': {'type': 'openapi/v0.0.39'}},
+    'jobs': [{
+        'job_id': 101,
+        'job_state': ['RUNNING'],
+        'state_reason': 'None',
+        'partition': 'short',
+        'exit_code': {'status': ['SUCCESS'], 'return_code': {'set': True, 'number': 0}},
+    }, {
+        'job_id': 102,
+        'job_state': 'PENDING',
+        'state_reason': 'Priority',
+        'partition': 'long',
+    }]
+})
+
+SACCT_JSON = json.dumps({
+    'jobs': [{
+        'job_id': 103,
+        'state': {'current': ['OUT_OF_MEMORY'], 'reason': 'None'},
+        'exit_code': {'status': ['ERROR'], 'return_code': {'set': True, 'number': 137}},
+        'partition': 'short',
+    }]
+})
+
+PBSPRO_JSON = json.dumps({
+    'timestamp': 1600000000,
+    'pbs_version': '19.1.3',
+    'Jobs': {
+        '201.pbs': {'job_state': 'R', 'queue': 'workq', 'Resource_List': {'ncpus': 1}},
+        '202.pbs': {'job_state': 'F', 'queue': 'workq', 'Exit_status': 271},
+    }
+})
+
+BJOBS_JSON = json.dumps({
+    'COMMAND': 'bjobs',
+    'JOBS': 2,
+    'RECORDS': [
+        {'JOBID': '301', 'STAT': 'RUN', 'EXIT_CODE': '', 'EXIT_REASON': '', 'QUEUE': 'normal'},
+        {'JOBID': '302', 'STAT': 'EXIT', 'EXIT_CODE': '130', 'EXIT_REASON': 'TERM_RUNLIMIT: job killed after reaching LSF run time limit', 'QUEUE': 'normal'},
+    ]
+})
+
+TORQUE_XML = '''<Data><Job><Job_Id>401.torque</Job_Id><job_state>Q</job_state><queue>batch</queue></Job>
+<Job><Job_Id>402.torque</Job_Id><job_state>C</job_state><queue>batch</queue><exit_status>0</exit_status></Job></Data>'''
+
+SGE_XML = '''<?xml version='1.0'?>
+<job_info><queue_info><job_list state="running"><JB_job_number>501</JB_job_number><state>r</state><queue_name>all.q@node1</queue_name></job_list></queue_info>
+<job_info><job_list state="pending"><JB_job_number>502</JB_job_number><state>qw</state></job_list></job_info></job_info>'''
+
+
+def test_submit_output():
+    assert get_scheduler('slurm').parse_submit_output('123;cluster\n') == {
+        'job_id': '123',
+        'cluster': 'cluster'
+    }
+    assert get_scheduler('slurm').parse_submit_output(
+        'Submitted batch job 124') == {'job_id': '124'}
+    assert get_scheduler('pbspro').parse_submit_output(
+        'warning\n125.server') == {'job_id': '125.server'}
+    assert get_scheduler('lsf').parse_submit_output(
+        'Job <126> is submitted to queue <normal>.') == {
+            'job_id': '126',
+            'queue': 'normal'
+        }
+    assert get_scheduler('sge').parse_submit_output('127.1-10:1') == {
+        'job_id': '127'
+    }
+    assert get_scheduler('lsf').parse_submit_output('unexpected') is None
+    with pytest.raises(ValueError):
+        get_scheduler('condor')
+
+
+def test_status_tables():
+    slurm = get_scheduler('slurm')
+    assert slurm.parse_status_table(SQUEUE_JSON) == {
+        '101': JobRecord('running', 'RUNNING', 0, None, 'short'),
+        '102': JobRecord('queued', 'PENDING', None, 'Priority', 'long'),
+    }
+    assert slurm.parse_status_table(SACCT_JSON)['103'] == JobRecord(
+        'oom', 'OUT_OF_MEMORY', 137, None, 'short')
+    assert get_scheduler('pbspro').parse_status_table(PBSPRO_JSON) == {
+        '201.pbs': JobRecord('running', 'R', None, None, 'workq'),
+        '202.pbs': JobRecord('failed', 'F', 271, None, 'workq'),
+    }
+    lsf = get_scheduler('lsf').parse_status_table(BJOBS_JSON)
+    assert lsf['301'].state == 'running'
+    assert lsf['302'].state == 'timeout'
+    assert lsf['302'].exit_code == 130
+    torque = get_scheduler('torque').parse_status_table(TORQUE_XML)
+    assert torque['401.torque'].state == 'queued'
+    assert torque['402.torque'].state == 'completed'
+    sge = get_scheduler('sge').parse_status_table(SGE_XML)
+    assert sge['501'] == JobRecord('running', 'r', None, None, 'all.q@node1')
+    assert sge['502'].state == 'queued'
+
+
+def test_engine_with_scheduler(pbs_engine, task_factory, pbs_config):
+    pbs_config.pop('submit_cmd')
+    pbs_config.pop('kill_cmd')
+    engine = pbs_engine(lambda cmd: '2001;cluster\n' if cmd.startswith(
+        'sbatch') else '{"jobs": []}', scheduler='slurm')
+    assert engine.kill_cmd == 'scancel {job_id}'
+    task_id = task_factory('t1000000000000000')
+    assert engine.execute_tasks([task_id])
+    assert 'sbatch --parsable ~/.sos/tasks/t1000000000000000.sh' in engine.agent.commands
+    assert engine._get_job_id(task_id) == {
+        'job_id': '2001',
+        'cluster': 'cluster'
+    }
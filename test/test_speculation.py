@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import time
+
+from sos.tasks import TaskFile
+
+from sos_pbs.speculation import backup_id
+
+PATTERN = r'{job_id,\d\S*} {name} {status} {queue}'
+
+
+def _wait_for_snapshot(engine):
+    for i in range(50):
+        if engine._status_cache.snapshot() is not None:
+            return
+        time.sleep(0.1)
+
+
+def test_stragglers(pbs_engine):
+    engine = pbs_engine(speculative_factor=2, speculative_after=0.75)
+    spec = engine._speculation
+    tasks = [f't{i}000000000000000' for i in range(1, 5)]
+    for task_id in tasks:
+        spec.track(task_id, 'scatter_10')
+        spec.update(task_id, 'running', now=0)
+    # no backup before most tasks have completed
+    spec.update(tasks[0], 'completed', now=10)
+    spec.update(tasks[1], 'completed', now=12)
+    assert not spec.update(tasks[3], 'running', now=100)
+    spec.update(tasks[2], 'completed', now=14)
+    # median runtime is 12
+    assert not spec.update(tasks[3], 'running', now=20)
+    assert spec.update(tasks[3], 'running', now=25)
+    # tasks of other steps are not affected
+    spec.track('t5000000000000000', 'other_10')
+    assert not spec.update('t5000000000000000', 'running', now=0)
+    assert not spec.update('t5000000000000000', 'running', now=1000)
+
+
+def test_backup_id():
+    task_id = 't1000000000000000'
+    backup = backup_id(task_id)
+    assert len(backup) == len(task_id) and backup != task_id
+    assert backup_id(task_id) == backup
+
+
+def _speculative_engine(pbs_engine, task_id, table, status):
+    backup = backup_id(task_id)
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return table['qstat']
+        if cmd.startswith('qsub'):
+            return '2001.server'
+        if cmd.startswith('qdel'):
+            return cmd.split()[-1] + ' deleted'
+        if backup in cmd:
+            return f'{backup}\t{status[backup]}\n'
+        return f'{task_id}\t{status[task_id]}\n'
+
+    engine = pbs_engine(
+        respond,
+        status_table_cmd='qstat',
+        status_table_output=PATTERN,
+        speculative_factor=2,
+        speculative_queue='long',
+        queue='short',
+        task_template='#!/bin/bash\n#PBS -q {queue}\n{command}\n')
+    engine._render_job(task_id)
+    engine.spool.write_job_id(task_id, {'job_id': '1001.server'})
+    _wait_for_snapshot(engine)
+    # pretend that other tasks of the step completed in 10 seconds
+    engine._speculation.runtimes['scatter_10'] = {'t2': 10, 't3': 10}
+    engine._speculation.started[task_id] = time.time() - 100
+    engine.query_tasks([task_id])
+    return engine
+
+
+def test_backup_copy(pbs_engine, task_factory):
+    task_id = task_factory('t1000000000000000', step_name='scatter_10')
+    backup = backup_id(task_id)
+    table = {'qstat': '1001.server t1 R short\n'}
+    status = {task_id: 'running', backup: 'submitted'}
+    engine = _speculative_engine(pbs_engine, task_id, table, status)
+    # the backup is a copy of the task with its own id and job
+    assert engine.agent.prepared == [backup]
+    assert TaskFile(backup).params.sos_dict['step_name'] == 'scatter_10'
+    assert engine._get_job_id(task_id) == {
+        'job_id': '1001.server',
+        'backup_task': backup,
+        'backup_job_id': '2001.server'
+    }
+    assert engine._get_job_id(backup) == {'job_id': '2001.server'}
+    with open(engine.spool.path(backup, '.sh')) as job_file:
+        text = job_file.read()
+        assert '#PBS -q long' in text
+        assert f'sos execute {backup} ' in text
+    # only one backup is submitted
+    engine.query_tasks([task_id])
+    assert len([x for x in engine.agent.commands if x.startswith('qsub')]) == 1
+    # both jobs are killed with the task
+    status[task_id] = 'killed'
+    assert engine.kill_tasks([task_id]) == (
+        f'{task_id}\tkilled\t1001.server deleted\n2001.server deleted\n')
+
+
+def test_task_wins(pbs_engine, task_factory):
+    task_id = task_factory('t1000000000000000', step_name='scatter_10')
+    backup = backup_id(task_id)
+    table = {'qstat': '1001.server t1 R short\n2001.server t2 R long\n'}
+    status = {task_id: 'running', backup: 'running'}
+    engine = _speculative_engine(pbs_engine, task_id, table, status)
+    engine.agent.commands.clear()
+    status[task_id] = 'completed'
+    assert engine.query_tasks([task_id]) == f'{task_id}\tcompleted\n'
+    assert [x for x in engine.agent.commands if x.startswith('qdel')
+           ] == ['qdel 2001.server']
+    assert not engine._speculation.backups
+
+
+def test_backup_wins(pbs_engine, task_factory):
+    task_id = task_factory('t1000000000000000', step_name='scatter_10')
+    backup = backup_id(task_id)
+    table = {'qstat': '1001.server t1 R short\n2001.server t2 R long\n'}
+    status = {task_id: 'running', backup: 'running'}
+    engine = _speculative_engine(pbs_engine, task_id, table, status)
+    engine.agent.sent_files.clear()
+    # the backup completes with its result and signatures
+    TaskFile(backup).add_result({
+        'ret_code': 0,
+        'task': backup,
+        'output': {},
+        'signature': {'sig': 1}
+    })
+    TaskFile(backup).status = 'completed'
+    status[backup] = 'completed'
+    # the job of the task is cancelled, and the task is reported running
+    # until its job has ended
+    assert engine.query_tasks([task_id]) == f'{task_id}\trunning\n'
+    assert 'qdel 1001.server' in engine.agent.commands
+    assert engine.query_tasks([task_id]) == f'{task_id}\trunning\n'
+    table['qstat'] = '1001.server t1 C short\n2001.server t2 C long\n'
+    engine._status_cache.refresh()
+    status[task_id] = 'aborted'
+    assert engine.query_tasks([task_id]) == f'{task_id}\tcompleted\n'
+    task_file = TaskFile(task_id)
+    assert task_file.status == 'completed'
+    assert task_file.result['task'] == task_id
+    assert task_file.signature == {'sig': 1}
+    assert (task_file.task_file, 'tasks') in engine.agent.sent_files
+
+
+def test_backup_fails(pbs_engine, task_factory):
+    task_id = task_factory('t1000000000000000', step_name='scatter_10')
+    backup = backup_id(task_id)
+    table = {'qstat': '1001.server t1 R short\n2001.server t2 R long\n'}
+    status = {task_id: 'running', backup: 'running'}
+    engine = _speculative_engine(pbs_engine, task_id, table, status)
+    # a failed task is not reported while its backup is running
+    status[task_id] = 'failed'
+    assert engine.query_tasks([task_id]) == f'{task_id}\trunning\n'
+    status[backup] = 'failed'
+    assert engine.query_tasks([task_id]) == f'{task_id}\tfailed\n'
+    assert not engine._speculation.backups
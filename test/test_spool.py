@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+
+from sos_pbs.spool import JobSpool
+
+
+def test_sharded_spool(tmp_path):
+    spool = JobSpool({'spool_dir': str(tmp_path)}, 'tasks')
+    job_file = spool.path('t5173b80bf85d3d03', '.sh', create=True)
+    assert job_file == os.path.join(str(tmp_path), 'tasks', '51',
+                                    't5173b80bf85d3d03.sh')
+    assert os.path.isdir(os.path.dirname(job_file))
+    #
+    spool.write_job_id('t5173b80bf85d3d03', {'job_id': '123.server'})
+    assert spool.read_job_id('t5173b80bf85d3d03') == {'job_id': '123.server'}
+    assert spool.read_job_id('t0000000000000000') == {}
+
+
+def test_legacy_job_id_files(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    legacy_dir = tmp_path / 'home' / '.sos' / 'tasks'
+    legacy_dir.mkdir(parents=True)
+    (legacy_dir / 'tabcdef.job_id').write_text('job_id: 42\nserver: pbs\n')
+    # a relocated spool still finds job ids written under ~/.sos/tasks
+    spool = JobSpool({'spool_dir': str(tmp_path / 'spool')}, 'tasks')
+    assert spool.read_job_id('tabcdef') == {'job_id': '42', 'server': 'pbs'}
+    # new job ids take precedence over legacy ones
+    spool.write_job_id('tabcdef', {'job_id': '43'})
+    assert spool.read_job_id('tabcdef') == {'job_id': '43'}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import subprocess
+
+import pytest
+
+TEMPLATE = '''#!/bin/bash
+{stage_in}
+cat $SOS_STAGE_DIR/a.txt $SOS_STAGE_DIR/sub/b.txt > $SOS_STAGE_DIR/out.txt
+{stage_out}
+'''
+
+
+@pytest.mark.parametrize('compress', [False, 'gzip'])
+def test_stage_in_and_out(pbs_engine, task_factory, sos_home, compress):
+    # workdir of tasks created by task_factory
+    workdir = sos_home
+    os.makedirs(str(workdir / 'sub'))
+    (workdir / 'a.txt').write_text('a\n')
+    (workdir / 'sub' / 'b.txt').write_text('b\n')
+    stage_dir = sos_home / 'scratch'
+    engine = pbs_engine(
+        task_template=TEMPLATE,
+        stage_dir=str(stage_dir),
+        stage_skip_local=False,
+        stage_compress=compress)
+    task_id = task_factory(
+        't1000000000000000',
+        input=['a.txt', 'sub/b.txt'],
+        output=['out.txt'])
+    _, job_file, job_text = engine._render_job(task_id)
+    subprocess.check_call(['bash', job_file])
+    assert (workdir / 'out.txt').read_text() == 'a\nb\n'
+    assert not stage_dir.exists()
+
+
+def test_skip_staging(pbs_engine, task_factory, sos_home):
+    engine = pbs_engine(task_template=TEMPLATE)
+    runtime, _, job_text = engine._render_job(
+        task_factory('t1000000000000000'))
+    # nothing to stage
+    assert runtime['stage_in'] == '' and runtime['stage_out'] == ''
+    # inputs on a local file system are not copied
+    (sos_home / 'a.txt').write_text('a\n')
+    runtime, job_file, _ = engine._render_job(
+        task_factory('t2000000000000000', input=['a.txt']))
+    assert 'stat -f -c %T' in runtime['stage_in']
+    stage_dir = os.path.join(str(sos_home), 'tmp')
+    os.makedirs(stage_dir)
+    subprocess.call(['bash', job_file], env=dict(os.environ, TMPDIR=stage_dir))
+    assert os.listdir(stage_dir) == []
+
+
+def test_read_through_stage_dir(pbs_engine, task_factory, sos_home):
+    workdir = sos_home
+    os.makedirs(str(workdir / 'sub'))
+    (workdir / 'a.txt').write_text('a\n')
+    (workdir / 'sub' / 'b.txt').write_text('b\n')
+    stage_dir = sos_home / 'scratch'
+    # the task reads relative paths in the stage dir, where local inputs
+    # are symlinked, and writes one output to the working directory
+    engine = pbs_engine(
+        task_template='#!/bin/bash\n{stage_in}\n'
+        '(cd "$SOS_STAGE_DIR" && test -L a.txt && cat a.txt sub/b.txt > out.txt)\n'
+        f'echo c > {workdir}/direct.txt\n'
+        '{stage_out}\n',
+        stage_dir=str(stage_dir))
+    task_id = task_factory(
+        't1000000000000000',
+        input=['a.txt', 'sub/b.txt'],
+        output=['out.txt', 'direct.txt'])
+    _, job_file, _ = engine._render_job(task_id)
+    subprocess.check_call(['bash', job_file])
+    assert (workdir / 'out.txt').read_text() == 'a\nb\n'
+    assert (workdir / 'direct.txt').read_text() == 'c\n'
+    assert (workdir / 'a.txt').read_text() == 'a\n'
+    assert not stage_dir.exists()
+
+
+def test_outputs_seen_before_stage_out(pbs_engine, task_factory, sos_home):
+    workdir = sos_home
+    stage_dir = sos_home / 'scratch'
+    # sos execute finds the outputs in the working directory, where they are
+    # symlinks to the staging directory until they are copied back
+    engine = pbs_engine(
+        task_template='#!/bin/bash\n{stage_in}\n'
+        'echo a > "$SOS_STAGE_DIR/out.txt"\n'
+        f'test -L {workdir}/out.txt && stat -L -c %Y {workdir}/out.txt > {workdir}/mtime\n'
+        '{stage_out}\n',
+        stage_dir=str(stage_dir))
+    (workdir / 'out.txt').write_text('old\n')
+    (workdir / 'missing.txt').write_text('old\n')
+    task_id = task_factory(
+        't1000000000000000', output=['out.txt', 'missing.txt'])
+    _, job_file, _ = engine._render_job(task_id)
+    subprocess.check_call(['bash', job_file])
+    assert not (workdir / 'out.txt').is_symlink()
+    assert (workdir / 'out.txt').read_text() == 'a\n'
+    # modification times are kept so that signatures stay valid
+    assert int((workdir / 'mtime').read_text()) == int(
+        os.path.getmtime(str(workdir / 'out.txt')))
+    # outputs that are not written are removed instead of left dangling
+    assert not os.path.lexists(str(workdir / 'missing.txt'))
+    assert not stage_dir.exists()
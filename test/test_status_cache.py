@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import time
+
+from sos_pbs.schedulers import PatternScheduler, parse_table_with_pattern
+from sos_pbs.status_cache import SchedulerStatusCache
+
+QSTAT_OUTPUT = '''
+Job ID                    Name             User            Time Use S Queue
+------------------------- ---------------- --------------- -------- - -----
+1001.server               t1000000000      user            00:00:01 R batch
+1002.server               t2000000000      user            0        Q batch
+'''
+
+PATTERN = r'{job_id,\d\S*} {name} {user} {time} {status} {queue}'
+
+
+def test_parse_status_table():
+    jobs = parse_table_with_pattern(QSTAT_OUTPUT, PATTERN)
+    assert set(jobs) == {'1001.server', '1002.server'}
+    assert jobs['1001.server']['status'] == 'R'
+    assert jobs['1002.server']['queue'] == 'batch'
+
+
+def test_shared_snapshot(sos_home, pbs_config, fake_agent):
+    agent = fake_agent(pbs_config, lambda cmd: QSTAT_OUTPUT)
+    reader_agent = fake_agent(pbs_config, lambda cmd: QSTAT_OUTPUT)
+    parser = PatternScheduler(PATTERN).parse_status_table
+    kwargs = dict(interval=1, cache_dir=str(sos_home / 'status'))
+    poller = SchedulerStatusCache(
+        agent, fetch=lambda: parser(agent.check_output('qstat')),
+        **kwargs).start()
+    reader = SchedulerStatusCache(
+        reader_agent,
+        fetch=lambda: parser(reader_agent.check_output('qstat')),
+        **kwargs)
+    for i in range(50):
+        if reader.snapshot() is not None:
+            break
+        time.sleep(0.1)
+    assert reader.snapshot()['jobs']['1001.server'].state == 'running'
+    assert reader.snapshot()['jobs']['1002.server'].native_state == 'Q'
+    # only the process holding the lock calls the scheduler
+    assert agent.commands == ['qstat']
+    assert not reader_agent.commands
+    assert poller._is_poller
+    # stale snapshots are not used
+    old = time.time() - 10
+    os.utime(reader.snapshot_file, (old, old))
+    reader.ttl = 0
+    assert reader.snapshot() is None
+
+
+def test_lost_jobs(pbs_engine, task_factory):
+    tasks = ['t1000000000000000', 't3000000000000000']
+
+    def respond(cmd):
+        if cmd == 'qstat':
+            return QSTAT_OUTPUT
+        return ''.join(f'{x}\tsubmitted\n' for x in tasks)
+
+    engine = pbs_engine(
+        respond, status_table_cmd='qstat', status_table_output=PATTERN)
+    for task_id, job_id in zip(tasks, ['1001.server', '1003.server']):
+        task_factory(task_id)
+        job_id_file = engine.spool.write_job_id(task_id, {'job_id': job_id})
+        old = time.time() - engine._status_cache.interval - 10
+        os.utime(job_id_file, (old, old))
+    for i in range(50):
+        if engine._status_cache.snapshot() is not None:
+            break
+        time.sleep(0.1)
+    assert engine._get_job_status(tasks[0]).state == 'running'
+    assert engine._get_job_status(tasks[1]).state == 'missing'
+    assert not engine._is_job_lost(tasks[0])
+    assert engine._is_job_lost(tasks[1])
+    assert engine.query_tasks(tasks) == (f'{tasks[0]}\tsubmitted\n'
+                                         f'{tasks[1]}\tfailed\n')
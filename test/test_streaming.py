@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from sos_pbs.task_engine import TaskRecord
+
+
+def _respond(cmd):
+    if cmd.startswith('sos kill'):
+        # t1... is already completed
+        return ''.join(f'{x}\t{"completed" if x.startswith("t1") else "killed"}\n'
+                       for x in cmd.split()[2:])
+    if cmd.startswith('sos status'):
+        return ''.join(f'{x}\tsubmitted\n' for x in cmd.split() if x.startswith('t'))
+    if cmd.startswith('qdel'):
+        return f'{cmd.split()[1]} deleted'
+    return ''
+
+
+def test_iter_kill_tasks(pbs_engine):
+    engine = pbs_engine(_respond)
+    tasks = [f't{i}000000000000000' for i in range(1, 6)]
+    for task_id in tasks[:4]:
+        engine.spool.write_job_id(task_id, {'job_id': f'{task_id[1]}.server'})
+    records = engine.iter_kill_tasks(tasks, batch_size=2)
+    # records of the first batch are available before other tasks are killed
+    assert next(records) == TaskRecord(tasks[0], 'completed', None, None)
+    assert len([x for x in engine.agent.commands if x.startswith('sos kill')]) == 1
+    assert list(records) == [
+        TaskRecord(tasks[1], 'killed', '2.server', '2.server deleted'),
+        TaskRecord(tasks[2], 'killed', '3.server', '3.server deleted'),
+        TaskRecord(tasks[3], 'killed', '4.server', '4.server deleted'),
+        TaskRecord(tasks[4], 'killed', None, None),
+    ]
+    assert len([x for x in engine.agent.commands if x.startswith('sos kill')]) == 3
+    # the text output is unchanged
+    assert engine.kill_tasks(tasks[:3]) == (f'{tasks[0]}\tcompleted\t.\n'
+                                            f'{tasks[1]}\tkilled\t2.server deleted\n'
+                                            f'{tasks[2]}\tkilled\t3.server deleted\n')
+
+
+def test_iter_query_tasks(pbs_engine):
+    engine = pbs_engine(_respond)
+    tasks = [f't{i}000000000000000' for i in range(1, 4)]
+    engine.spool.write_job_id(tasks[0], {'job_id': '1.server'})
+    assert list(engine.iter_query_tasks(tasks, batch_size=2)) == [
+        TaskRecord(tasks[0], 'submitted', '1.server', None),
+        TaskRecord(tasks[1], 'submitted', None, None),
+        TaskRecord(tasks[2], 'submitted', None, None),
+    ]
+    assert len([x for x in engine.agent.commands if x.startswith('sos status')]) == 2
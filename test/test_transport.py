@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sos_pbs.transport import RESTTransport, ShellTransport
+
+
+class StubSlurmRestd(BaseHTTPRequestHandler):
+    # a minimal slurmrestd that keeps jobs in memory
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        server.clients.add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.posts += 1
+        if server.drop_posts:
+            # the job might have been submitted before the connection dropped
+            server.drop_posts -= 1
+            self.close_connection = True
+            return
+        if not request['script'].startswith('#!'):
+            return self._reply(500, {'errors': [{'error_number': 2, 'error': 'bad script'}]})
+        with server.lock:
+            job_id = 1000 + len(server.jobs)
+            server.jobs[job_id] = dict(request['job'], script=request['script'])
+        self._reply(200, {'job_id': job_id, 'errors': []})
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self._reply(200, {
+            'jobs': [{
+                'job_id': k,
+                'name': v['name'],
+                'job_state': 'CANCELLED' if k in self.server.cancelled else 'RUNNING',
+                'partition': v.get('partition'),
+            } for k, v in self.server.jobs.items()]
+        })
+
+    def do_DELETE(self):
+        self.server.clients.add(self.client_address)
+        self.server.cancelled.add(int(self.path.rsplit('/', 1)[-1]))
+        self._reply(200, {'errors': []})
+
+
+@pytest.fixture
+def rest_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSlurmRestd)
+    server.jobs = {}
+    server.cancelled = set()
+    server.clients = set()
+    server.posts = 0
+    server.drop_posts = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_rest_transport(pbs_engine, task_factory, rest_server, sos_home):
+    engine = pbs_engine(
+        transport='rest',
+        scheduler='slurm',
+        rest_url=f'http://127.0.0.1:{rest_server.server_port}',
+        queue='short')
+    assert isinstance(engine.transport, RESTTransport)
+    tasks = [task_factory(f't{i}00000000000000') for i in range(1, 6)]
+    assert engine.execute_tasks(tasks)
+    # job ids are recorded as for jobs submitted by sbatch
+    assert engine._get_job_id(tasks[0]) == {'job_id': '1000'}
+    assert engine._get_job_id(tasks[4]) == {'job_id': '1004'}
+    assert rest_server.jobs[1000]['name'] == tasks[0]
+    assert f'sos execute {tasks[0]} ' in rest_server.jobs[1000]['script']
+    assert rest_server.jobs[1000]['partition'] == 'short'
+    assert rest_server.jobs[1000]['current_working_directory'] == str(sos_home)
+    assert rest_server.jobs[1000]['environment'] == [
+        f'HOME={sos_home}', 'PATH=/bin:/usr/bin:/usr/local/bin'
+    ]
+    # the script is sent with the job, and no command is run on or job file
+    # sent to the host
+    assert not engine.agent.commands
+    assert not engine.agent.sent_files
+    #
+    engine.transport.cancel([{'task': tasks[1], 'job_id': '1001'}])
+    jobs = engine.transport.job_table()
+    assert jobs['1000'].state == 'running'
+    assert jobs['1001'].state == 'cancelled'
+    # all requests share one keep-alive connection
+    assert len(rest_server.clients) == 1
+
+
+def test_rest_submit_not_retried(pbs_engine, task_factory, rest_server):
+    engine = pbs_engine(
+        transport='rest',
+        rest_url=f'http://127.0.0.1:{rest_server.server_port}',
+        rest_environment={'PATH': '/opt/sos/bin:/bin'})
+    task_factory('t1000000000000000')
+    rest_server.drop_posts = 1
+    with pytest.raises(RuntimeError, match='Failed to submit'):
+        engine._prepare_script('t1000000000000000')
+    # a submission that might have reached the server is not sent again
+    assert rest_server.posts == 1
+    assert engine._prepare_script('t1000000000000000')
+    assert rest_server.jobs[1000]['environment'] == ['PATH=/opt/sos/bin:/bin']
+
+
+def test_rest_job_table(pbs_engine, rest_server):
+    # the job table of slurmrestd is shared without a scheduler or parser
+    engine = pbs_engine(
+        transport='rest', rest_url=f'http://127.0.0.1:{rest_server.server_port}')
+    assert engine._status_cache.fetch() == {}
+    # and by the parser of the queue if specified
+    assert engine.transport.job_table(None, json.loads) == {'jobs': []}
+
+
+def test_rest_errors(pbs_engine, task_factory, rest_server):
+    engine = pbs_engine(
+        transport='rest',
+        rest_url=f'http://127.0.0.1:{rest_server.server_port}',
+        task_template='no shebang')
+    task_factory('t1000000000000000')
+    with pytest.raises(RuntimeError, match='bad script'):
+        engine._prepare_script('t1000000000000000')
+    with pytest.raises(ValueError, match='rest_url'):
+        pbs_engine(transport='rest')
+    with pytest.raises(ValueError, match='not supported by the REST transport'):
+        pbs_engine(
+            transport='rest',
+            scheduler='pbspro',
+            rest_url=f'http://127.0.0.1:{rest_server.server_port}')
+    with pytest.raises(ValueError, match='Unsupported transport'):
+        pbs_engine(transport='carrier pigeon')
+
+
+def test_shell_transport(pbs_engine, task_factory):
+    engine = pbs_engine(lambda cmd: 'Job 12.server submitted',
+                        submit_cmd_output='Job {job_id} submitted')
+    assert isinstance(engine.transport, ShellTransport)
+    task_factory('t1000000000000000')
+    assert engine.execute_tasks(['t1000000000000000'])
+    assert engine._get_job_id('t1000000000000000') == {'job_id': '12.server'}
+    assert engine.agent.commands == ['qsub ~/.sos/tasks/t1000000000000000.sh']